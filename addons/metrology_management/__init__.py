@@ -1,4 +1,6 @@
 from . import models
+from . import wizards
+from . import controllers
 try:
 	# optional packages: import if present
 	from . import reports
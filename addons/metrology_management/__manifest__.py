@@ -1,6 +1,6 @@
 {
     'name': 'Sistema de Controle Metrológico',
-    'version': '1.0.0',
+    'version': '1.1.0',
     'category': 'Quality/Metrology',
     'summary': 'Sistema de gestão metrológica aderente à ISO 10012',
     'description': """
@@ -33,6 +33,8 @@
     'data/sequence_data.xml',
     'data/cron.xml',
     'data/mail_activity.xml',
+    'data/regra_decisao_data.xml',
+    'data/resumo_alertas_template.xml',
     # Assignments
     'data/assign_admin_technician.xml',
         
@@ -45,6 +47,17 @@
         'views/equipment_views.xml',
         'views/calibracao_views.xml',
         'views/dashboard_views.xml',
+        'views/calibracao_import_views.xml',
+        'views/historico_exportacao_views.xml',
+        'views/reintervalo_views.xml',
+        'views/planejamento_views.xml',
+        'views/deriva_views.xml',
+        'views/incerteza_views.xml',
+        'views/padrao_views.xml',
+        'views/regra_decisao_views.xml',
+        'views/status_evento_views.xml',
+        'views/calibracao_arquivo_views.xml',
+        'views/alerta_fila_views.xml',
         'views/menu.xml',  # Carregar menus por último
     ],
     'demo': [
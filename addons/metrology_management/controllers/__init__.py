@@ -0,0 +1,2 @@
+from . import certificado
+from . import api
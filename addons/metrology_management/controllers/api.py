@@ -0,0 +1,189 @@
+import hashlib
+import json
+
+from werkzeug.http import parse_date, http_date
+
+from odoo import fields, http
+from odoo.http import request
+from odoo.tools import SQL
+
+API_LIMITE_PADRAO = 200
+API_LIMITE_MAXIMO = 5000
+
+# Projeções compactas: nenhum campo de mail.thread nem binários
+CAMPOS_EQUIPAMENTO = [
+    'tag', 'nome', 'codigo', 'tipo', 'status_metrologico', 'ultima_calibracao', 'proxima_calibracao',
+    'frequencia_calibracao', 'centro_custo', 'active', 'write_date',
+]
+CAMPOS_CALIBRACAO = [
+    'name', 'equipamento_id', 'data_calibracao', 'data_validade', 'resultado', 'state',
+    'erro_encontrado', 'incerteza_expandida', 'numero_certificado', 'write_date',
+]
+
+
+def _serializar(registro, campos):
+    """Converte o registro já carregado em um dicionário JSON compacto"""
+    dados = {'id': registro.id}
+    for nome in campos:
+        campo = registro._fields[nome]
+        valor = registro[nome]
+        if campo.type == 'many2one':
+            valor = valor.id or None
+        elif campo.type == 'datetime':
+            valor = fields.Datetime.to_string(valor) if valor else None
+        elif campo.type == 'date':
+            valor = fields.Date.to_string(valor) if valor else None
+        elif valor is False and campo.type not in ('boolean', 'integer', 'float'):
+            valor = None
+        dados[nome] = valor
+    return dados
+
+
+def _inteiro(valor, padrao, minimo=0, maximo=None):
+    if valor in (None, ''):
+        return padrao
+    valor = int(valor)
+    if valor < minimo:
+        raise ValueError(valor)
+    return min(valor, maximo) if maximo else valor
+
+
+class MetrologyApiController(http.Controller):
+
+    def _erro(self, mensagem, status=400):
+        return request.make_json_response({'erro': mensagem}, status=status)
+
+    def _validadores(self, registros):
+        """Retorna (ETag, Last-Modified) da página a partir dos ids e datas de alteração"""
+        assinatura = ','.join('%s:%s' % (r.id, r.write_date) for r in registros)
+        etag = '"%s"' % hashlib.sha1(assinatura.encode()).hexdigest()
+        ultima = max(registros.mapped('write_date')) if registros else None
+        return etag, ultima
+
+    def _nao_modificado(self, etag, ultima):
+        cabecalhos = request.httprequest.headers
+        if_none_match = cabecalhos.get('If-None-Match')
+        if if_none_match:
+            return etag in [valor.strip() for valor in if_none_match.split(',')] or if_none_match.strip() == '*'
+        if_modified_since = parse_date(cabecalhos.get('If-Modified-Since'))
+        if if_modified_since and ultima:
+            # HTTP-date tem resolução de segundos
+            return ultima.replace(microsecond=0) <= if_modified_since.replace(tzinfo=None)
+        return False
+
+    def _pagina(self, modelo, dominio, campos, cursor, limite):
+        """Página por chave (id > cursor), sem OFFSET"""
+        Model = request.env[modelo]
+        Model.check_access_rights('read')
+        registros = Model.search_fetch(dominio + [('id', '>', cursor)], campos, limit=limite, order='id')
+        etag, ultima = self._validadores(registros)
+        cabecalhos = [('ETag', etag), ('Cache-Control', 'private, no-cache')]
+        if ultima:
+            cabecalhos.append(('Last-Modified', http_date(ultima)))
+        if self._nao_modificado(etag, ultima):
+            return request.make_response(b'', headers=cabecalhos, status=304)
+        proximo = registros[-1].id if len(registros) == limite else None
+        return request.make_json_response({
+            'itens': [_serializar(r, campos) for r in registros],
+            'proximo_cursor': proximo,
+        }, headers=cabecalhos)
+
+    @http.route('/metrology/api/v1/equipamentos', type='http', auth='user', methods=['GET'])
+    def listar_equipamentos(self, cursor=None, limite=None, status=None, **kwargs):
+        """Lista equipamentos em ordem de id; use proximo_cursor para a página seguinte"""
+        try:
+            cursor = _inteiro(cursor, 0)
+            limite = _inteiro(limite, API_LIMITE_PADRAO, 1, API_LIMITE_MAXIMO)
+        except ValueError:
+            return self._erro('Parâmetros cursor/limite inválidos.')
+        dominio = [('status_metrologico', '=', status)] if status else []
+        return self._pagina('metrology.equipamento', dominio, CAMPOS_EQUIPAMENTO, cursor, limite)
+
+    @http.route('/metrology/api/v1/calibracoes', type='http', auth='user', methods=['GET'])
+    def listar_calibracoes(self, cursor=None, limite=None, equipamento_id=None, **kwargs):
+        """Lista o histórico de calibrações, opcionalmente de um único equipamento"""
+        try:
+            cursor = _inteiro(cursor, 0)
+            limite = _inteiro(limite, API_LIMITE_PADRAO, 1, API_LIMITE_MAXIMO)
+            equipamento_id = _inteiro(equipamento_id, None, 1)
+        except ValueError:
+            return self._erro('Parâmetros cursor/limite/equipamento_id inválidos.')
+        dominio = [('equipamento_id', '=', equipamento_id)] if equipamento_id else []
+        return self._pagina('metrology.calibracao', dominio, CAMPOS_CALIBRACAO, cursor, limite)
+
+    @http.route('/metrology/api/v1/alteracoes', type='http', auth='user', methods=['GET'])
+    def alteracoes(self, modelo='equipamento', desde=None, limite=None, **kwargs):
+        """Feed incremental em NDJSON ordenado por (transação, id).
+
+        O cursor é opaco ("<transação>,<id>"); a última linha da resposta traz o cursor a
+        ser enviado na próxima chamada. Só são entregues alterações de transações abaixo
+        do xmin do snapshot, de modo que nenhuma confirmação tardia fica para trás do cursor.
+        """
+        modelos = {
+            'equipamento': ('metrology.equipamento', CAMPOS_EQUIPAMENTO),
+            'calibracao': ('metrology.calibracao', CAMPOS_CALIBRACAO),
+        }
+        if modelo not in modelos:
+            return self._erro('Modelo inválido: use equipamento ou calibracao.')
+        nome_modelo, campos = modelos[modelo]
+        try:
+            limite = _inteiro(limite, API_LIMITE_PADRAO, 1, API_LIMITE_MAXIMO)
+            if desde:
+                transacao, registro_id = desde.split(',', 1)
+                desde = (int(transacao), int(registro_id))
+        except ValueError:
+            return self._erro('Cursor inválido.')
+
+        Model = request.env[nome_modelo].with_context(active_test=False)  # arquivamentos também são alterações
+        Model.check_access_rights('read')
+        tabela = Model._table
+        transacao = SQL.identifier(tabela, 'transacao')
+        coluna_id = SQL.identifier(tabela, 'id')
+        # Coluna mantida por gatilho (criar_coluna_transacao); comparação por linha no índice (transacao, id)
+        query = Model._search([])
+        query.add_where(SQL('%s < txid_snapshot_xmin(txid_current_snapshot())', transacao))
+        if desde:
+            query.add_where(SQL('(%s, %s) > (%s, %s)', transacao, coluna_id, desde[0], desde[1]))
+        query.order = SQL('%s, %s', transacao, coluna_id)
+        query.limit = limite
+        request.env.cr.execute(query.select(coluna_id, transacao))
+        linhas_cursor = request.env.cr.fetchall()
+        registros = Model.browse([row[0] for row in linhas_cursor])
+        registros.fetch(campos)
+
+        etag, ultima = self._validadores(registros)
+        cabecalhos = [('Content-Type', 'application/x-ndjson; charset=utf-8'), ('ETag', etag)]
+        if self._nao_modificado(etag, ultima):
+            return request.make_response(b'', headers=cabecalhos, status=304)
+        proximo = '%s,%s' % desde if desde else None
+        if linhas_cursor:
+            proximo = '%s,%s' % (linhas_cursor[-1][1], linhas_cursor[-1][0])
+        fim = len(registros) < limite
+
+        def gerar():
+            # Os valores já estão no cache (fetch acima): o gerador não consulta o banco,
+            # cuja conexão é devolvida antes da transmissão da resposta
+            for registro in registros:
+                yield (json.dumps(_serializar(registro, campos), ensure_ascii=False) + '\n').encode()
+            yield (json.dumps({'cursor': proximo, 'fim': fim}) + '\n').encode()
+
+        return request.make_response(gerar(), headers=cabecalhos)
+
+    @http.route('/metrology/api/v1/eventos', type='http', auth='user', methods=['GET'])
+    def eventos(self, cursor=None, limite=None, somente_status=None, **kwargs):
+        """Consome o registro de transições do status metrológico a partir do cursor.
+
+        O cursor é opaco ("<transação>,<id>"); sem cursor a leitura começa pelo evento
+        mais antigo retido. Repita a chamada com proximo_cursor até fim = true.
+        """
+        Evento = request.env['metrology.status.evento']
+        try:
+            limite = _inteiro(limite, API_LIMITE_PADRAO, 1, API_LIMITE_MAXIMO)
+            eventos, proximo, fim = Evento._ler(cursor, limite, somente_status in ('1', 'true'))
+        except ValueError:
+            return self._erro('Parâmetros cursor/limite inválidos.')
+        return request.make_json_response({
+            'itens': eventos._exportar(),
+            'proximo_cursor': proximo,
+            'fim': fim,
+        }, headers=[('Cache-Control', 'no-store')])
@@ -0,0 +1,17 @@
+from odoo import http
+from odoo.http import request
+
+
+class CertificadoController(http.Controller):
+
+    @http.route('/metrology/certificado/<int:calibracao_id>', type='http', auth='user')
+    def baixar_certificado(self, calibracao_id, download='1'):
+        """Envia o certificado a partir do filestore, com suporte a requisições Range/condicionais"""
+        calibracao = request.env['metrology.calibracao'].browse(calibracao_id).exists()
+        if not calibracao:
+            raise request.not_found()
+        calibracao.check_access_rights('read')
+        calibracao.check_access_rule('read')
+        stream = request.env['ir.binary']._get_stream_from(
+            calibracao, 'certificado_file', filename_field='certificado_filename')
+        return stream.get_response(as_attachment=download not in ('0', 'false'))
@@ -0,0 +1,73 @@
+import logging
+
+from odoo import api, SUPERUSER_ID
+from odoo.tools import column_exists
+
+_logger = logging.getLogger(__name__)
+
+# Tabelas gravadas em SQL cujas linhas anteriores à separação por empresa herdam a do equipamento
+TABELAS_EMPRESA_EQUIPAMENTO = ('metrology_status_evento', 'metrology_deriva', 'metrology_alerta_fila')
+# Certificados convertidos em anexos por lote (limita a memória usada pela migração)
+CERTIFICADO_MIGRACAO_BATCH_SIZE = 100
+
+
+def _preencher_empresas(cr):
+    """Preenche a empresa das linhas existentes a partir do equipamento.
+
+    Sem a empresa, as regras multiempresa ocultariam essas linhas: eventos deixariam de
+    ser entregues e alertas enfileirados nunca sairiam da fila.
+    """
+    for tabela in TABELAS_EMPRESA_EQUIPAMENTO:
+        cr.execute("""
+            UPDATE {tabela} t
+               SET company_id = e.company_id
+              FROM metrology_equipamento e
+             WHERE e.id = t.equipamento_id
+               AND t.company_id IS NULL
+        """.format(tabela=tabela))
+        _logger.info('%s: empresa preenchida em %s linhas', tabela, cr.rowcount)
+
+
+def _migrar_certificados(env):
+    """Move para o filestore os certificados gravados na coluna de metrology_calibracao.
+
+    Até a versão 1.0.0 o certificado era um Binary sem attachment=True; o Odoo não
+    converte a coluna existente ao mudar o campo. Ao final a coluna é removida.
+    """
+    cr = env.cr
+    if not column_exists(cr, 'metrology_calibracao', 'certificado_file'):
+        return
+    migrados = 0
+    while True:
+        cr.execute("""
+            SELECT id, certificado_file
+              FROM metrology_calibracao
+             WHERE certificado_file IS NOT NULL
+          ORDER BY id
+             LIMIT %s
+        """, [CERTIFICADO_MIGRACAO_BATCH_SIZE])
+        rows = cr.fetchall()
+        if not rows:
+            break
+        # Colunas binárias antigas guardam o conteúdo já codificado em base64
+        env['ir.attachment'].create([{
+            'name': 'certificado_file',
+            'res_model': 'metrology.calibracao',
+            'res_field': 'certificado_file',
+            'res_id': calibracao_id,
+            'type': 'binary',
+            'datas': bytes(conteudo),
+        } for calibracao_id, conteudo in rows])
+        cr.execute("UPDATE metrology_calibracao SET certificado_file = NULL WHERE id = ANY(%s)",
+                   [[row[0] for row in rows]])
+        migrados += len(rows)
+        env.invalidate_all()
+    cr.execute('ALTER TABLE metrology_calibracao DROP COLUMN certificado_file')
+    _logger.info('%s certificados migrados para o filestore', migrados)
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    _preencher_empresas(cr)
+    _migrar_certificados(api.Environment(cr, SUPERUSER_ID, {}))
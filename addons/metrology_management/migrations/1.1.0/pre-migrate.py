@@ -0,0 +1,23 @@
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Preserva os resultados existentes como informados manualmente.
+
+    Até a versão 1.0.0 o resultado era obrigatório e digitado pelo usuário; sem esta
+    marcação a regra de decisão passaria a reescrever os certificados históricos. A
+    coluna é criada aqui, antes da atualização do módulo, para que nenhuma gravação
+    de regra (dados XML) reavalie o histórico antes da marcação.
+    """
+    if not version:
+        return
+    cr.execute("ALTER TABLE metrology_calibracao ADD COLUMN IF NOT EXISTS resultado_manual boolean")
+    cr.execute("""
+        UPDATE metrology_calibracao
+           SET resultado_manual = TRUE
+         WHERE resultado IS NOT NULL
+           AND resultado_manual IS NOT TRUE
+    """)
+    _logger.info('%s calibrações marcadas com resultado informado manualmente', cr.rowcount)
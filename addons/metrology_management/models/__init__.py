@@ -3,4 +3,17 @@ from . import calibracao
 from . import padrao_medicao
 from . import calibracoes_alert
 from . import dashboard
-from . import misc_models
\ No newline at end of file
+from . import dashboard_kpi
+from . import misc_models
+from . import historico_exportacao
+from . import planejamento
+from . import deriva
+from . import incerteza
+from . import regra_decisao
+from . import status_evento
+from . import gerador_frota
+from . import ir_sequence
+from . import calibracao_arquivo
+from . import alerta_fila
+from . import res_users
+from . import res_company
\ No newline at end of file
@@ -0,0 +1,164 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Resumos (destinatários) gerados por execução do agendador; o restante fica para a próxima
+RESUMO_LIMITE_PADRAO = 100
+
+CAMPOS_RESUMO_EQUIPAMENTO = [
+    'tag', 'nome', 'codigo', 'centro_custo', 'proxima_calibracao', 'status_metrologico',
+]
+
+
+class AlertaFila(models.Model):
+    _name = 'metrology.alerta.fila'
+    _description = 'Fila de Alertas para Resumo'
+    _order = 'id'
+    _log_access = False
+
+    usuario_id = fields.Many2one('res.users', string='Destinatário', required=True, readonly=True,
+                                 ondelete='cascade', index=True)
+    equipamento_id = fields.Many2one('metrology.equipamento', string='Equipamento', required=True,
+                                     readonly=True, ondelete='cascade')
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True, index=True)
+    tipo = fields.Selection([
+        ('vencido', 'Calibração Vencida'),
+        ('proximo', 'Vencimento Próximo'),
+    ], string='Tipo', required=True, readonly=True)
+    data_alerta = fields.Date(string='Data do Alerta', readonly=True)
+    # Identifica a execução do agendador de alertas que ainda está enfileirando (retido até _liberar)
+    execucao = fields.Char(string='Execução em Andamento', readonly=True, index=True)
+
+    @api.model
+    def _enfileirar(self, equipamento_ids, tipo):
+        """Registra os alertas dos equipamentos para o resumo do responsável técnico.
+
+        Equipamentos sem responsável são endereçados ao usuário que executa o agendador,
+        como nas atividades de alerta. Dentro de uma execução do agendador de alertas
+        (contexto metrology_alerta_execucao) os registros ficam retidos até _liberar.
+        """
+        if not equipamento_ids:
+            return
+        execucao = self.env.context.get('metrology_alerta_execucao')
+        self.env['metrology.equipamento'].flush_model(['responsavel_id', 'company_id'])
+        self.env.cr.execute("""
+            INSERT INTO metrology_alerta_fila (usuario_id, equipamento_id, company_id, tipo, data_alerta, execucao)
+            SELECT COALESCE(e.responsavel_id, %(uid)s), e.id, e.company_id, %(tipo)s, %(hoje)s, %(execucao)s
+              FROM metrology_equipamento e
+             WHERE e.id = ANY(%(ids)s)
+        """, {'uid': self.env.uid, 'tipo': tipo, 'hoje': fields.Date.context_today(self),
+              'execucao': execucao, 'ids': list(equipamento_ids)})
+        if not execucao:
+            # Destinatários com preferência imediata não esperam a próxima execução agendada
+            self.env.ref('metrology_management.ir_cron_resumo_alertas')._trigger()
+
+    @api.model
+    def _liberar(self, execucao):
+        """Libera para os resumos os alertas enfileirados pela execução informada"""
+        self.env.cr.execute("UPDATE metrology_alerta_fila SET execucao = NULL WHERE execucao = %s", [execucao])
+        if self.env.cr.rowcount:
+            self.invalidate_model(['execucao'])
+            self.env.ref('metrology_management.ir_cron_resumo_alertas')._trigger()
+
+    @api.model
+    def _limite_por_execucao(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.resumo_limite_envios', RESUMO_LIMITE_PADRAO)
+        try:
+            return max(int(valor), 1)
+        except (TypeError, ValueError):
+            return RESUMO_LIMITE_PADRAO
+
+    @api.model
+    def _usuarios_pendentes(self, limite):
+        """Destinatários com alertas na fila cujo período de resumo (preferência) já venceu.
+
+        Destinatários com alertas de hoje ainda retidos por uma execução em andamento
+        esperam o fim dela; retenções de dias anteriores (execução interrompida) não contam.
+        """
+        self.flush_model()
+        self.env['res.users'].flush_model(['metrology_resumo_frequencia', 'metrology_resumo_ultimo_envio'])
+        hoje = fields.Date.context_today(self)
+        inicio_dia = datetime.combine(hoje, time.min)
+        self.env.cr.execute("""
+            SELECT f.usuario_id
+              FROM metrology_alerta_fila f
+              JOIN res_users u ON u.id = f.usuario_id
+             WHERE (u.metrology_resumo_ultimo_envio IS NULL
+                    OR u.metrology_resumo_frequencia = 'imediato'
+                    OR (COALESCE(u.metrology_resumo_frequencia, 'diario') = 'diario'
+                        AND u.metrology_resumo_ultimo_envio < %(dia)s)
+                    OR (u.metrology_resumo_frequencia = 'semanal'
+                        AND u.metrology_resumo_ultimo_envio < %(semana)s))
+               AND NOT EXISTS (SELECT 1
+                                 FROM metrology_alerta_fila r
+                                WHERE r.usuario_id = f.usuario_id
+                                  AND r.execucao IS NOT NULL
+                                  AND r.data_alerta >= %(hoje)s)
+          GROUP BY f.usuario_id
+          ORDER BY min(f.id)
+             LIMIT %(limite)s
+        """, {'dia': inicio_dia, 'semana': inicio_dia - timedelta(days=6), 'hoje': hoje, 'limite': limite})
+        return self.env['res.users'].browse(row[0] for row in self.env.cr.fetchall())
+
+    @api.model
+    def _enviar_resumos(self):
+        """Gera um e-mail de resumo por destinatário e esvazia a fila correspondente.
+
+        Executado pelo agendador. Cada resumo é renderizado uma única vez e entregue à
+        fila de saída (mail.mail), que faz o envio assíncrono em lotes. O número de
+        resumos por execução é limitado por metrology_management.resumo_limite_envios.
+        """
+        limite = self._limite_por_execucao()
+        usuarios = self._usuarios_pendentes(limite)
+        if not usuarios:
+            return 0
+        fila = self.search_fetch([('usuario_id', 'in', usuarios.ids)], ['usuario_id', 'equipamento_id', 'tipo'])
+        fila.equipamento_id.fetch(CAMPOS_RESUMO_EQUIPAMENTO)
+        usuarios.fetch(['name', 'lang', 'partner_id', 'email'])
+
+        por_usuario = defaultdict(lambda: {'vencido': [], 'proximo': []})
+        for alerta in fila:
+            equipamento = alerta.equipamento_id
+            # Calibrados depois de enfileirados não precisam mais de aviso
+            if alerta.tipo == 'vencido' and equipamento.status_metrologico != 'vencido':
+                continue
+            equipamentos = por_usuario[alerta.usuario_id][alerta.tipo]
+            if equipamento not in equipamentos:
+                equipamentos.append(equipamento)
+
+        email_from = self.env.company.email_formatted or self.env.user.email_formatted
+        QWeb = self.env['ir.qweb']
+        vals_list = []
+        for usuario in usuarios:
+            alertas = por_usuario.get(usuario)
+            if not alertas or not (alertas['vencido'] or alertas['proximo']):
+                continue
+            if not usuario.email:
+                _logger.warning('Resumo de alertas descartado: usuário %s sem e-mail', usuario.login)
+                continue
+            corpo = QWeb.with_context(lang=usuario.lang)._render('metrology_management.resumo_alertas_email', {
+                'usuario': usuario,
+                'vencidos': alertas['vencido'],
+                'proximos': alertas['proximo'],
+                'data': fields.Date.context_today(self),
+            })
+            vals_list.append({
+                'subject': 'Resumo de alertas de calibração: %d vencidas, %d próximas do vencimento' % (
+                    len(alertas['vencido']), len(alertas['proximo'])),
+                'body_html': corpo,
+                'email_from': email_from,
+                'recipient_ids': [(4, usuario.partner_id.id)],
+                'auto_delete': True,
+            })
+        self.env['mail.mail'].sudo().create(vals_list)
+        usuarios.sudo().write({'metrology_resumo_ultimo_envio': fields.Datetime.now()})
+        fila.unlink()
+        _logger.info('Resumos de alertas: %s e-mails para %s destinatários', len(vals_list), len(usuarios))
+        if len(usuarios) == limite:
+            _logger.info('Limite de resumos por execução atingido; os demais seguem na próxima execução')
+        return len(vals_list)
@@ -1,7 +1,26 @@
+import logging
+
 from odoo import models, fields, api
-from odoo.exceptions import ValidationError
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import split_every
 from dateutil.relativedelta import relativedelta
 
+from ..tools.perfil import perfilar
+from .equipamento import criar_coluna_transacao, criar_gatilho_write_date
+from .regra_decisao import avaliar_regra
+
+_logger = logging.getLogger(__name__)
+
+# Campos que alteram a projeção do planejamento de calibrações
+CAMPOS_PLANEJAMENTO = {'state', 'data_calibracao', 'equipamento_id', 'executor_id', 'local_ensaio_id'}
+# Condições ambientais usadas pelas componentes do orçamento de incerteza
+CAMPOS_AMBIENTAIS = {'temperatura', 'umidade', 'pressao'}
+# Campos que alteram a rastreabilidade da calibração ou a calibração vigente do equipamento
+CAMPOS_RASTREABILIDADE = {'padrao_id', 'state', 'equipamento_id', 'data_calibracao'}
+# Campos que alteram o resultado calculado pela regra de decisão
+CAMPOS_DECISAO = {'erro_encontrado', 'incerteza_expandida', 'fator_abrangencia', 'equipamento_id', 'resultado_manual'}
+DECISAO_BATCH_SIZE = 5000
+
 class Calibracao(models.Model):
     _name = 'metrology.calibracao'
     _description = 'Registro de Calibração'
@@ -9,12 +28,15 @@ class Calibracao(models.Model):
     _order = 'data_calibracao desc'
 
     name = fields.Char(string='Número', required=True, copy=False, readonly=True,
-                       default=lambda self: self.env['ir.sequence'].next_by_code('metrology.calibracao'))
+                       default='Novo', help='Atribuído pela sequência ao salvar.')
     
     # Identificação
     equipamento_id = fields.Many2one('metrology.equipamento', string='Equipamento', 
                                       required=True, ondelete='restrict', tracking=True)
-    data_calibracao = fields.Date(string='Data da Calibração', required=True, 
+    # Pré-calculado para que o INSERT já leve a empresa (contadores do dashboard por empresa)
+    company_id = fields.Many2one(related='equipamento_id.company_id', string='Empresa', store=True, index=True,
+                                 precompute=True)
+    data_calibracao = fields.Date(string='Data da Calibração', required=True, index=True,
                                    default=fields.Date.today, tracking=True)
     data_validade = fields.Date(string='Data de Validade', compute='_compute_data_validade', 
                                  store=True, tracking=True)
@@ -27,7 +49,8 @@ class Calibracao(models.Model):
     ], string='Tipo de Comprovação', required=True, default='calibracao', tracking=True)
     
     # Local e Executor
-    local_ensaio_id = fields.Many2one('metrology.local_ensaios', string='Local do Ensaio')
+    local_ensaio_id = fields.Many2one('metrology.local_ensaios', string='Local do Ensaio',
+                                      domain="['|', ('company_id', '=', False), ('company_id', '=', company_id)]")
     executor_id = fields.Many2one('metrology.parte_interessada', string='Executor',
                                    domain=[('tipo', '=', 'laboratorio')])
     tecnico_responsavel = fields.Char(string='Técnico Responsável')
@@ -36,6 +59,8 @@ class Calibracao(models.Model):
     padrao_id = fields.Many2one('metrology.padrao_medicao', string='Padrão de Medição Utilizado')
     rastreabilidade = fields.Char(string='Rastreabilidade', 
                                    related='padrao_id.rastreabilidade', readonly=True)
+    rastreabilidade_suspeita = fields.Boolean(string='Rastreabilidade Suspeita', readonly=True, copy=False,
+                                              help='Executada com um padrão cuja cadeia de rastreabilidade está sob suspeita.')
     
     # Condições Ambientais
     temperatura = fields.Float(string='Temperatura (°C)')
@@ -47,16 +72,30 @@ class Calibracao(models.Model):
         ('conforme', 'Conforme'),
         ('nao_conforme', 'Não Conforme'),
         ('condicional', 'Condicional'),
-    ], string='Resultado da Calibração', required=True, tracking=True)
+    ], string='Resultado da Calibração', tracking=True,
+        help='Calculado pela regra de decisão do equipamento, a menos que seja informado manualmente.')
+    resultado_manual = fields.Boolean(string='Resultado Informado Manualmente', copy=False,
+                                      help='Quando marcado, a regra de decisão não altera o resultado.')
+    probabilidade_falsa_aceitacao = fields.Float(string='Probabilidade de Falsa Aceitação', readonly=True,
+                                                 digits=(16, 6))
     
-    incerteza_expandida = fields.Float(string='Incerteza Expandida (k=2)')
+    incerteza_expandida = fields.Float(string='Incerteza Expandida (U)',
+                                       help='Informada ou calculada pelo orçamento de incerteza.')
+    fator_abrangencia = fields.Float(string='Fator de Abrangência (k)', default=2.0)
+    orcamento_incerteza_ids = fields.One2many('metrology.incerteza.orcamento', 'calibracao_id',
+                                              string='Orçamento de Incerteza')
     erro_encontrado = fields.Float(string='Erro Encontrado')
     ajuste_realizado = fields.Boolean(string='Ajuste Realizado', tracking=True)
     
     # Certificado
     numero_certificado = fields.Char(string='Número do Certificado')
-    certificado_file = fields.Binary(string='Arquivo do Certificado')
+    # Armazenado como anexo no filestore (endereçado pelo checksum, sem duplicar conteúdo)
+    # e nunca carregado junto com os demais campos da calibração
+    certificado_file = fields.Binary(string='Arquivo do Certificado', attachment=True, prefetch=False)
     certificado_filename = fields.Char(string='Nome do Arquivo')
+    certificado_tamanho = fields.Integer(string='Tamanho do Certificado (bytes)', compute='_compute_certificado_metadados')
+    certificado_checksum = fields.Char(string='Checksum do Certificado', compute='_compute_certificado_metadados')
+    certificado_mimetype = fields.Char(string='Tipo do Certificado', compute='_compute_certificado_metadados')
     
     # Observações
     observacoes = fields.Text(string='Observações')
@@ -70,6 +109,17 @@ class Calibracao(models.Model):
         ('cancelado', 'Cancelado'),
     ], string='Status', default='rascunho', tracking=True)
     
+    def init(self):
+        # Atende a busca da última calibração aprovada por equipamento sem ler o histórico inteiro
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS metrology_calibracao_equipamento_state_data_idx
+                ON metrology_calibracao (equipamento_id, state, data_calibracao DESC)
+        """)
+        # Paginação por chave do feed de alterações da API
+        criar_coluna_transacao(self.env.cr, 'metrology_calibracao')
+        criar_gatilho_write_date(self.env.cr, 'metrology_calibracao',
+                                 ['data_validade', 'resultado', 'incerteza_expandida'])
+
     @api.depends('data_calibracao', 'equipamento_id.frequencia_calibracao')
     def _compute_data_validade(self):
         """Calcula a data de validade com base na data de calibração e frequência do equipamento"""
@@ -80,6 +130,174 @@ class Calibracao(models.Model):
             else:
                 record.data_validade = False
     
+    @api.depends('certificado_file')
+    def _compute_certificado_metadados(self):
+        """Lê tamanho, checksum e tipo do anexo sem carregar o conteúdo do certificado"""
+        existentes = self.filtered(lambda c: isinstance(c.id, int))
+        metadados = {}
+        if existentes:
+            self.env['ir.attachment'].flush_model(['res_model', 'res_field', 'res_id'])
+            self.env.cr.execute("""
+                SELECT res_id, file_size, checksum, mimetype
+                  FROM ir_attachment
+                 WHERE res_model = %s
+                   AND res_field = 'certificado_file'
+                   AND res_id = ANY(%s)
+            """, [self._name, existentes.ids])
+            metadados = {row[0]: row[1:] for row in self.env.cr.fetchall()}
+        for record in self:
+            tamanho, checksum, mimetype = metadados.get(record.id, (0, False, False))
+            record.certificado_tamanho = tamanho
+            record.certificado_checksum = checksum
+            record.certificado_mimetype = mimetype
+
+    def action_baixar_certificado(self):
+        """Abre o download do certificado pela rota com suporte a requisições parciais"""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/metrology/certificado/%s' % self.id,
+            'target': 'self',
+        }
+
+    @api.model_create_multi
+    @perfilar()
+    def create(self, vals_list):
+        # Números reservados em bloco: uma chamada à sequência por lote, e não por registro
+        sem_numero = [vals for vals in vals_list if vals.get('name', 'Novo') == 'Novo']
+        for vals, numero in zip(sem_numero, self.env['ir.sequence']._next_block_by_code(
+                'metrology.calibracao', len(sem_numero))):
+            vals['name'] = numero
+        for vals in vals_list:
+            # Resultado informado na criação (formulário ou importação) prevalece sobre a regra
+            if vals.get('resultado') and 'resultado_manual' not in vals:
+                vals['resultado_manual'] = True
+        Planejamento = self.env['metrology.planejamento.carga']
+        atualizar_planejamento = Planejamento._planejamento_calculado()
+        if atualizar_planejamento:
+            equipamento_ids = {vals['equipamento_id'] for vals in vals_list if vals.get('equipamento_id')}
+            antes = Planejamento._projetar(equipamento_ids)
+        calibracoes = super().create(vals_list)
+        calibracoes._avaliar_decisao(incluir_aprovadas=True)
+        calibracoes._sincronizar_suspeita()
+        if atualizar_planejamento:
+            Planejamento._atualizar_equipamentos(equipamento_ids, antes)
+        return calibracoes
+
+    def write(self, vals):
+        if 'resultado' in vals and 'resultado_manual' not in vals:
+            vals = dict(vals, resultado_manual=bool(vals['resultado']))
+        Planejamento = self.env['metrology.planejamento.carga']
+        equipamentos_anteriores = self.equipamento_id
+        if CAMPOS_PLANEJAMENTO.intersection(vals) and Planejamento._planejamento_calculado():
+            # Atualiza o planejamento apenas com a diferença dos equipamentos afetados
+            antes = Planejamento._projetar(equipamentos_anteriores.ids)
+            res = super().write(vals)
+            Planejamento._atualizar_equipamentos((equipamentos_anteriores | self.equipamento_id).ids, antes)
+        else:
+            res = super().write(vals)
+        if CAMPOS_AMBIENTAIS.intersection(vals):
+            self.orcamento_incerteza_ids.filtered(lambda o: o.metodo == 'gum')._avaliar()
+        if CAMPOS_DECISAO.intersection(vals):
+            self._avaliar_decisao()
+        if CAMPOS_RASTREABILIDADE.intersection(vals):
+            self._sincronizar_suspeita(equipamentos_anteriores)
+        return res
+
+    def _sincronizar_suspeita(self, equipamentos=None):
+        """Sinaliza estas calibrações e os equipamentos afetados conforme os padrões suspeitos"""
+        Padrao = self.env['metrology.padrao_medicao']
+        if not Padrao._ha_suspeitos():
+            return
+        equipamentos = (equipamentos or self.env['metrology.equipamento']) | self.equipamento_id
+        Padrao._sincronizar_suspeita(calibracao_ids=self.ids, equipamento_ids=equipamentos.ids)
+
+    def _avaliar_decisao(self, incluir_aprovadas=False):
+        """Aplica a regra de decisão em lote: uma leitura e uma atualização SQL por lote.
+
+        Calibrações com resultado manual ou cujo equipamento não tem EMA são ignoradas.
+        Calibrações aprovadas (certificados emitidos) só são avaliadas na criação, com
+        incluir_aprovadas; alterações posteriores de regra, EMA ou medições não as reescrevem.
+        Os status dos equipamentos cuja calibração vigente mudou são recalculados pelo ORM.
+        """
+        Regra = self.env['metrology.regra.decisao']
+        regra_padrao = Regra._regra_padrao()
+        self.flush_model(['equipamento_id', 'erro_encontrado', 'incerteza_expandida',
+                          'fator_abrangencia', 'resultado', 'resultado_manual'])
+        self.env['metrology.equipamento'].flush_model(['erro_maximo_admissivel', 'regra_decisao_id'])
+        Regra.flush_model(['tipo', 'fator_banda_guarda'])
+        regras = {}
+        for ids in split_every(DECISAO_BATCH_SIZE, [i for i in self.ids if isinstance(i, int)]):
+            self.env.cr.execute("""
+                SELECT c.id, c.erro_encontrado, c.incerteza_expandida, c.fator_abrangencia,
+                       e.erro_maximo_admissivel, r.tipo, r.fator_banda_guarda
+                  FROM metrology_calibracao c
+                  JOIN metrology_equipamento e ON e.id = c.equipamento_id
+                  JOIN metrology_regra_decisao r ON r.id = COALESCE(e.regra_decisao_id, %s)
+                 WHERE c.id = ANY(%s)
+                   AND c.resultado_manual IS NOT TRUE
+                   AND (%s OR c.state IS DISTINCT FROM 'aprovado')
+                   AND e.erro_maximo_admissivel > 0
+            """, [regra_padrao.id or None, list(ids), incluir_aprovadas])
+            avaliacoes = []
+            for calib_id, erro, incerteza, fator_k, ema, tipo, fator_w in self.env.cr.fetchall():
+                chave = (tipo, fator_w, ema, erro, incerteza, fator_k)
+                if chave not in regras:
+                    regras[chave] = avaliar_regra(tipo, fator_w or 0.0, ema, erro, incerteza, fator_k)
+                avaliacoes.append((calib_id,) + regras[chave])
+            if not avaliacoes:
+                continue
+            self.env.cr.execute("""
+                UPDATE metrology_calibracao c
+                   SET resultado = a.resultado,
+                       probabilidade_falsa_aceitacao = a.probabilidade
+                  FROM (SELECT id, resultado, round(probabilidade::numeric, 6) AS probabilidade
+                          FROM unnest(%s::int[], %s::varchar[], %s::float8[]) AS u(id, resultado, probabilidade)
+                       ) a
+                 WHERE c.id = a.id
+                   AND (c.resultado IS DISTINCT FROM a.resultado
+                        OR c.probabilidade_falsa_aceitacao IS DISTINCT FROM a.probabilidade)
+             RETURNING c.id
+            """, [list(coluna) for coluna in zip(*avaliacoes)])
+            alteradas = self.browse([row[0] for row in self.env.cr.fetchall()])
+            if alteradas:
+                alteradas.invalidate_recordset(['resultado', 'probabilidade_falsa_aceitacao'])
+                # Recalcula o status dos equipamentos cuja calibração vigente foi alterada
+                alteradas.modified(['resultado'])
+                self.env['metrology.equipamento'].flush_model(['status_metrologico'])
+
+    @api.model
+    def _avaliar_decisao_por_regras(self, regra_ids):
+        """Reavalia as calibrações em aberto dos equipamentos que usam as regras informadas"""
+        regra_padrao = self.env['metrology.regra.decisao']._regra_padrao()
+        self.env['metrology.equipamento'].flush_model(['regra_decisao_id'])
+        self.env.cr.execute("""
+            SELECT c.id
+              FROM metrology_calibracao c
+              JOIN metrology_equipamento e ON e.id = c.equipamento_id
+             WHERE COALESCE(e.regra_decisao_id, %s) = ANY(%s)
+               AND c.resultado_manual IS NOT TRUE
+               AND c.state IS DISTINCT FROM 'aprovado'
+          ORDER BY c.id
+        """, [regra_padrao.id or None, list(regra_ids)])
+        calibracoes = self.browse([row[0] for row in self.env.cr.fetchall()])
+        calibracoes._avaliar_decisao()
+        return calibracoes
+
+    def action_abrir_orcamento_incerteza(self):
+        """Abre o orçamento de incerteza da calibração, criando-o se necessário"""
+        self.ensure_one()
+        orcamento = self.orcamento_incerteza_ids[:1] or self.env['metrology.incerteza.orcamento'].create({
+            'calibracao_id': self.id,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'metrology.incerteza.orcamento',
+            'res_id': orcamento.id,
+            'view_mode': 'form',
+            'target': 'current',
+        }
+
     @api.constrains('data_calibracao', 'data_validade')
     def _check_dates(self):
         for record in self:
@@ -99,13 +317,69 @@ class Calibracao(models.Model):
         """Move o registro para o estado 'em_analise'"""
         self.write({'state': 'em_analise'})
 
+    @perfilar()
     def action_aprovar(self):
-        """Aprova o registro de calibração e atualiza o status do equipamento"""
-        self.ensure_one()
-        if not self.numero_certificado:
-            raise ValidationError('É necessário informar o número do certificado para aprovar a calibração.')
-        self.write({'state': 'aprovado'})
-        self.equipamento_id._compute_status_metrologico()
+        """Aprova as calibrações e atualiza as datas e o status dos equipamentos.
+
+        Os certificados de todo o lote são validados antes de qualquer gravação. Os
+        equipamentos afetados são travados em ordem de id, sem espera: calibrações de um
+        equipamento em aprovação por outra transação ficam pendentes e são informadas.
+        Cada equipamento é recalculado uma única vez, qualquer que seja o número de
+        calibrações dele no lote.
+        """
+        sem_certificado = self.filtered(lambda c: not c.numero_certificado)
+        if sem_certificado:
+            raise ValidationError('É necessário informar o número do certificado para aprovar a calibração.%s' % (
+                ' (%s)' % ', '.join(sem_certificado.mapped('name')) if len(self) > 1 else ''))
+        # Sem EMA a regra não calcula o resultado; aprovar sem ele deixaria o equipamento fora de uso
+        sem_resultado = self.filtered(lambda c: not c.resultado)
+        if sem_resultado:
+            raise ValidationError('É necessário informar o resultado da calibração (ou o EMA do equipamento) '
+                                  'para aprová-la.%s' % (
+                                      ' (%s)' % ', '.join(sem_resultado.mapped('name')) if len(self) > 1 else ''))
+        calibracoes = self.filtered(lambda c: c.state != 'aprovado')
+        equipamentos = calibracoes.equipamento_id
+        travados = self._travar_equipamentos(equipamentos)
+        pendentes = calibracoes.filtered(lambda c: c.equipamento_id not in travados)
+        if pendentes and len(self) == 1:
+            raise UserError('O equipamento %s está sendo atualizado por outro usuário. Tente novamente.'
+                            % self.equipamento_id.display_name)
+        (calibracoes - pendentes).write({'state': 'aprovado'})
+        # Recalcula enquanto as travas estão mantidas
+        travados.flush_recordset(['ultima_calibracao_id', 'ultima_calibracao', 'proxima_calibracao',
+                                  'status_metrologico'])
+        if pendentes:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {
+                    'type': 'warning',
+                    'sticky': True,
+                    'message': '%s calibrações aprovadas. %s aguardam outra aprovação em andamento: %s' % (
+                        len(calibracoes) - len(pendentes), len(pendentes), ', '.join(pendentes.mapped('name'))),
+                    'next': {'type': 'ir.actions.act_window_close'},
+                },
+            }
+        return True
+
+    def _travar_equipamentos(self, equipamentos):
+        """Trava as linhas dos equipamentos em ordem de id e retorna as obtidas.
+
+        Linhas travadas por outra transação são ignoradas (SKIP LOCKED) em vez de
+        aguardadas, o que evita esperas, impasses e falhas de serialização entre
+        aprovações concorrentes. NO KEY UPDATE não bloqueia a inclusão de calibrações
+        que referenciam o equipamento.
+        """
+        if not equipamentos:
+            return equipamentos
+        self.env.cr.execute("""
+            SELECT id
+              FROM metrology_equipamento
+             WHERE id = ANY(%s)
+          ORDER BY id
+               FOR NO KEY UPDATE SKIP LOCKED
+        """, [equipamentos.ids])
+        return equipamentos.browse(row[0] for row in self.env.cr.fetchall())
 
     def action_cancelar(self):
         """Cancela o registro de calibração"""
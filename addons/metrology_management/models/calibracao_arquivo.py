@@ -0,0 +1,213 @@
+import logging
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api
+from odoo.tools import html2plaintext
+
+_logger = logging.getLogger(__name__)
+
+ARQUIVO_BATCH_SIZE = 1000
+ARQUIVO_ANOS_PADRAO = 5
+# Tempo (segundos) que uma execução do agendador dedica aos lotes antes de se reagendar
+TEMPO_MAXIMO_ARQUIVAMENTO = 240
+
+# Colunas copiadas da tabela quente; as demais são descartadas no arquivamento
+COLUNAS_ARQUIVO = [
+    'name', 'equipamento_id', 'data_calibracao', 'data_validade', 'tipo_comprovacao', 'local_ensaio_id',
+    'executor_id', 'tecnico_responsavel', 'padrao_id', 'temperatura', 'umidade', 'pressao', 'resultado',
+    'resultado_manual', 'probabilidade_falsa_aceitacao', 'incerteza_expandida', 'fator_abrangencia',
+    'erro_encontrado', 'ajuste_realizado', 'numero_certificado', 'certificado_filename', 'observacoes',
+    'restricoes_uso', 'state', 'company_id', 'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+
+# Move um lote: calibrações canceladas ou substituídas (aprovadas que não são a vigente do
+# equipamento) anteriores ao corte, sem orçamento de incerteza. A exclusão e a inclusão
+# acontecem no mesmo comando; linhas em uso por outra transação ficam para o próximo lote.
+_MOVER_LOTE = """
+    WITH alvo AS (
+        SELECT c.id
+          FROM metrology_calibracao c
+          JOIN metrology_equipamento e ON e.id = c.equipamento_id
+         WHERE c.data_calibracao < %(corte)s
+           AND (c.state = 'cancelado'
+                OR (c.state = 'aprovado' AND c.id IS DISTINCT FROM e.ultima_calibracao_id))
+           AND NOT EXISTS (SELECT 1 FROM metrology_incerteza_orcamento o WHERE o.calibracao_id = c.id)
+      ORDER BY c.data_calibracao, c.id
+         LIMIT %(limite)s
+           FOR UPDATE OF c SKIP LOCKED
+    ),
+    movidas AS (
+        DELETE FROM metrology_calibracao c
+         USING alvo
+         WHERE c.id = alvo.id
+     RETURNING c.*
+    )
+    INSERT INTO metrology_calibracao_arquivo (calibracao_original_id, data_arquivamento, {colunas})
+    SELECT id, now() at time zone 'UTC', {colunas}
+      FROM movidas
+ RETURNING id, calibracao_original_id
+""".format(colunas=', '.join(COLUNAS_ARQUIVO))
+
+# Mensagens e valores de rastreamento das calibrações movidas, serializados no arquivo
+_HISTORICO_MENSAGENS = """
+    UPDATE metrology_calibracao_arquivo a
+       SET historico_mensagens = h.mensagens
+      FROM (
+            SELECT m.res_id,
+                   json_agg(json_build_object(
+                       'data', m.date,
+                       'autor_id', m.author_id,
+                       'tipo', m.message_type,
+                       'assunto', m.subject,
+                       'corpo', m.body,
+                       'rastreamento', (
+                           SELECT json_agg(json_build_object(
+                                      'campo', f.name,
+                                      'anterior', COALESCE(t.old_value_char, t.old_value_text, t.old_value_integer::text,
+                                                           t.old_value_float::text, t.old_value_datetime::text),
+                                      'novo', COALESCE(t.new_value_char, t.new_value_text, t.new_value_integer::text,
+                                                       t.new_value_float::text, t.new_value_datetime::text))
+                                      ORDER BY t.id)
+                             FROM mail_tracking_value t
+                        LEFT JOIN ir_model_fields f ON f.id = t.field_id
+                            WHERE t.mail_message_id = m.id)
+                   ) ORDER BY m.date, m.id) AS mensagens
+              FROM mail_message m
+             WHERE m.model = 'metrology.calibracao'
+               AND m.res_id = ANY(%(originais)s)
+          GROUP BY m.res_id
+           ) h
+     WHERE a.calibracao_original_id = h.res_id
+       AND a.id = ANY(%(arquivados)s)
+"""
+
+
+class CalibracaoArquivo(models.Model):
+    _name = 'metrology.calibracao.arquivo'
+    _description = 'Calibração Arquivada'
+    _order = 'data_calibracao desc, id desc'
+
+    # Camada fria do histórico: gravada somente por _arquivar e nunca editada
+    calibracao_original_id = fields.Integer(string='ID Original', readonly=True, index=True)
+    data_arquivamento = fields.Datetime(string='Data do Arquivamento', readonly=True)
+    name = fields.Char(string='Número', readonly=True)
+    equipamento_id = fields.Many2one('metrology.equipamento', string='Equipamento', readonly=True,
+                                     ondelete='restrict', index=True)
+    data_calibracao = fields.Date(string='Data da Calibração', readonly=True, index=True)
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True, index=True)
+    data_validade = fields.Date(string='Data de Validade', readonly=True)
+    tipo_comprovacao = fields.Selection(selection='_selection_tipo_comprovacao', string='Tipo de Comprovação',
+                                        readonly=True)
+    local_ensaio_id = fields.Many2one('metrology.local_ensaios', string='Local do Ensaio', readonly=True)
+    executor_id = fields.Many2one('metrology.parte_interessada', string='Executor', readonly=True)
+    tecnico_responsavel = fields.Char(string='Técnico Responsável', readonly=True)
+    padrao_id = fields.Many2one('metrology.padrao_medicao', string='Padrão de Medição Utilizado', readonly=True)
+    temperatura = fields.Float(string='Temperatura (°C)', readonly=True)
+    umidade = fields.Float(string='Umidade Relativa (%)', readonly=True)
+    pressao = fields.Float(string='Pressão Atmosférica (hPa)', readonly=True)
+    resultado = fields.Selection(selection='_selection_resultado', string='Resultado da Calibração', readonly=True)
+    resultado_manual = fields.Boolean(string='Resultado Informado Manualmente', readonly=True)
+    probabilidade_falsa_aceitacao = fields.Float(string='Probabilidade de Falsa Aceitação', readonly=True,
+                                                 digits=(16, 6))
+    incerteza_expandida = fields.Float(string='Incerteza Expandida (U)', readonly=True)
+    fator_abrangencia = fields.Float(string='Fator de Abrangência (k)', readonly=True)
+    erro_encontrado = fields.Float(string='Erro Encontrado', readonly=True)
+    ajuste_realizado = fields.Boolean(string='Ajuste Realizado', readonly=True)
+    numero_certificado = fields.Char(string='Número do Certificado', readonly=True)
+    # Anexo transferido da calibração original (res_field certificado_file)
+    certificado_file = fields.Binary(string='Arquivo do Certificado', attachment=True, prefetch=False, readonly=True)
+    certificado_filename = fields.Char(string='Nome do Arquivo', readonly=True)
+    observacoes = fields.Text(string='Observações', readonly=True)
+    restricoes_uso = fields.Text(string='Restrições de Uso', readonly=True)
+    state = fields.Selection(selection='_selection_state', string='Status', readonly=True)
+    historico_mensagens = fields.Json(string='Histórico de Mensagens', readonly=True)
+    historico_mensagens_texto = fields.Text(string='Mensagens e Rastreamento',
+                                            compute='_compute_historico_mensagens_texto')
+
+    def _selection_tipo_comprovacao(self):
+        return self.env['metrology.calibracao']._fields['tipo_comprovacao'].selection
+
+    def _selection_resultado(self):
+        return self.env['metrology.calibracao']._fields['resultado'].selection
+
+    def _selection_state(self):
+        return self.env['metrology.calibracao']._fields['state'].selection
+
+    @api.depends('historico_mensagens')
+    def _compute_historico_mensagens_texto(self):
+        for arquivo in self:
+            linhas = []
+            for mensagem in arquivo.historico_mensagens or []:
+                linhas.append('%s - %s' % (mensagem.get('data') or '', mensagem.get('assunto') or mensagem.get('tipo')))
+                if mensagem.get('corpo'):
+                    linhas.append('    %s' % html2plaintext(mensagem['corpo']))
+                for rastreamento in mensagem.get('rastreamento') or []:
+                    linhas.append('    %s: %s → %s' % (
+                        rastreamento.get('campo'), rastreamento.get('anterior') or '', rastreamento.get('novo') or ''))
+            arquivo.historico_mensagens_texto = '\n'.join(linhas)
+
+    @api.model
+    def _corte(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.arquivo_anos', ARQUIVO_ANOS_PADRAO)
+        try:
+            anos = max(int(valor), 1)
+        except (TypeError, ValueError):
+            anos = ARQUIVO_ANOS_PADRAO
+        return fields.Date.context_today(self) - relativedelta(years=anos)
+
+    def _commit(self):
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _arquivar(self, limite=ARQUIVO_BATCH_SIZE):
+        """Move calibrações antigas da tabela quente para o arquivo; executado pelo agendador.
+
+        Cada lote move as calibrações, serializa suas mensagens e rastreamentos no
+        arquivo, remove-os das tabelas de mensagens e transfere os anexos (certificados)
+        para o registro arquivado, em uma transação por lote. Ao esgotar o tempo da
+        execução, o agendador é reagendado para continuar de onde parou.
+        """
+        self.env['metrology.calibracao'].flush_model()
+        self.env['metrology.equipamento'].flush_model(['ultima_calibracao_id'])
+        self.env['metrology.incerteza.orcamento'].flush_model(['calibracao_id'])
+        cr = self.env.cr
+        corte = self._corte()
+        inicio = time.monotonic()
+        total = 0
+        while True:
+            if time.monotonic() - inicio > TEMPO_MAXIMO_ARQUIVAMENTO:
+                self.env.ref('metrology_management.ir_cron_arquivar_calibracoes')._trigger()
+                break
+            cr.execute(_MOVER_LOTE, {'corte': corte, 'limite': limite})
+            movidas = cr.fetchall()
+            if not movidas:
+                break
+            arquivados = [row[0] for row in movidas]
+            originais = [row[1] for row in movidas]
+            parametros = {'originais': originais, 'arquivados': arquivados}
+            cr.execute(_HISTORICO_MENSAGENS, parametros)
+            # Mensagens, rastreamentos e notificações saem em cascata de mail_message
+            cr.execute("""
+                DELETE FROM mail_message WHERE model = 'metrology.calibracao' AND res_id = ANY(%(originais)s)
+            """, parametros)
+            cr.execute("""
+                DELETE FROM mail_followers WHERE res_model = 'metrology.calibracao' AND res_id = ANY(%(originais)s)
+            """, parametros)
+            cr.execute("""
+                DELETE FROM mail_activity WHERE res_model = 'metrology.calibracao' AND res_id = ANY(%(originais)s)
+            """, parametros)
+            cr.execute("""
+                UPDATE ir_attachment a
+                   SET res_model = 'metrology.calibracao.arquivo', res_id = m.arquivado
+                  FROM unnest(%(originais)s::int[], %(arquivados)s::int[]) AS m(original, arquivado)
+                 WHERE a.res_model = 'metrology.calibracao' AND a.res_id = m.original
+            """, parametros)
+            total += len(movidas)
+            self._commit()
+            _logger.info('Arquivamento de calibrações: %s movidas', total)
+        self.env.invalidate_all()
+        return total
@@ -1,5 +1,18 @@
+import uuid
+
 from odoo import models, fields, api
+from odoo.tools import split_every
 from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
+
+from ..tools.perfil import perfilar
+
+# Quantidade de equipamentos processados (e confirmados) por transação
+ALERT_BATCH_SIZE = 500
+# 'resumo': alertas agregados por responsável (metrology.alerta.fila);
+# 'mensagem': uma mensagem no chatter por equipamento vencido (comportamento anterior)
+ALERTAS_MODO_PADRAO = 'resumo'
+
 
 class CalibracoesTodo(models.Model):
     _name = 'metrology.calibracoes.alert'
@@ -7,49 +20,119 @@ class CalibracoesTodo(models.Model):
     _inherit = ['mail.thread', 'mail.activity.mixin']
 
     @api.model
+    @perfilar()
     def _send_calibration_alerts(self):
         """
         Envia alertas para calibrações próximas ao vencimento e vencidas.
-        Executa diariamente via agendador de tarefas (cron job).
+        Executa diariamente via agendador de tarefas (cron job), um por empresa
+        (model.with_company(<id>)); somente os equipamentos da empresa do ambiente são tratados.
         """
-        self._send_upcoming_calibration_alerts()
-        self._send_expired_calibration_alerts()
-        
+        # Garante que os status vencidos estejam atualizados antes de filtrar por eles
+        self.env['metrology.equipamento']._rollover_status_metrologico()
+        # Os lotes são confirmados um a um: os alertas enfileirados ficam retidos até o fim
+        # da execução para que nenhum resumo saia com apenas parte dos equipamentos
+        execucao = str(uuid.uuid4())
+        alertas = self.with_context(metrology_alerta_execucao=execucao)
+        alertas._send_upcoming_calibration_alerts()
+        alertas._send_expired_calibration_alerts()
+        self.env['metrology.alerta.fila']._liberar(execucao)
+
+    @api.model
+    def _modo_resumo(self):
+        modo = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.alertas_modo', ALERTAS_MODO_PADRAO)
+        return modo != 'mensagem'
+
+    def _commit_lote(self):
+        """Confirma o lote processado para não manter uma única transação longa (exceto em testes)"""
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @perfilar()
     def _send_upcoming_calibration_alerts(self):
-        """Envia alertas para calibrações que vencem em 30 dias"""
-        data_limite_30 = date.today() + timedelta(days=30)
-        equipamentos_30 = self.env['metrology.equipamento'].search([
-            ('proxima_calibracao', '<=', data_limite_30),
-            ('proxima_calibracao', '>=', date.today()),
-            ('active', '=', True)
-        ])
-        
-        for equipamento in equipamentos_30:
-            if not equipamento.activity_ids.filtered(
-                lambda a: a.activity_type_id == self.env.ref('metrology_management.mail_activity_calibration_alert')
-            ):
-                self._create_calibration_alert_activity(equipamento)
+        """Envia alertas para calibrações que vencem dentro da janela configurada (30 dias por padrão)"""
+        Equip = self.env['metrology.equipamento']
+        hoje = date.today()
+        data_limite = hoje + timedelta(days=Equip._janela_alerta_dias())
+        activity_type = self.env.ref('metrology_management.mail_activity_calibration_alert')
+        Equip.flush_model(['proxima_calibracao', 'active', 'company_id'])
+        self.env['mail.activity'].flush_model(['res_model', 'res_id', 'activity_type_id'])
+
+        # Anti-join: somente equipamentos que ainda não possuem a atividade de alerta
+        self.env.cr.execute("""
+            SELECT e.id
+              FROM metrology_equipamento e
+             WHERE e.company_id = %(company_id)s
+               AND e.active
+               AND e.proxima_calibracao BETWEEN %(hoje)s AND %(data_limite)s
+               AND NOT EXISTS (
+                       SELECT 1
+                         FROM mail_activity a
+                        WHERE a.res_model = 'metrology.equipamento'
+                          AND a.res_id = e.id
+                          AND a.activity_type_id = %(activity_type_id)s)
+          ORDER BY e.id
+        """, {'hoje': hoje, 'data_limite': data_limite, 'activity_type_id': activity_type.id,
+              'company_id': self.env.company.id})
+        equipamento_ids = [row[0] for row in self.env.cr.fetchall()]
+
+        res_model_id = self.env['ir.model']._get_id('metrology.equipamento')
+        date_deadline = fields.Date.context_today(self) + relativedelta(
+            **{activity_type.delay_unit or 'days': activity_type.delay_count or 0})
+        resumo = self._modo_resumo()
+        # No modo resumo a atribuição da atividade não gera e-mail próprio
+        Activity = self.env['mail.activity'].with_context(mail_activity_quick_update=resumo)
+        for ids in split_every(ALERT_BATCH_SIZE, equipamento_ids):
+            Activity.create([
+                self._prepare_calibration_alert_activity(equipamento, activity_type, res_model_id, date_deadline)
+                for equipamento in Equip.browse(ids)
+            ])
+            if resumo:
+                self.env['metrology.alerta.fila']._enfileirar(ids, 'proximo')
+            self._commit_lote()
 
     def _send_expired_calibration_alerts(self):
-        """Envia alertas para equipamentos com calibração vencida"""
-        equipamentos_vencidos = self.env['metrology.equipamento'].search([
+        """Envia alertas para equipamentos com calibração vencida, uma vez por transição de estado"""
+        Equip = self.env['metrology.equipamento']
+
+        # Equipamentos que saíram do estado vencido voltam a ser elegíveis para um novo alerta
+        Equip.search([
+            ('company_id', '=', self.env.company.id),
+            ('alerta_status', '=', 'vencido'),
+            ('status_metrologico', '!=', 'vencido'),
+        ]).write({'alerta_status': False})
+
+        equipamentos_vencidos = Equip.search([
+            ('company_id', '=', self.env.company.id),
             ('proxima_calibracao', '<', date.today()),
             ('status_metrologico', '=', 'vencido'),
+            ('alerta_status', '!=', 'vencido'),
             ('active', '=', True)
-        ])
-        
-        for equipamento in equipamentos_vencidos:
-            self._create_expired_calibration_message(equipamento)
-
-    def _create_calibration_alert_activity(self, equipamento):
-        """Cria atividade de alerta de calibração próxima"""
-        return equipamento.activity_schedule(
-            'metrology_management.mail_activity_calibration_alert',
-            user_id=equipamento.responsavel_id.id or self.env.user.id,
-            summary=f'Calibração próxima ao vencimento: {equipamento.tag}',
-            note=f'O equipamento {equipamento.tag} - {equipamento.nome} '
-                 f'vence em {equipamento.dias_para_vencimento} dias.'
-        )
+        ], order='id')
+
+        resumo = self._modo_resumo()
+        for ids in split_every(ALERT_BATCH_SIZE, equipamentos_vencidos.ids):
+            lote = Equip.browse(ids)
+            if resumo:
+                self.env['metrology.alerta.fila']._enfileirar(ids, 'vencido')
+            else:
+                for equipamento in lote:
+                    self._create_expired_calibration_message(equipamento)
+            lote.write({'alerta_status': 'vencido', 'alerta_data': date.today()})
+            self._commit_lote()
+
+    def _prepare_calibration_alert_activity(self, equipamento, activity_type, res_model_id, date_deadline):
+        """Prepara os valores da atividade de alerta de calibração próxima"""
+        return {
+            'res_model_id': res_model_id,
+            'res_id': equipamento.id,
+            'activity_type_id': activity_type.id,
+            'date_deadline': date_deadline,
+            'user_id': equipamento.responsavel_id.id or self.env.user.id,
+            'summary': f'Calibração próxima ao vencimento: {equipamento.tag}',
+            'note': f'O equipamento {equipamento.tag} - {equipamento.nome} '
+                    f'vence em {equipamento.dias_para_vencimento} dias.',
+        }
 
     def _create_expired_calibration_message(self, equipamento):
         """Cria mensagem de alerta para calibração vencida"""
@@ -59,9 +142,8 @@ class CalibracoesTodo(models.Model):
             message_type='notification',
             subtype_id=self.env.ref('mail.mt_note').id,
             tracking_value_ids=[(0, 0, {
-                'field': 'status_metrologico',
-                'field_desc': 'Status Metrológico',
+                'field_id': self.env['ir.model.fields']._get('metrology.equipamento', 'status_metrologico').id,
                 'old_value_char': 'Válido',
                 'new_value_char': 'Vencido'
             })]
-        )
\ No newline at end of file
+        )
@@ -1,17 +1,26 @@
 from odoo import models, fields, api
+from odoo.models import PREFETCH_MAX
+from odoo.tools import split_every
 from datetime import date, timedelta
 
+from ..tools.perfil import perfilar
+
+# Campos lidos pelo template do relatório de exportação do dashboard
+REPORT_EQUIPAMENTO_FIELDS = ['tag', 'nome', 'modelo', 'numero_serie', 'status_metrologico', 'ultima_calibracao_id']
+REPORT_CALIBRACAO_FIELDS = ['data_calibracao', 'resultado', 'numero_certificado']
+
+
 class MetrologyDashboard(models.Model):
     _name = 'metrology.dashboard'
     _description = 'Dashboard Metrológico'
 
-    # Campos computados para cache de dados
-    total_equipamentos = fields.Integer(string='Total de Equipamentos', compute='_compute_dashboard_data', store=True)
-    equipamentos_conformes = fields.Integer(string='Equipamentos Conformes', compute='_compute_dashboard_data', store=True)
-    equipamentos_vencidos = fields.Integer(string='Equipamentos Vencidos', compute='_compute_dashboard_data', store=True)
-    proximas_calibracoes = fields.Integer(string='Calibrações Próximas', compute='_compute_dashboard_data', store=True)
-    calibracoes_mes = fields.Integer(string='Calibrações do Mês', compute='_compute_dashboard_data', store=True)
-    taxa_conformidade = fields.Float(string='Taxa de Conformidade', compute='_compute_dashboard_data', store=True)
+    # Indicadores lidos do armazenamento de contadores (metrology.dashboard.kpi)
+    total_equipamentos = fields.Integer(string='Total de Equipamentos', compute='_compute_dashboard_data')
+    equipamentos_conformes = fields.Integer(string='Equipamentos Conformes', compute='_compute_dashboard_data')
+    equipamentos_vencidos = fields.Integer(string='Equipamentos Vencidos', compute='_compute_dashboard_data')
+    proximas_calibracoes = fields.Integer(string='Calibrações Próximas', compute='_compute_dashboard_data')
+    calibracoes_mes = fields.Integer(string='Calibrações do Mês', compute='_compute_dashboard_data')
+    taxa_conformidade = fields.Float(string='Taxa de Conformidade', compute='_compute_dashboard_data')
 
     @api.model
     def create(self, vals):
@@ -21,60 +30,116 @@ class MetrologyDashboard(models.Model):
             return existing
         return super().create(vals)
 
-    @api.depends('total_equipamentos', 'equipamentos_conformes')
     def _compute_dashboard_data(self):
         """Computa os dados do dashboard"""
+        snapshot = self._get_kpi_snapshot()
         for record in self:
-            # Total de equipamentos
-            record.total_equipamentos = self.env['metrology.equipamento'].search_count([
-                ('active', '=', True)
-            ])
-
-            # Equipamentos por status
-            record.equipamentos_conformes = self.env['metrology.equipamento'].search_count([
-                ('status_metrologico', '=', 'conforme'),
-                ('active', '=', True)
-            ])
-
-            record.equipamentos_vencidos = self.env['metrology.equipamento'].search_count([
-                ('status_metrologico', '=', 'vencido'),
-                ('active', '=', True)
-            ])
-
-            # Calibrações próximas (30 dias)
-            data_limite = date.today() + timedelta(days=30)
-            record.proximas_calibracoes = self.env['metrology.equipamento'].search_count([
-                ('proxima_calibracao', '<=', data_limite),
-                ('proxima_calibracao', '>=', date.today()),
-                ('active', '=', True)
-            ])
-
-            # Calibrações realizadas no mês
-            inicio_mes = date.today().replace(day=1)
-            record.calibracoes_mes = self.env['metrology.calibracao'].search_count([
-                ('data_calibracao', '>=', inicio_mes),
-                ('state', '=', 'aprovado')
-            ])
-
-            # Taxa de conformidade
+            record.total_equipamentos = snapshot['total_equipamentos']
+            record.equipamentos_conformes = snapshot['equipamentos_conformes']
+            record.equipamentos_vencidos = snapshot['equipamentos_vencidos']
+            record.proximas_calibracoes = snapshot['proximas_calibracoes']
+            record.calibracoes_mes = snapshot['calibracoes_mes']
+            record.taxa_conformidade = snapshot['taxa_conformidade']
+
+    @api.model
+    def _get_kpi_snapshot(self):
+        """Lê os indicadores das empresas selecionadas (self.env.companies) a partir dos contadores materializados"""
+        # Gravações pendentes precisam chegar ao banco para que os gatilhos atualizem os contadores
+        self.env['metrology.equipamento'].flush_model()
+        self.env['metrology.calibracao'].flush_model()
+        hoje = date.today()
+        # Os contadores guardam só o mês do vencimento; a janela de dias vem do índice
+        # (company_id, proxima_calibracao) dos equipamentos, que lê apenas a faixa da janela
+        self.env.cr.execute("""
+            SELECT COALESCE(SUM(quantidade), 0),
+                   COALESCE(SUM(quantidade) FILTER (WHERE status_metrologico = 'conforme'), 0),
+                   COALESCE(SUM(quantidade) FILTER (WHERE status_metrologico = 'vencido'), 0),
+                   (SELECT count(*)
+                      FROM metrology_equipamento
+                     WHERE company_id = ANY(%(empresas)s)
+                       AND active
+                       AND proxima_calibracao BETWEEN %(hoje)s AND %(data_limite)s),
+                   (SELECT COALESCE(SUM(quantidade), 0)
+                      FROM metrology_dashboard_kpi_calibracao
+                     WHERE company_id = ANY(%(empresas)s)
+                       AND mes >= %(inicio_mes)s)
+              FROM metrology_dashboard_kpi
+             WHERE company_id = ANY(%(empresas)s)
+        """, {
+            'empresas': self.env.companies.ids,
+            'hoje': hoje,
+            # Calibrações próximas (janela dos alertas, 30 dias por padrão)
+            'data_limite': hoje + timedelta(days=self.env['metrology.equipamento']._janela_alerta_dias()),
+            'inicio_mes': hoje.replace(day=1),
+        })
+        total, conformes, vencidos, proximas, calibracoes_mes = self.env.cr.fetchone()
+        return {
+            'total_equipamentos': total,
+            'equipamentos_conformes': conformes,
+            'equipamentos_vencidos': vencidos,
+            'proximas_calibracoes': proximas,
+            'calibracoes_mes': calibracoes_mes,
             # Widget percentage na view espera valor entre 0 e 1; não multiplicar por 100 aqui
-            record.taxa_conformidade = (
-                round((record.equipamentos_conformes / record.total_equipamentos), 4)
-                if record.total_equipamentos > 0 else 0.0
+            'taxa_conformidade': round(conformes / total, 4) if total > 0 else 0.0,
+        }
+
+    @api.model
+    def get_kpis_por_dimensao(self, dimensao):
+        """Retorna os indicadores agrupados por 'tipo' ou 'centro_custo' a partir dos contadores"""
+        if dimensao not in ('tipo', 'centro_custo'):
+            raise ValueError('Dimensão inválida: %s' % dimensao)
+        self.env['metrology.equipamento'].flush_model()
+        hoje = date.today()
+        self.env.cr.execute("""
+            WITH proximas AS (
+                SELECT NULLIF({dimensao}, '') AS chave, count(*) AS quantidade
+                  FROM metrology_equipamento
+                 WHERE company_id = ANY(%(empresas)s)
+                   AND active
+                   AND proxima_calibracao BETWEEN %(hoje)s AND %(data_limite)s
+              GROUP BY 1
             )
+            SELECT k.{dimensao},
+                   SUM(k.quantidade),
+                   SUM(k.quantidade) FILTER (WHERE k.status_metrologico = 'conforme'),
+                   SUM(k.quantidade) FILTER (WHERE k.status_metrologico = 'vencido'),
+                   MAX(p.quantidade)
+              FROM metrology_dashboard_kpi k
+         LEFT JOIN proximas p ON p.chave IS NOT DISTINCT FROM k.{dimensao}
+             WHERE k.company_id = ANY(%(empresas)s)
+          GROUP BY k.{dimensao}
+            HAVING SUM(k.quantidade) > 0
+          ORDER BY k.{dimensao}
+        """.format(dimensao=dimensao), {
+            'empresas': self.env.companies.ids,
+            'hoje': hoje,
+            'data_limite': hoje + timedelta(days=self.env['metrology.equipamento']._janela_alerta_dias()),
+        })
+        rotulos = dict(self.env['metrology.equipamento']._fields['tipo'].selection) if dimensao == 'tipo' else {}
+        resultado = []
+        for chave, total, conformes, vencidos, proximas in self.env.cr.fetchall():
+            conformes = conformes or 0
+            resultado.append({
+                'chave': chave,
+                'rotulo': rotulos.get(chave, chave) or 'Não informado',
+                'total_equipamentos': total,
+                'equipamentos_conformes': conformes,
+                'equipamentos_vencidos': vencidos or 0,
+                'proximas_calibracoes': proximas or 0,
+                'taxa_conformidade': round(conformes / total, 4) if total > 0 else 0.0,
+            })
+        return resultado
 
     @api.model
+    @perfilar()
     def default_get(self, fields_list):
-        """Override para forçar recálculo ao abrir o dashboard"""
+        """Preenche o formulário com os indicadores atuais lidos dos contadores"""
         res = super().default_get(fields_list)
         
         # Procura ou cria o registro do dashboard
         dashboard = self.search([], limit=1)
         if not dashboard:
             dashboard = self.create({})
-        else:
-            # Força recálculo dos campos computados
-            dashboard._compute_dashboard_data()
         
         # Retorna os valores atualizados
         if dashboard:
@@ -84,17 +149,27 @@ class MetrologyDashboard(models.Model):
         
         return res
 
+    @perfilar()
     def get_report_data(self):
         """Retorna um snapshot com os dados do dashboard e a última calibração de cada equipamento.
 
+        O número de consultas independe da quantidade de equipamentos: os indicadores
+        vêm dos contadores materializados, a última calibração é lida do ponteiro
+        ultima_calibracao_id mantido no equipamento e os campos usados pelo template
+        são carregados em lotes de PREFETCH_MAX registros, de modo que o laço QWeb não
+        dispara leituras por linha.
+
         Estrutura retornada:
         {
           'total_equipamentos': int,
           'equipamentos_conformes': int,
           'equipamentos_vencidos': int,
           'proximas_calibracoes': int,
+          'janela_alerta_dias': int,  # janela usada em proximas_calibracoes
           'calibracoes_mes': int,
           'taxa_conformidade': float,  # 0..1
+          'indicadores_por_tipo': [dict],  # ver get_kpis_por_dimensao
+          'indicadores_por_centro_custo': [dict],
           'equipment_rows': [
               {'equipamento': record(equip), 'calibracao': record(cal) or False}
           ]
@@ -104,47 +179,27 @@ class MetrologyDashboard(models.Model):
         Equip = self.env['metrology.equipamento']
         Calib = self.env['metrology.calibracao']
 
-        from datetime import date, timedelta
-
-        total_equipamentos = Equip.search_count([('active', '=', True)])
-        equipamentos_conformes = Equip.search_count([
-            ('status_metrologico', '=', 'conforme'), ('active', '=', True)
-        ])
-        equipamentos_vencidos = Equip.search_count([
-            ('status_metrologico', '=', 'vencido'), ('active', '=', True)
-        ])
-
-        data_limite = date.today() + timedelta(days=30)
-        proximas_calibracoes = Equip.search_count([
-            ('proxima_calibracao', '<=', data_limite),
-            ('proxima_calibracao', '>=', date.today()),
-            ('active', '=', True)
-        ])
-
-        inicio_mes = date.today().replace(day=1)
-        calibracoes_mes = Calib.search_count([
-            ('data_calibracao', '>=', inicio_mes), ('state', '=', 'aprovado')
-        ])
-
-        taxa_conformidade = (
-            round((equipamentos_conformes / total_equipamentos), 4)
-            if total_equipamentos > 0 else 0.0
-        )
+        snapshot = self._get_kpi_snapshot()
+        snapshot['janela_alerta_dias'] = Equip._janela_alerta_dias()
+        snapshot['indicadores_por_tipo'] = self.get_kpis_por_dimensao('tipo')
+        snapshot['indicadores_por_centro_custo'] = self.get_kpis_por_dimensao('centro_custo')
 
-        equipment_rows = []
-        for eq in Equip.search([('active', '=', True)], order='tag asc, nome asc'):
-            last = Calib.search([
-                ('equipamento_id', '=', eq.id),
-                ('state', '=', 'aprovado')
-            ], order='data_calibracao desc', limit=1)
-            equipment_rows.append({'equipamento': eq, 'calibracao': last or False})
+        equipamentos = Equip.search([('active', '=', True), ('company_id', 'in', self.env.companies.ids)],
+                                    order='tag asc, nome asc')
+        for ids in split_every(PREFETCH_MAX, equipamentos.ids):
+            Equip.browse(ids).fetch(REPORT_EQUIPAMENTO_FIELDS)
 
-        return {
-            'total_equipamentos': total_equipamentos,
-            'equipamentos_conformes': equipamentos_conformes,
-            'equipamentos_vencidos': equipamentos_vencidos,
-            'proximas_calibracoes': proximas_calibracoes,
-            'calibracoes_mes': calibracoes_mes,
-            'taxa_conformidade': taxa_conformidade,
-            'equipment_rows': equipment_rows,
-        }
\ No newline at end of file
+        # Recordset completo compartilha o mesmo conjunto de prefetch
+        calibracoes = equipamentos.ultima_calibracao_id
+        for ids in split_every(PREFETCH_MAX, calibracoes.ids):
+            Calib.browse(ids).fetch(REPORT_CALIBRACAO_FIELDS)
+
+        equipment_rows = []
+        for eq in equipamentos:
+            equipment_rows.append({
+                'equipamento': eq,
+                'calibracao': eq.ultima_calibracao_id or False,
+            })
+
+        snapshot['equipment_rows'] = equipment_rows
+        return snapshot
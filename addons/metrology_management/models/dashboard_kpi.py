@@ -0,0 +1,217 @@
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Chaves de agrupamento dos contadores. COALESCE permite usar as expressões em
+# um índice único (e no ON CONFLICT) mesmo com colunas nulas. A empresa abre a chave
+# para que os agendadores de cada empresa não disputem as mesmas linhas. O vencimento
+# entra agrupado por mês: com a data exata, quase toda calibração criaria uma linha nova.
+_CHAVE_EQUIPAMENTO = (
+    "COALESCE(company_id, 0), COALESCE(tipo, ''), COALESCE(centro_custo, ''), "
+    "COALESCE(status_metrologico, ''), COALESCE(mes_vencimento, 'infinity'::date)"
+)
+_CHAVE_CALIBRACAO = "COALESCE(company_id, 0), mes"
+
+_UPSERT_EQUIPAMENTO = """
+    INSERT INTO metrology_dashboard_kpi
+           (company_id, tipo, centro_custo, status_metrologico, mes_vencimento, quantidade)
+    SELECT d.company_id, d.tipo, d.centro_custo, d.status_metrologico, d.mes_vencimento, SUM(d.quantidade)
+      FROM ({origem}) d
+  GROUP BY d.company_id, d.tipo, d.centro_custo, d.status_metrologico, d.mes_vencimento
+    HAVING SUM(d.quantidade) <> 0
+        ON CONFLICT ({chave})
+        DO UPDATE SET quantidade = metrology_dashboard_kpi.quantidade + EXCLUDED.quantidade
+"""
+_UPSERT_CALIBRACAO = """
+    INSERT INTO metrology_dashboard_kpi_calibracao (company_id, mes, quantidade)
+    SELECT d.company_id, d.mes, SUM(d.quantidade)
+      FROM ({origem}) d
+  GROUP BY d.company_id, d.mes
+    HAVING SUM(d.quantidade) <> 0
+        ON CONFLICT ({chave})
+        DO UPDATE SET quantidade = metrology_dashboard_kpi_calibracao.quantidade + EXCLUDED.quantidade
+"""
+
+
+# Valores vazios são normalizados para NULL para que cada chave do índice único
+# corresponda a um único grupo ({p}: prefixo da tabela de transição)
+_COLUNAS_EQUIPAMENTO = (
+    "{p}company_id, NULLIF({p}tipo, '') AS tipo, NULLIF({p}centro_custo, '') AS centro_custo, "
+    "NULLIF({p}status_metrologico, '') AS status_metrologico, "
+    "date_trunc('month', {p}proxima_calibracao)::date AS mes_vencimento"
+)
+_FILTRO_EQUIPAMENTO = "{p}active"
+# Colunas cuja alteração muda o contador de um equipamento ou de uma calibração
+_ALTERACAO_EQUIPAMENTO = (
+    "{p}company_id, {p}tipo, {p}centro_custo, {p}status_metrologico, "
+    "date_trunc('month', {p}proxima_calibracao), {p}active"
+)
+
+_COLUNAS_CALIBRACAO = "{p}company_id, date_trunc('month', {p}data_calibracao)::date AS mes"
+_FILTRO_CALIBRACAO = "{p}state = 'aprovado' AND {p}data_calibracao IS NOT NULL"
+_ALTERACAO_CALIBRACAO = "{p}company_id, {p}state, date_trunc('month', {p}data_calibracao)"
+
+
+def _origem(colunas, filtro):
+    def origem(tabela, sinal):
+        return "SELECT %s, %d AS quantidade FROM %s WHERE %s" % (
+            colunas.format(p=''), sinal, tabela, filtro.format(p=''))
+    return origem
+
+
+def _origem_alteracao(colunas, filtro, alteracao):
+    """Deltas de um UPDATE restritos às linhas em que alguma coluna do contador mudou.
+
+    O PostgreSQL não aceita tabelas de transição em gatilhos UPDATE OF <colunas>: o
+    gatilho dispara em todo UPDATE e a junção por id descarta as linhas inalteradas.
+    """
+    mudou = '(%s) IS DISTINCT FROM (%s)' % (alteracao.format(p='a.'), alteracao.format(p='n.'))
+    return (
+        "SELECT {novas}, 1 AS quantidade FROM novas n JOIN antigas a ON a.id = n.id "
+        "WHERE {filtro_novas} AND {mudou} "
+        "UNION ALL "
+        "SELECT {antigas}, -1 AS quantidade FROM antigas a JOIN novas n ON n.id = a.id "
+        "WHERE {filtro_antigas} AND {mudou}"
+    ).format(novas=colunas.format(p='n.'), antigas=colunas.format(p='a.'),
+             filtro_novas=filtro.format(p='n.'), filtro_antigas=filtro.format(p='a.'), mudou=mudou)
+
+
+_origem_equipamento = _origem(_COLUNAS_EQUIPAMENTO, _FILTRO_EQUIPAMENTO)
+_origem_calibracao = _origem(_COLUNAS_CALIBRACAO, _FILTRO_CALIBRACAO)
+
+
+def _criar_gatilhos(cr, tabela, funcao, upsert, origem, origem_update, chave):
+    """Cria a função e os gatilhos por comando que aplicam os deltas nos contadores.
+
+    Os gatilhos usam tabelas de transição, portanto cada comando SQL aplica um único
+    delta agregado, independente do número de linhas afetadas.
+    """
+    corpo_insert = upsert.format(origem=origem('novas', 1), chave=chave)
+    corpo_delete = upsert.format(origem=origem('antigas', -1), chave=chave)
+    corpo_update = upsert.format(origem=origem_update, chave=chave)
+    cr.execute("""
+        CREATE OR REPLACE FUNCTION {funcao}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {corpo_insert};
+            ELSIF TG_OP = 'DELETE' THEN
+                {corpo_delete};
+            ELSE
+                {corpo_update};
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+    """.format(funcao=funcao, corpo_insert=corpo_insert,
+               corpo_delete=corpo_delete, corpo_update=corpo_update))
+    for evento, transicao in (
+        ('INSERT', 'NEW TABLE AS novas'),
+        ('UPDATE', 'NEW TABLE AS novas OLD TABLE AS antigas'),
+        ('DELETE', 'OLD TABLE AS antigas'),
+    ):
+        gatilho = '%s_%s' % (funcao, evento.lower())
+        cr.execute('DROP TRIGGER IF EXISTS %s ON %s' % (gatilho, tabela))
+        cr.execute("""
+            CREATE TRIGGER {gatilho} AFTER {evento} ON {tabela}
+            REFERENCING {transicao}
+            FOR EACH STATEMENT EXECUTE FUNCTION {funcao}()
+        """.format(gatilho=gatilho, evento=evento, tabela=tabela,
+                   transicao=transicao, funcao=funcao))
+
+
+class MetrologyDashboardKpiCalibracao(models.Model):
+    _name = 'metrology.dashboard.kpi.calibracao'
+    _description = 'Contadores de Calibrações Aprovadas por Mês'
+    _order = 'mes desc'
+
+    # Mantido pelos gatilhos de metrology_calibracao
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True)
+    mes = fields.Date(string='Mês', readonly=True)
+    quantidade = fields.Integer(string='Quantidade', readonly=True, group_operator='sum')
+
+    def init(self):
+        self.env.cr.execute("DROP INDEX IF EXISTS metrology_dashboard_kpi_calibracao_mes_uniq")
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS metrology_dashboard_kpi_calibracao_empresa_mes_uniq
+                ON metrology_dashboard_kpi_calibracao (%s)
+        """ % _CHAVE_CALIBRACAO)
+
+
+class MetrologyDashboardKpi(models.Model):
+    _name = 'metrology.dashboard.kpi'
+    _description = 'Contadores do Dashboard Metrológico'
+    _order = 'tipo, centro_custo, status_metrologico, mes_vencimento'
+
+    # Cada linha conta os equipamentos ativos que compartilham a mesma combinação de
+    # tipo, centro de custo, status e mês da próxima calibração. As linhas são
+    # mantidas pelos gatilhos de metrology_equipamento e nunca pelo ORM.
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True)
+    tipo = fields.Selection(selection='_selection_tipo', string='Tipo', readonly=True)
+    centro_custo = fields.Char(string='Centro de Custo', readonly=True)
+    status_metrologico = fields.Selection(selection='_selection_status', string='Status Metrológico', readonly=True)
+    mes_vencimento = fields.Date(string='Mês da Próxima Calibração', readonly=True)
+    quantidade = fields.Integer(string='Quantidade', readonly=True, group_operator='sum')
+
+    def _selection_tipo(self):
+        return self.env['metrology.equipamento']._fields['tipo'].selection
+
+    def _selection_status(self):
+        return self.env['metrology.equipamento']._fields['status_metrologico'].selection
+
+    def init(self):
+        for indice in ('metrology_dashboard_kpi_chave_uniq', 'metrology_dashboard_kpi_empresa_chave_uniq'):
+            self.env.cr.execute("DROP INDEX IF EXISTS %s" % indice)
+        # Contadores por data exata: substituídos pelo mês (reconciliados abaixo)
+        self.env.cr.execute("ALTER TABLE metrology_dashboard_kpi DROP COLUMN IF EXISTS proxima_calibracao")
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS metrology_dashboard_kpi_empresa_mes_chave_uniq
+                ON metrology_dashboard_kpi (%s)
+        """ % _CHAVE_EQUIPAMENTO)
+        _criar_gatilhos(self.env.cr, 'metrology_equipamento', 'metrology_dashboard_kpi_equipamento',
+                        _UPSERT_EQUIPAMENTO, _origem_equipamento,
+                        _origem_alteracao(_COLUNAS_EQUIPAMENTO, _FILTRO_EQUIPAMENTO, _ALTERACAO_EQUIPAMENTO),
+                        _CHAVE_EQUIPAMENTO)
+        _criar_gatilhos(self.env.cr, 'metrology_calibracao', 'metrology_dashboard_kpi_calibracao',
+                        _UPSERT_CALIBRACAO, _origem_calibracao,
+                        _origem_alteracao(_COLUNAS_CALIBRACAO, _FILTRO_CALIBRACAO, _ALTERACAO_CALIBRACAO),
+                        _CHAVE_CALIBRACAO)
+        self._reconciliar()
+
+    @api.model
+    def _reconciliar(self):
+        """Corrige eventuais desvios dos contadores em relação às tabelas de origem.
+
+        Executado diariamente via agendador; aplica somente as diferenças encontradas,
+        de modo que os gatilhos concorrentes continuam válidos durante a execução.
+        """
+        self.env['metrology.equipamento'].flush_model()
+        self.env['metrology.calibracao'].flush_model()
+        self.env.cr.execute("""
+            WITH diferenca AS (
+                %s
+                 UNION ALL
+                SELECT company_id, tipo, centro_custo, status_metrologico, mes_vencimento, -quantidade
+                  FROM metrology_dashboard_kpi
+            )
+        """ % _origem_equipamento('metrology_equipamento', 1)
+            + _UPSERT_EQUIPAMENTO.format(origem='SELECT * FROM diferenca', chave=_CHAVE_EQUIPAMENTO))
+        corrigidos = self.env.cr.rowcount
+        self.env.cr.execute("""
+            WITH diferenca AS (
+                %s
+                 UNION ALL
+                SELECT company_id, mes, -quantidade
+                  FROM metrology_dashboard_kpi_calibracao
+            )
+        """ % _origem_calibracao('metrology_calibracao', 1)
+            + _UPSERT_CALIBRACAO.format(origem='SELECT * FROM diferenca', chave=_CHAVE_CALIBRACAO))
+        corrigidos += self.env.cr.rowcount
+        self.env.cr.execute("DELETE FROM metrology_dashboard_kpi WHERE quantidade = 0")
+        self.env.cr.execute("DELETE FROM metrology_dashboard_kpi_calibracao WHERE quantidade = 0")
+        self.invalidate_model()
+        self.env['metrology.dashboard.kpi.calibracao'].invalidate_model()
+        if corrigidos:
+            _logger.info('Contadores do dashboard reconciliados: %s grupos corrigidos', corrigidos)
+        return corrigidos
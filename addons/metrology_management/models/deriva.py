@@ -0,0 +1,170 @@
+import logging
+from datetime import date
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Critérios para confiar na regressão; abaixo deles vale o método escada (ILAC-G24, método 1)
+DERIVA_MINIMO_PONTOS = 3
+DERIVA_R2_MINIMO = 0.5
+# Fração do tempo previsto até o cruzamento do EMA usada como intervalo recomendado
+DERIVA_FATOR_SEGURANCA = 0.8
+# Método escada: estende o intervalo se o último erro está dentro do EMA, reduz caso contrário
+ESCADA_FATOR_AUMENTO = 1.25
+ESCADA_FATOR_REDUCAO = 0.5
+FREQUENCIA_MINIMA = 1
+FREQUENCIA_MAXIMA = 60
+
+# Datas são convertidas em anos decimais a partir desta origem para a regressão
+ORIGEM_DERIVA = date(2000, 1, 1)
+_ORIGEM = "DATE '%s'" % ORIGEM_DERIVA.isoformat()
+
+_ANALISE = """
+    WITH historico AS (
+        SELECT equipamento_id, data_calibracao, erro_encontrado, state FROM metrology_calibracao
+         UNION ALL
+        -- Calibrações arquivadas continuam compondo a tendência
+        SELECT equipamento_id, data_calibracao, erro_encontrado, state FROM metrology_calibracao_arquivo
+    ),
+    pontos AS (
+        SELECT c.equipamento_id,
+               ((c.data_calibracao - {origem}) / 365.25)::float8 AS x,
+               c.erro_encontrado AS y,
+               c.data_calibracao
+          FROM historico c
+          JOIN metrology_equipamento e ON e.id = c.equipamento_id
+         WHERE e.active
+           AND c.state = 'aprovado'
+           AND c.data_calibracao IS NOT NULL
+           AND c.erro_encontrado IS NOT NULL
+    ),
+    ajuste AS (
+        SELECT equipamento_id,
+               regr_count(y, x) AS pontos,
+               regr_slope(y, x) AS inclinacao,
+               regr_intercept(y, x) AS intercepto,
+               regr_r2(y, x) AS r2,
+               (array_agg(y ORDER BY data_calibracao DESC))[1] AS ultimo_erro,
+               ((max(data_calibracao) - {origem}) / 365.25)::float8 AS x_ultima
+          FROM pontos
+      GROUP BY equipamento_id
+    ),
+    previsao AS (
+        SELECT a.*, e.company_id,
+               COALESCE(NULLIF(e.frequencia_calibracao, 0), 12) AS frequencia,
+               e.erro_maximo_admissivel AS ema,
+               CASE WHEN a.pontos >= %(minimo_pontos)s
+                     AND COALESCE(a.r2, 0) >= %(r2_minimo)s
+                     AND a.inclinacao <> 0
+                     AND e.erro_maximo_admissivel > 0
+                    -- Instante em que a reta atinge +EMA (deriva positiva) ou -EMA (negativa)
+                    THEN (sign(a.inclinacao) * e.erro_maximo_admissivel - a.intercepto) / a.inclinacao
+               END AS x_cruzamento
+          FROM ajuste a
+          JOIN metrology_equipamento e ON e.id = a.equipamento_id
+    )
+    INSERT INTO metrology_deriva AS d
+           (equipamento_id, company_id, pontos, taxa_deriva, erro_previsto, r2, ultimo_erro,
+            data_cruzamento_ema, frequencia_recomendada, metodo, data_analise)
+    SELECT p.equipamento_id, p.company_id, p.pontos, p.inclinacao,
+           p.intercepto + p.inclinacao * %(x_hoje)s,
+           p.r2, p.ultimo_erro,
+           -- Cruzamentos além de um século são tratados como "sem previsão"
+           CASE WHEN abs(p.x_cruzamento - p.x_ultima) < 100
+                THEN {origem} + (p.x_cruzamento * 365.25)::int
+           END,
+           CASE WHEN p.x_cruzamento IS NOT NULL
+                THEN LEAST(GREATEST((p.x_cruzamento - p.x_ultima) * 12 * %(fator_seguranca)s,
+                                    %(frequencia_minima)s), %(frequencia_maxima)s)::int
+                WHEN p.ema IS NULL OR p.ema <= 0
+                THEN p.frequencia
+                WHEN abs(p.ultimo_erro) <= p.ema
+                THEN LEAST(p.frequencia * %(fator_aumento)s, %(frequencia_maxima)s)::int
+                ELSE GREATEST(p.frequencia * %(fator_reducao)s, %(frequencia_minima)s)::int
+           END,
+           CASE WHEN p.x_cruzamento IS NOT NULL THEN 'regressao' ELSE 'escada' END,
+           now() at time zone 'UTC'
+      FROM previsao p
+        ON CONFLICT (equipamento_id) DO UPDATE
+       SET company_id = EXCLUDED.company_id,
+           pontos = EXCLUDED.pontos,
+           taxa_deriva = EXCLUDED.taxa_deriva,
+           erro_previsto = EXCLUDED.erro_previsto,
+           r2 = EXCLUDED.r2,
+           ultimo_erro = EXCLUDED.ultimo_erro,
+           data_cruzamento_ema = EXCLUDED.data_cruzamento_ema,
+           frequencia_recomendada = EXCLUDED.frequencia_recomendada,
+           metodo = EXCLUDED.metodo,
+           data_analise = EXCLUDED.data_analise
+""".format(origem=_ORIGEM)
+
+
+class Deriva(models.Model):
+    _name = 'metrology.deriva'
+    _description = 'Análise de Deriva do Equipamento'
+    _rec_name = 'equipamento_id'
+    _order = 'data_cruzamento_ema, equipamento_id'
+
+    # Resumo por equipamento gravado em lote por _analisar_frota; nunca editado pelo ORM
+    equipamento_id = fields.Many2one('metrology.equipamento', string='Equipamento', required=True,
+                                     readonly=True, ondelete='cascade', index=True)
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True, index=True)
+    frequencia_calibracao = fields.Integer(related='equipamento_id.frequencia_calibracao')
+    erro_maximo_admissivel = fields.Float(related='equipamento_id.erro_maximo_admissivel')
+    pontos = fields.Integer(string='Calibrações Analisadas', readonly=True)
+    taxa_deriva = fields.Float(string='Deriva (por ano)', readonly=True,
+                               help='Inclinação da regressão linear do erro encontrado em função do tempo.')
+    erro_previsto = fields.Float(string='Erro Previsto Hoje', readonly=True)
+    r2 = fields.Float(string='R²', readonly=True, digits=(3, 2))
+    ultimo_erro = fields.Float(string='Último Erro Encontrado', readonly=True)
+    data_cruzamento_ema = fields.Date(string='Previsão de Cruzamento do EMA', readonly=True)
+    frequencia_recomendada = fields.Integer(string='Frequência Recomendada (meses)', readonly=True)
+    metodo = fields.Selection([
+        ('regressao', 'Regressão Linear'),
+        ('escada', 'Método Escada (ILAC-G24)'),
+    ], string='Método', readonly=True)
+    data_analise = fields.Datetime(string='Data da Análise', readonly=True)
+
+    _sql_constraints = [
+        ('equipamento_uniq', 'unique(equipamento_id)', 'Cada equipamento possui uma única análise de deriva.'),
+    ]
+
+    @api.model
+    def _analisar_frota(self):
+        """Ajusta a deriva de todos os equipamentos ativos em uma única consulta.
+
+        O histórico completo é agregado no banco (regr_slope, regr_intercept, regr_r2);
+        a frequência recomendada vem do cruzamento previsto do EMA quando a regressão é
+        confiável, ou do método escada do ILAC-G24 caso contrário.
+        """
+        self.env['metrology.equipamento'].flush_model(['active', 'company_id', 'frequencia_calibracao',
+                                                        'erro_maximo_admissivel'])
+        self.env['metrology.calibracao'].flush_model(['equipamento_id', 'state', 'data_calibracao', 'erro_encontrado'])
+        cr = self.env.cr
+        cr.execute(_ANALISE, {
+            'x_hoje': (fields.Date.context_today(self) - ORIGEM_DERIVA).days / 365.25,
+            'minimo_pontos': DERIVA_MINIMO_PONTOS,
+            'r2_minimo': DERIVA_R2_MINIMO,
+            'fator_seguranca': DERIVA_FATOR_SEGURANCA,
+            'fator_aumento': ESCADA_FATOR_AUMENTO,
+            'fator_reducao': ESCADA_FATOR_REDUCAO,
+            'frequencia_minima': FREQUENCIA_MINIMA,
+            'frequencia_maxima': FREQUENCIA_MAXIMA,
+        })
+        analisados = cr.rowcount
+        # Equipamentos arquivados ou sem histórico deixam de ter análise
+        cr.execute("DELETE FROM metrology_deriva WHERE data_analise <> now() at time zone 'UTC'")
+        self.invalidate_model()
+        _logger.info('Análise de deriva concluída: %s equipamentos', analisados)
+        return analisados
+
+    def action_aplicar_frequencia_recomendada(self):
+        """Aplica a frequência recomendada aos equipamentos das análises selecionadas"""
+        por_frequencia = {}
+        for deriva in self.filtered('frequencia_recomendada'):
+            if deriva.frequencia_recomendada != deriva.frequencia_calibracao:
+                por_frequencia.setdefault(deriva.frequencia_recomendada, self.env['metrology.equipamento'])
+                por_frequencia[deriva.frequencia_recomendada] |= deriva.equipamento_id
+        for frequencia, equipamentos in por_frequencia.items():
+            equipamentos._aplicar_frequencia_calibracao(frequencia)
@@ -1,5 +1,100 @@
-from odoo import models, fields, api
+import logging
+import operator as py_operator
+from contextlib import contextmanager
+from datetime import date, timedelta
+from dateutil.relativedelta import relativedelta
+
+import psycopg2
+
+from odoo import models, fields, api, Command
 from odoo.exceptions import ValidationError
+from odoo.tools import SQL, split_every
+
+from ..tools.perfil import perfilar
+
+_logger = logging.getLogger(__name__)
+
+# Quantidade de equipamentos recalculados (e confirmados) por transação na virada de status
+ROLLOVER_BATCH_SIZE = 1000
+
+# Antecedência padrão dos alertas de vencimento (parâmetro metrology_management.alerta_janela_dias)
+JANELA_ALERTA_PADRAO_DIAS = 30
+
+# Índices únicos de TAG por empresa (exato ou normalizado) e a expressão indexada de cada um
+INDICES_TAG = {
+    'metrology_equipamento_empresa_tag_uniq': 'tag',
+    'metrology_equipamento_empresa_tag_normalizado_uniq': 'upper(btrim(tag))',
+}
+# Índices globais das versões anteriores, substituídos pelos índices por empresa
+INDICES_TAG_OBSOLETOS = ('metrology_equipamento_tag_uniq', 'metrology_equipamento_tag_normalizado_uniq')
+
+_OPERADORES_DIAS = {
+    '<': py_operator.lt,
+    '<=': py_operator.le,
+    '>': py_operator.gt,
+    '>=': py_operator.ge,
+    '=': py_operator.eq,
+    '!=': py_operator.ne,
+}
+
+
+def criar_gatilho_write_date(cr, tabela, colunas):
+    """Atualiza write_date quando colunas calculadas ou gravadas em SQL mudam.
+
+    Recálculos do ORM e atualizações em lote não passam por write(); o gatilho mantém o
+    write_date (ETag e Last-Modified da API) coerente com essas alterações.
+    """
+    cr.execute("""
+        CREATE OR REPLACE FUNCTION metrology_marcar_write_date() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.write_date := now() at time zone 'UTC';
+            RETURN NEW;
+        END;
+        $$;
+    """)
+    gatilho = '%s_write_date' % tabela
+    cr.execute('DROP TRIGGER IF EXISTS %s ON %s' % (gatilho, tabela))
+    cr.execute("""
+        CREATE TRIGGER {gatilho} BEFORE UPDATE OF {colunas} ON {tabela}
+        FOR EACH ROW WHEN ({condicao})
+        EXECUTE FUNCTION metrology_marcar_write_date()
+    """.format(gatilho=gatilho, tabela=tabela, colunas=', '.join(colunas),
+               condicao=' OR '.join('OLD.%s IS DISTINCT FROM NEW.%s' % (c, c) for c in colunas)))
+
+
+def criar_coluna_transacao(cr, tabela):
+    """Mantém em `transacao` o txid da última transação que incluiu ou alterou a linha.
+
+    O feed de alterações da API pagina por (transacao, id) e só entrega transações
+    abaixo do xmin do snapshot, como o registro de eventos de status: uma transação
+    longa confirmada depois que o consumidor avançou não fica para trás do cursor,
+    o que acontecia com write_date (instante de início da transação).
+    """
+    # Valor padrão constante: sem reescrita da tabela; linhas antigas entram no início do feed
+    cr.execute('ALTER TABLE %s ADD COLUMN IF NOT EXISTS transacao bigint NOT NULL DEFAULT 0' % tabela)
+    cr.execute("""
+        CREATE OR REPLACE FUNCTION metrology_marcar_transacao() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.transacao := txid_current();
+            RETURN NEW;
+        END;
+        $$;
+    """)
+    gatilho = '%s_transacao' % tabela
+    cr.execute('DROP TRIGGER IF EXISTS %s ON %s' % (gatilho, tabela))
+    cr.execute("""
+        CREATE TRIGGER {gatilho} BEFORE INSERT OR UPDATE ON {tabela}
+        FOR EACH ROW EXECUTE FUNCTION metrology_marcar_transacao()
+    """.format(gatilho=gatilho, tabela=tabela))
+    cr.execute('DROP INDEX IF EXISTS %s_write_date_id_idx' % tabela)
+    cr.execute('CREATE INDEX IF NOT EXISTS {tabela}_transacao_id_idx ON {tabela} (transacao, id)'.format(
+        tabela=tabela))
+
+
+def _escapar_like(valor):
+    """Escapa os curingas do LIKE para que o termo seja buscado literalmente"""
+    return valor.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
 
 class Equipamento(models.Model):
     _name = 'metrology.equipamento'
@@ -8,29 +103,61 @@ class Equipamento(models.Model):
     _order = 'codigo'
     _rec_name = 'nome'
 
+    @staticmethod
+    def _formatar_exibicao(equipamento_id, tag, nome, codigo):
+        """Monta o texto 'TAG - Descrição' a partir dos valores já lidos"""
+        parts = [part for part in (tag, nome) if part]
+        return ' - '.join(parts) if parts else (codigo or str(equipamento_id))
+
     def name_get(self):
         """Display as 'TAG - Descrição'. Fallbacks to available pieces."""
-        result = []
-        for rec in self:
-            parts = []
-            if rec.tag:
-                parts.append(rec.tag)
-            if rec.nome:
-                parts.append(rec.nome)
-            display = ' - '.join(parts) if parts else (rec.codigo or str(rec.id))
-            result.append((rec.id, display))
-        return result
+        return [
+            (rec.id, self._formatar_exibicao(rec.id, rec.tag, rec.nome, rec.codigo))
+            for rec in self
+        ]
 
     @api.model
+    @perfilar()
     def name_search(self, name='', args=None, operator='ilike', limit=100):
+        """Busca por TAG ou descrição, com o TAG exato primeiro e depois prefixos.
+
+        Para o operador 'ilike' (usado pelo widget Many2one), resolve busca, ranking e
+        texto de exibição em uma única consulta apoiada pelos índices trigram de tag e
+        nome, sem reler os registros para montar o nome.
+        """
         args = args or []
-        if name:
-            # Search by tag OR description (nome)
-            domain = args + ['|', ('tag', operator, name), ('nome', operator, name)]
-            recs = self.search(domain, limit=limit)
-        else:
-            recs = self.search(args, limit=limit)
-        return recs.name_get()
+        if not name or operator != 'ilike':
+            if name:
+                domain = args + ['|', ('tag', operator, name), ('nome', operator, name)]
+            else:
+                domain = args
+            return self.search(domain, limit=limit).name_get()
+
+        termo = name.strip()
+        prefixo = _escapar_like(termo) + '%'
+        query = self._search(args + ['|', ('tag', 'ilike', termo), ('nome', 'ilike', termo)])
+        tabela = self._table
+        query.order = SQL(
+            """CASE WHEN upper(btrim(%s)) = upper(%s) THEN 0
+                    WHEN %s ILIKE %s THEN 1
+                    WHEN %s ILIKE %s THEN 2
+                    ELSE 3 END, %s, %s""",
+            SQL.identifier(tabela, 'tag'), termo,
+            SQL.identifier(tabela, 'tag'), prefixo,
+            SQL.identifier(tabela, 'nome'), prefixo,
+            SQL.identifier(tabela, 'tag'), SQL.identifier(tabela, 'id'),
+        )
+        query.limit = limit
+        self.env.cr.execute(query.select(
+            SQL.identifier(tabela, 'id'),
+            SQL.identifier(tabela, 'tag'),
+            SQL.identifier(tabela, 'nome'),
+            SQL.identifier(tabela, 'codigo'),
+        ))
+        return [
+            (equipamento_id, self._formatar_exibicao(equipamento_id, tag, nome, codigo))
+            for equipamento_id, tag, nome, codigo in self.env.cr.fetchall()
+        ]
 
     def action_view_calibracoes(self):
         """Ação para exibir as calibrações do equipamento em uma nova view"""
@@ -47,19 +174,36 @@ class Equipamento(models.Model):
 
     def action_print_history(self):
         """Gera o relatório PDF com todo o histórico do equipamento."""
+        if len(self) > 1:
+            return self.action_exportar_historico_lote()
         self.ensure_one()
         return self.env.ref('metrology_management.action_report_equipment_history').report_action(self)
 
+    def action_exportar_historico_lote(self):
+        """Agenda a exportação do histórico de vários equipamentos em segundo plano"""
+        exportacao = self.env['metrology.historico.exportacao'].create({
+            'name': 'Histórico de %s equipamentos' % len(self),
+            'equipamento_ids': [Command.set(self.ids)],
+        })
+        return {
+            'name': 'Exportação de Histórico',
+            'type': 'ir.actions.act_window',
+            'res_model': 'metrology.historico.exportacao',
+            'res_id': exportacao.id,
+            'view_mode': 'form',
+        }
+
     # Campos de Identificação
     codigo = fields.Char(
         string='Código',
         required=True,
         copy=False,
         readonly=True,
-        default=lambda self: self.env['ir.sequence'].next_by_code('metrology.equipamento')
+        default='Novo',
+        help='Atribuído pela sequência ao salvar.'
     )
-    tag = fields.Char(string='TAG/Etiqueta', required=True, tracking=True)
-    nome = fields.Char(string='Descrição', required=True, tracking=True)
+    tag = fields.Char(string='TAG/Etiqueta', required=True, tracking=True, index='trigram')
+    nome = fields.Char(string='Descrição', required=True, tracking=True, index='trigram')
     tipo = fields.Selection([
         ('dimensional', 'Dimensional'),
         ('eletrico', 'Elétrico'),
@@ -80,11 +224,17 @@ class Equipamento(models.Model):
     resolucao = fields.Char(string='Resolução', tracking=True)
     incerteza_maxima = fields.Float(string='Incerteza Máxima Permitida', tracking=True)
     erro_maximo_admissivel = fields.Float(string='Erro Máximo Admissível (EMA)', tracking=True)
+    regra_decisao_id = fields.Many2one(
+        'metrology.regra.decisao', string='Regra de Decisão', tracking=True,
+        default=lambda self: self.env['metrology.regra.decisao']._regra_padrao(),
+        help='Regra usada para calcular o resultado das calibrações. Sem regra, vale a regra padrão.')
     
     # Localização e Responsável
     localizacao = fields.Char(string='Localização Física', tracking=True)
     centro_custo = fields.Char(string='Centro de Custo')
     responsavel_id = fields.Many2one('res.users', string='Responsável Técnico', tracking=True)
+    company_id = fields.Many2one('res.company', string='Empresa', required=True, index=True, tracking=True,
+                                 default=lambda self: self.env.company)
     
     # Status Metrológico
     status_metrologico = fields.Selection([
@@ -98,49 +248,83 @@ class Equipamento(models.Model):
     
     # Calibração
     frequencia_calibracao = fields.Integer(string='Frequência de Calibração (meses)', default=12)
+    ultima_calibracao_id = fields.Many2one('metrology.calibracao', string='Última Calibração Aprovada',
+                                           compute='_compute_ultima_calibracao_id', store=True, readonly=True)
     ultima_calibracao = fields.Date(string='Data da Última Calibração', compute='_compute_datas_calibracao', store=True)
-    proxima_calibracao = fields.Date(string='Data da Próxima Calibração', compute='_compute_datas_calibracao', store=True)
-    dias_para_vencimento = fields.Integer(string='Dias para Vencimento', compute='_compute_dias_vencimento', store=True)
+    proxima_calibracao = fields.Date(string='Data da Próxima Calibração', compute='_compute_datas_calibracao',
+                                     store=True, index=True)
+    # Não armazenado: depende da data atual e ficaria desatualizado no banco
+    dias_para_vencimento = fields.Integer(string='Dias para Vencimento', compute='_compute_dias_vencimento',
+                                          search='_search_dias_para_vencimento')
     
     # Relacionamentos
     calibracao_ids = fields.One2many('metrology.calibracao', 'equipamento_id', string='Histórico de Calibrações')
+    calibracao_arquivo_ids = fields.One2many('metrology.calibracao.arquivo', 'equipamento_id',
+                                             string='Histórico Arquivado')
     nao_conformidade_ids = fields.One2many('metrology.nao_conformidade', 'equipamento_id', string='Não Conformidades')
+    deriva_ids = fields.One2many('metrology.deriva', 'equipamento_id', string='Análise de Deriva')
     
     # Campos de Controle
     active = fields.Boolean(default=True, string='Ativo')
     observacoes = fields.Text(string='Observações')
+
+    # Registro do último alerta enviado (evita repetir a mensagem de vencimento a cada execução)
+    alerta_status = fields.Selection(
+        selection=lambda self: self._fields['status_metrologico'].selection,
+        string='Último Status Alertado', copy=False, readonly=True)
+    alerta_data = fields.Date(string='Data do Último Alerta', copy=False, readonly=True)
+    # Sinalizado quando a calibração vigente depende de um padrão suspeito
+    rastreabilidade_suspeita = fields.Boolean(string='Rastreabilidade Suspeita', readonly=True, copy=False)
     
-    @api.depends('calibracao_ids', 'calibracao_ids.data_calibracao', 'calibracao_ids.state')
+    @api.depends('calibracao_ids.state', 'calibracao_ids.data_calibracao')
+    def _compute_ultima_calibracao_id(self):
+        """Localiza a última calibração aprovada de cada equipamento em uma única consulta"""
+        existentes = self.filtered(lambda e: isinstance(e.id, int))
+        ultima_por_equipamento = {}
+        if existentes:
+            self.env['metrology.calibracao'].flush_model(['equipamento_id', 'state', 'data_calibracao'])
+            # Usa o índice (equipamento_id, state, data_calibracao desc) de metrology_calibracao
+            self.env.cr.execute("""
+                SELECT DISTINCT ON (equipamento_id) equipamento_id, id
+                  FROM metrology_calibracao
+                 WHERE state = 'aprovado'
+                   AND equipamento_id = ANY(%s)
+              ORDER BY equipamento_id, data_calibracao DESC, id DESC
+            """, [existentes.ids])
+            ultima_por_equipamento = dict(self.env.cr.fetchall())
+        for equipamento in existentes:
+            equipamento.ultima_calibracao_id = ultima_por_equipamento.get(equipamento.id, False)
+        # Registros ainda não salvos (onchange) não estão no banco
+        for equipamento in self - existentes:
+            equipamento.ultima_calibracao_id = equipamento.calibracao_ids.filtered(
+                lambda c: c.state == 'aprovado'
+            ).sorted('data_calibracao', reverse=True)[:1]
+
+    @api.depends('ultima_calibracao_id.data_calibracao', 'frequencia_calibracao')
+    @perfilar()
     def _compute_datas_calibracao(self):
         """Calcula as datas de última e próxima calibração"""
         for equipamento in self:
-            calibracoes = equipamento.calibracao_ids.filtered(
-                lambda c: c.state == 'aprovado'
-            ).sorted('data_calibracao', reverse=True)
-            
-            if calibracoes:
-                equipamento.ultima_calibracao = calibracoes[0].data_calibracao
-                from dateutil.relativedelta import relativedelta
-                equipamento.proxima_calibracao = calibracoes[0].data_calibracao + relativedelta(
+            ultima_calibracao = equipamento.ultima_calibracao_id
+            if ultima_calibracao:
+                equipamento.ultima_calibracao = ultima_calibracao.data_calibracao
+                equipamento.proxima_calibracao = ultima_calibracao.data_calibracao + relativedelta(
                     months=equipamento.frequencia_calibracao
                 )
             else:
                 equipamento.ultima_calibracao = False
                 equipamento.proxima_calibracao = False
     
-    @api.depends('proxima_calibracao', 'calibracao_ids.resultado', 'calibracao_ids.state')
+    @api.depends('proxima_calibracao', 'ultima_calibracao_id.resultado')
     def _compute_status_metrologico(self):
         """Calcula o status metrológico com base nas calibrações"""
-        from datetime import date
         for equipamento in self:
             if not equipamento.proxima_calibracao:
                 equipamento.status_metrologico = 'fora_uso'
             elif equipamento.proxima_calibracao < date.today():
                 equipamento.status_metrologico = 'vencido'
             else:
-                ultima_calibracao = equipamento.calibracao_ids.filtered(
-                    lambda c: c.state == 'aprovado'
-                ).sorted('data_calibracao', reverse=True)[:1]
+                ultima_calibracao = equipamento.ultima_calibracao_id
                 
                 if ultima_calibracao and ultima_calibracao.resultado == 'conforme':
                     equipamento.status_metrologico = 'conforme'
@@ -152,17 +336,245 @@ class Equipamento(models.Model):
     @api.depends('proxima_calibracao')
     def _compute_dias_vencimento(self):
         """Calcula dias restantes até o vencimento da calibração"""
-        from datetime import date
         for equipamento in self:
             if equipamento.proxima_calibracao:
                 delta = equipamento.proxima_calibracao - date.today()
                 equipamento.dias_para_vencimento = delta.days
             else:
                 equipamento.dias_para_vencimento = 0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        # Números reservados em bloco: uma chamada à sequência por lote, e não por registro
+        sem_codigo = [vals for vals in vals_list if vals.get('codigo', 'Novo') == 'Novo']
+        for vals, codigo in zip(sem_codigo, self.env['ir.sequence']._next_block_by_code(
+                'metrology.equipamento', len(sem_codigo))):
+            vals['codigo'] = codigo
+        with self._traduzir_tag_duplicado([vals.get('tag') for vals in vals_list]):
+            return super().create(vals_list)
+
+    def write(self, vals):
+        # A troca de frequência recalcula todo o histórico em lote, fora do recálculo registro a registro
+        if 'frequencia_calibracao' in vals:
+            vals = dict(vals)
+            frequencia = vals.pop('frequencia_calibracao')
+            res = super().write(vals) if vals else True
+            self._aplicar_frequencia_calibracao(frequencia)
+        else:
+            res = super().write(vals)
+        if 'erro_maximo_admissivel' in vals or 'regra_decisao_id' in vals:
+            self.calibracao_ids._avaliar_decisao()
+        return res
+
+    def _aplicar_frequencia_calibracao(self, frequencia):
+        """Aplica uma nova frequência de calibração e propaga o efeito em lote.
+
+        Atualiza a frequência, a data de validade de todo o histórico de calibrações e a
+        próxima calibração com comandos SQL únicos baseados em aritmética de datas;
+        em seguida invalida o cache e recalcula o status pelo ORM, de modo que o
+        rastreamento registre apenas as mudanças efetivas. A alteração é registrada no
+        histórico de cada equipamento e a diferença é enviada ao planejamento.
+        """
+        if not self:
+            return
+        # As atualizações em SQL não passam pelo ORM: controles de acesso e a validação
+        # da frequência, que garante validade posterior à calibração (_check_dates), são feitos aqui
+        self.check_access_rights('write')
+        self.check_access_rule('write')
+        self._validar_frequencia(frequencia)
+        Calib = self.env['metrology.calibracao']
+        Planejamento = self.env['metrology.planejamento.carga']
+        self.flush_model()
+        Calib.flush_model(['equipamento_id', 'data_calibracao', 'data_validade'])
+        alterados = self.filtered(lambda e: e.frequencia_calibracao != frequencia)
+        anteriores = {equipamento.id: equipamento.frequencia_calibracao for equipamento in alterados}
+        atualizar_planejamento = Planejamento._planejamento_calculado()
+        if atualizar_planejamento:
+            antes = Planejamento._projetar(alterados.ids)
+        cr = self.env.cr
+        cr.execute("""
+            UPDATE metrology_equipamento
+               SET frequencia_calibracao = %(frequencia)s,
+                   proxima_calibracao = (ultima_calibracao + make_interval(months => %(frequencia)s))::date,
+                   write_uid = %(uid)s,
+                   write_date = (now() at time zone 'UTC')
+             WHERE id = ANY(%(ids)s)
+        """, {'frequencia': frequencia, 'uid': self.env.uid, 'ids': self.ids})
+        cr.execute("""
+            UPDATE metrology_calibracao
+               SET data_validade = (data_calibracao + make_interval(months => %(frequencia)s))::date
+             WHERE equipamento_id = ANY(%(ids)s)
+               AND data_calibracao IS NOT NULL
+        """, {'frequencia': frequencia, 'ids': self.ids})
+        self.invalidate_recordset(['frequencia_calibracao', 'proxima_calibracao', 'write_uid', 'write_date'])
+        Calib.invalidate_model(['data_validade'])
+
+        for ids in split_every(ROLLOVER_BATCH_SIZE, self.ids):
+            lote = self.browse(ids)
+            lote.modified(['proxima_calibracao'])
+            lote.flush_recordset()
+
+        if atualizar_planejamento:
+            Planejamento._atualizar_equipamentos(alterados.ids, antes)
+        alterados._message_log_batch({
+            equipamento_id: 'Frequência de calibração alterada de %s para %s meses; validade das calibrações '
+                            'e próxima calibração recalculadas.' % (anterior or '-', frequencia)
+            for equipamento_id, anterior in anteriores.items()
+        })
+
+    @api.model
+    def _validar_frequencia(self, frequencia):
+        if not frequencia or frequencia <= 0:
+            raise ValidationError('A frequência de calibração deve ser de pelo menos 1 mês.')
+
+    @api.constrains('frequencia_calibracao')
+    def _check_frequencia_calibracao(self):
+        for equipamento in self:
+            self._validar_frequencia(equipamento.frequencia_calibracao)
+
+    def _search_dias_para_vencimento(self, operator, value):
+        """Converte o filtro em dias para um filtro indexado sobre proxima_calibracao"""
+        if operator not in _OPERADORES_DIAS or not isinstance(value, int):
+            raise ValidationError('Operação não suportada para Dias para Vencimento.')
+        domain = [('proxima_calibracao', operator, date.today() + timedelta(days=value))]
+        # Equipamentos sem próxima calibração têm 0 dias para vencimento
+        if _OPERADORES_DIAS[operator](0, value):
+            domain = ['|', ('proxima_calibracao', '=', False)] + domain
+        return domain
+
+    @api.model
+    def _rollover_status_metrologico(self):
+        """Recalcula o status dos equipamentos cujo vencimento foi ultrapassado desde a última execução.
+
+        Usa o índice de proxima_calibracao para selecionar somente a faixa de datas que
+        cruzou o limite desde a última virada; o recálculo passa pelo ORM em lotes para
+        que o rastreamento registre apenas as mudanças efetivas de status.
+        """
+        ICP = self.env['ir.config_parameter'].sudo()
+        hoje = date.today()
+        domain = [
+            ('proxima_calibracao', '<', hoje),
+            ('status_metrologico', '!=', 'vencido'),
+        ]
+        # Cada empresa tem o próprio agendador e, portanto, a própria data da última virada
+        chave = 'metrology_management.rollover_ultima_data.%s' % self.env.company.id
+        domain.append(('company_id', '=', self.env.company.id))
+        ultima_execucao = ICP.get_param(chave)
+        if ultima_execucao:
+            domain.append(('proxima_calibracao', '>=', fields.Date.to_date(ultima_execucao)))
+        equipamentos = self.with_context(active_test=False).search(domain, order='id')
+
+        for ids in split_every(ROLLOVER_BATCH_SIZE, equipamentos.ids):
+            lote = self.browse(ids)
+            lote.modified(['proxima_calibracao'])
+            lote.flush_recordset()
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+
+        ICP.set_param(chave, fields.Date.to_string(hoje))
+        return len(equipamentos)
     
-    @api.constrains('tag')
+    def init(self):
+        """Garante a unicidade do TAG no banco entre os equipamentos ativos de cada empresa.
+
+        Por padrão a comparação ignora maiúsculas e espaços nas extremidades; com o
+        parâmetro de sistema metrology_management.tag_case_sensitive = True o índice
+        passa a comparar o TAG exato (aplicado na atualização do módulo).
+        """
+        manter = self._indice_tag()
+        for nome in INDICES_TAG_OBSOLETOS + tuple(INDICES_TAG):
+            if nome != manter:
+                self.env.cr.execute('DROP INDEX IF EXISTS %s' % nome)
+        try:
+            with self.env.cr.savepoint(flush=False):
+                self.env.cr.execute("""
+                    CREATE UNIQUE INDEX IF NOT EXISTS {nome}
+                        ON metrology_equipamento (company_id, {expressao}) WHERE active
+                """.format(nome=manter, expressao=INDICES_TAG[manter]))
+        except psycopg2.IntegrityError:
+            self.env.cr.execute("""
+                SELECT MIN(tag) FROM metrology_equipamento
+                 WHERE active GROUP BY company_id, {expressao} HAVING COUNT(*) > 1
+            """.format(expressao=INDICES_TAG[manter]))
+            _logger.warning(
+                'Índice único de TAG não criado: existem equipamentos ativos com TAG duplicado (%s)',
+                ', '.join(row[0] for row in self.env.cr.fetchall()))
+
+        # Paginação por chave do feed de alterações da API
+        criar_coluna_transacao(self.env.cr, 'metrology_equipamento')
+        # Virada de status e alertas por empresa (regra multiempresa + faixa de vencimento)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS metrology_equipamento_empresa_proxima_idx
+                ON metrology_equipamento (company_id, proxima_calibracao)
+        """)
+        criar_gatilho_write_date(self.env.cr, 'metrology_equipamento',
+                                 ['status_metrologico', 'ultima_calibracao', 'proxima_calibracao'])
+
+    @api.model
+    def _janela_alerta_dias(self):
+        """Dias de antecedência para considerar uma calibração próxima do vencimento"""
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.alerta_janela_dias', JANELA_ALERTA_PADRAO_DIAS)
+        try:
+            return max(int(valor), 0)
+        except (TypeError, ValueError):
+            return JANELA_ALERTA_PADRAO_DIAS
+
+    @api.model
+    def _tag_case_sensitive(self):
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.tag_case_sensitive', 'False').lower() in ('1', 'true')
+
+    @api.model
+    def _indice_tag(self):
+        if self._tag_case_sensitive():
+            return 'metrology_equipamento_empresa_tag_uniq'
+        return 'metrology_equipamento_empresa_tag_normalizado_uniq'
+
+    @contextmanager
+    def _traduzir_tag_duplicado(self, tags):
+        """Converte a violação do índice único de TAG na mesma mensagem de _check_tag_unique.
+
+        Na criação o INSERT é executado antes das restrições em Python, e o índice
+        dispara primeiro. O comando com erro é desfeito em um savepoint, e o cursor
+        continua utilizável por quem tratar o ValidationError. O savepoint não grava as
+        pendências na entrada: na restrição, o UPDATE do TAG precisa ocorrer dentro dele.
+        """
+        try:
+            with self.env.cr.savepoint(flush=False):
+                yield
+        except psycopg2.IntegrityError as erro:
+            # O cache ainda contém os valores desfeitos pelo savepoint
+            self.env.cr.clear()
+            if erro.diag.constraint_name not in INDICES_TAG:
+                raise
+            raise ValidationError('Já existe um equipamento cadastrado com este TAG nesta empresa: %s'
+                                  % ', '.join(sorted(filter(None, tags)))) from None
+
+    @api.constrains('tag', 'active', 'company_id')
     def _check_tag_unique(self):
-        """Valida unicidade do TAG"""
-        for equipamento in self:
-            if self.search_count([('tag', '=', equipamento.tag), ('id', '!=', equipamento.id)]) > 0:
-                raise ValidationError('Já existe um equipamento cadastrado com este TAG!')
+        """Valida unicidade do TAG por empresa com uma única consulta para todo o lote.
+
+        A garantia contra transações concorrentes vem do índice único parcial criado em
+        init(); esta verificação apenas lista, de uma vez, todos os TAGs duplicados.
+        """
+        ativos = self.filtered('active')
+        if not ativos:
+            return
+        with self._traduzir_tag_duplicado(ativos.mapped('tag')):
+            self.flush_model(['tag', 'active', 'company_id'])
+        expressao = INDICES_TAG[self._indice_tag()]
+        self.env.cr.execute("""
+            SELECT MIN(tag)
+              FROM metrology_equipamento
+             WHERE active
+               AND (company_id, {expressao}) IN (SELECT company_id, {expressao}
+                                                  FROM metrology_equipamento
+                                                 WHERE id = ANY(%s))
+          GROUP BY company_id, {expressao}
+            HAVING COUNT(*) > 1
+        """.format(expressao=expressao), [ativos.ids])
+        duplicados = sorted(row[0] for row in self.env.cr.fetchall())
+        if duplicados:
+            raise ValidationError('Já existe um equipamento cadastrado com este TAG nesta empresa: %s'
+                                  % ', '.join(duplicados))
@@ -0,0 +1,224 @@
+"""Gerador de frotas sintéticas para testes de carga.
+
+Uso, com o ambiente do docker-compose.yml:
+
+    docker compose exec odoo odoo shell -d <banco> --db_host db -r odoo -w odoo
+    >>> env['metrology.gerador.frota']._gerar(1000000, historico=5, semente=7)
+
+A mesma semente e a mesma data de referência produzem sempre os mesmos dados em um
+banco recém-criado.
+"""
+import csv
+import io
+import logging
+import random
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api
+
+from .regra_decisao import avaliar_regra
+
+_logger = logging.getLogger(__name__)
+
+GERADOR_BATCH_SIZE = 10000
+
+# Pesos padrão das distribuições (normalizados no sorteio)
+DISTRIBUICAO_STATUS = {'conforme': 0.80, 'nao_conforme': 0.05, 'vencido': 0.10, 'fora_uso': 0.05}
+DISTRIBUICAO_FREQUENCIA = {6: 0.2, 12: 0.6, 24: 0.2}
+DISTRIBUICAO_EMA = {0.1: 0.25, 0.5: 0.25, 1.0: 0.25, 2.0: 0.25}
+
+_COLUNAS_EQUIPAMENTO = [
+    'id', 'codigo', 'tag', 'nome', 'tipo', 'fabricante', 'centro_custo', 'frequencia_calibracao',
+    'erro_maximo_admissivel', 'regra_decisao_id', 'status_metrologico', 'ultima_calibracao',
+    'proxima_calibracao', 'active', 'company_id', 'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+_COLUNAS_CALIBRACAO = [
+    'id', 'name', 'equipamento_id', 'data_calibracao', 'data_validade', 'tipo_comprovacao', 'executor_id',
+    'padrao_id', 'erro_encontrado', 'incerteza_expandida', 'fator_abrangencia', 'resultado',
+    'resultado_manual', 'probabilidade_falsa_aceitacao', 'numero_certificado', 'state', 'company_id',
+    'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+_COLUNAS_NAO_CONFORMIDADE = [
+    'name', 'equipamento_id', 'data', 'descricao', 'ativo',
+    'create_uid', 'create_date', 'write_uid', 'write_date',
+]
+
+
+class _Sorteio:
+    """Sorteio ponderado determinístico sobre um dicionário {valor: peso}"""
+
+    def __init__(self, rng, pesos):
+        self.rng = rng
+        self.valores = list(pesos)
+        self.pesos = list(pesos.values())
+
+    def __call__(self):
+        return self.rng.choices(self.valores, self.pesos)[0]
+
+
+class GeradorFrota(models.AbstractModel):
+    _name = 'metrology.gerador.frota'
+    _description = 'Gerador de Frota Sintética'
+
+    def _commit(self):
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    def _copiar(self, tabela, colunas, linhas):
+        """Grava as linhas com COPY; None vira NULL"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(linhas)
+        buffer.seek(0)
+        self.env.cr.copy_expert('COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (tabela, ', '.join(colunas)), buffer)
+
+    def _reservar_ids(self, tabela, quantidade):
+        self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)", ['%s_id_seq' % tabela, quantidade])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def _gerar(self, equipamentos, historico=3, semente=42, data_referencia=None, tipos=None,
+               status=None, frequencias=None, padroes=None, executores=None):
+        """Gera equipamentos, calibrações aprovadas, padrões, executores e não conformidades.
+
+        :param equipamentos: quantidade de equipamentos
+        :param historico: calibrações aprovadas por equipamento calibrado
+        :param semente: semente do gerador pseudoaleatório
+        :param data_referencia: data da calibração mais recente possível (padrão: hoje)
+        :param tipos: pesos por tipo de equipamento (padrão: uniforme)
+        :param status: pesos do status pretendido (conforme, nao_conforme, vencido, fora_uso)
+        :param frequencias: pesos por frequência de calibração em meses
+        :param padroes: quantidade de padrões de medição (padrão: 1 a cada 1000 equipamentos)
+        :param executores: quantidade de laboratórios (padrão: 1 a cada 5000 equipamentos)
+
+        Os campos calculados armazenados (datas, status, resultado, última calibração)
+        são preenchidos com as mesmas regras dos métodos de cálculo, portanto nenhum
+        recálculo é necessário. Os lotes são gravados com COPY e, fora dos testes,
+        confirmados um a um; o registro de eventos de status é suspenso durante a carga.
+        Os registros pertencem à empresa do ambiente (use with_company para outra planta).
+        """
+        rng = random.Random(semente)
+        referencia = data_referencia or date.today()
+        hoje = date.today()
+        Equipamento = self.env['metrology.equipamento']
+        sortear_tipo = _Sorteio(rng, tipos or {tipo: 1 for tipo, _rotulo in Equipamento._fields['tipo'].selection})
+        sortear_status = _Sorteio(rng, status or DISTRIBUICAO_STATUS)
+        sortear_frequencia = _Sorteio(rng, frequencias or DISTRIBUICAO_FREQUENCIA)
+        sortear_ema = _Sorteio(rng, DISTRIBUICAO_EMA)
+        regra = self.env['metrology.regra.decisao']._regra_padrao()
+
+        executor_ids = self.env['metrology.parte_interessada'].create([{
+            'name': 'Laboratório Sintético %d' % indice,
+            'tipo': 'laboratorio',
+        } for indice in range(executores or max(equipamentos // 5000, 3))]).ids
+        padrao_ids = self.env['metrology.padrao_medicao'].create([{
+            'name': 'Padrão Sintético %d' % indice,
+            'incerteza_expandida': 0.01,
+        } for indice in range(padroes or max(equipamentos // 1000, 5))]).ids
+        self.env.flush_all()
+        self._commit()
+
+        uid = self.env.uid
+        company_id = self.env.company.id
+        agora = fields.Datetime.now()
+        totais = {'equipamentos': 0, 'calibracoes': 0, 'nao_conformidades': 0}
+        for inicio in range(0, equipamentos, GERADOR_BATCH_SIZE):
+            quantidade = min(GERADOR_BATCH_SIZE, equipamentos - inicio)
+            # Cargas sintéticas não devem alimentar os consumidores de eventos
+            self.env.cr.execute("SELECT set_config('metrology.sem_eventos', '1', true)")
+            ids = self._reservar_ids('metrology_equipamento', quantidade)
+            codigos = self.env['ir.sequence']._next_block_by_code('metrology.equipamento', quantidade)
+
+            linhas_equipamento = []
+            calibracoes = []
+            nao_conformidades = []
+            ultimas = []
+            for equipamento_id, codigo in zip(ids, codigos):
+                tipo = sortear_tipo()
+                pretendido = sortear_status()
+                frequencia = sortear_frequencia()
+                ema = sortear_ema()
+
+                datas = []
+                if pretendido != 'fora_uso' and historico > 0:
+                    limite = referencia - relativedelta(months=frequencia)
+                    if pretendido == 'vencido':
+                        ultima = limite - relativedelta(days=rng.randint(1, 180))
+                    else:
+                        ultima = referencia - relativedelta(days=rng.randrange(max((referencia - limite).days, 1)))
+                    datas = [ultima - relativedelta(months=frequencia * ciclo) for ciclo in range(historico)]
+
+                resultado_ultima = None
+                for ciclo, data_calibracao in enumerate(datas):
+                    incerteza = round(ema * rng.uniform(0.05, 0.2), 6)
+                    if ciclo == 0 and pretendido == 'nao_conforme':
+                        erro = rng.choice((-1, 1)) * ema * rng.uniform(1.05, 1.5)
+                    else:
+                        # Deriva lenta: erros maiores nas calibrações mais recentes
+                        erro = ema * rng.uniform(-0.6, 0.6) * (1 - 0.1 * ciclo)
+                    erro = round(erro, 6)
+                    resultado, probabilidade = avaliar_regra(
+                        regra.tipo or 'simples', regra.fator_banda_guarda, ema, erro, incerteza, 2.0)
+                    if ciclo == 0:
+                        resultado_ultima = resultado
+                    calibracoes.append([
+                        equipamento_id, data_calibracao, data_calibracao + relativedelta(months=frequencia),
+                        'calibracao', rng.choice(executor_ids), rng.choice(padrao_ids), erro, incerteza, 2.0,
+                        resultado, False, round(probabilidade, 6),
+                    ])
+
+                ultima_calibracao = datas[0] if datas else None
+                proxima = ultima_calibracao + relativedelta(months=frequencia) if datas else None
+                # Mesmas regras de _compute_status_metrologico
+                if not proxima:
+                    status_metrologico = 'fora_uso'
+                elif proxima < hoje:
+                    status_metrologico = 'vencido'
+                elif resultado_ultima in ('conforme', 'nao_conforme'):
+                    status_metrologico = resultado_ultima
+                else:
+                    status_metrologico = 'fora_uso'
+
+                linhas_equipamento.append([
+                    equipamento_id, codigo, 'SIM-%08d' % equipamento_id, 'Instrumento sintético %d' % equipamento_id,
+                    tipo, 'Fabricante %d' % rng.randrange(50), 'CC-%03d' % rng.randrange(100), frequencia, ema,
+                    regra.id or None, status_metrologico, ultima_calibracao, proxima, True, company_id,
+                    uid, agora, uid, agora,
+                ])
+                if datas:
+                    ultimas.append((equipamento_id, len(calibracoes) - len(datas)))
+                if status_metrologico == 'nao_conforme':
+                    nao_conformidades.append([
+                        'NC do instrumento %d' % equipamento_id, equipamento_id, ultima_calibracao,
+                        'Erro encontrado acima do EMA.', True, uid, agora, uid, agora,
+                    ])
+
+            self._copiar('metrology_equipamento', _COLUNAS_EQUIPAMENTO, linhas_equipamento)
+            if calibracoes:
+                calibracao_ids = self._reservar_ids('metrology_calibracao', len(calibracoes))
+                nomes = self.env['ir.sequence']._next_block_by_code('metrology.calibracao', len(calibracoes))
+                self._copiar('metrology_calibracao', _COLUNAS_CALIBRACAO, [
+                    [calibracao_id, nome] + linha + ['CERT-%s' % nome, 'aprovado', company_id, uid, agora, uid, agora]
+                    for calibracao_id, nome, linha in zip(calibracao_ids, nomes, calibracoes)
+                ])
+                # Inserida antes das calibrações, a referência circular é preenchida depois
+                self.env.cr.execute("""
+                    UPDATE metrology_equipamento e
+                       SET ultima_calibracao_id = u.calibracao_id
+                      FROM unnest(%s::int[], %s::int[]) AS u(equipamento_id, calibracao_id)
+                     WHERE e.id = u.equipamento_id
+                """, [[u[0] for u in ultimas], [calibracao_ids[u[1]] for u in ultimas]])
+            if nao_conformidades:
+                self._copiar('metrology_nao_conformidade', _COLUNAS_NAO_CONFORMIDADE, nao_conformidades)
+
+            totais['equipamentos'] += quantidade
+            totais['calibracoes'] += len(calibracoes)
+            totais['nao_conformidades'] += len(nao_conformidades)
+            self._commit()
+            _logger.info('Frota sintética: %s de %s equipamentos gerados', totais['equipamentos'], equipamentos)
+
+        self.env.cr.execute("SELECT set_config('metrology.sem_eventos', '', true)")
+        self.env.invalidate_all()
+        self.env['metrology.planejamento.carga']._recalcular()
+        return totais
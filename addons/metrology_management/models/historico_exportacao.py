@@ -0,0 +1,279 @@
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from odoo import models, fields, api, Command
+from odoo.tools import split_every
+from odoo.tools.pdf import PdfFileReader, PdfFileWriter
+
+_logger = logging.getLogger(__name__)
+
+# Campos das calibrações lidos pelo relatório de histórico, carregados de uma vez por lote
+HISTORICO_CAMPOS_CALIBRACAO = [
+    'name', 'equipamento_id', 'data_calibracao', 'data_validade', 'numero_certificado',
+    'resultado', 'tecnico_responsavel', 'state', 'executor_id', 'local_ensaio_id',
+    'padrao_id', 'temperatura', 'umidade', 'pressao', 'incerteza_expandida', 'observacoes',
+]
+
+HISTORICO_CAMPOS_ARQUIVO = [
+    'name', 'equipamento_id', 'data_calibracao', 'data_validade', 'numero_certificado', 'resultado', 'state',
+]
+
+# Tempo (segundos) que uma execução do agendador dedica aos lotes antes de se reagendar
+TEMPO_MAXIMO_EXECUCAO = 240
+# Tentativas de geração de um lote antes de ele ser deixado de fora do PDF final
+LOTE_TENTATIVAS = 3
+# Bloco de leitura ao copiar o PDF mesclado para o filestore
+BLOCO_COPIA = 1024 * 1024
+
+
+class HistoricoExportacao(models.Model):
+    _name = 'metrology.historico.exportacao'
+    _description = 'Exportação em Lote do Histórico de Equipamentos'
+    _inherit = ['mail.thread']
+    _order = 'id desc'
+
+    name = fields.Char(string='Descrição', required=True, default='Exportação de Histórico')
+    equipamento_ids = fields.Many2many('metrology.equipamento', string='Equipamentos', required=True)
+    tamanho_lote = fields.Integer(string='Equipamentos por Lote', default=50)
+    state = fields.Selection([
+        ('processando', 'Processando'),
+        ('concluido', 'Concluído'),
+        ('parcial', 'Concluído Parcialmente'),
+        ('erro', 'Erro'),
+    ], string='Status', default='processando', readonly=True, tracking=True)
+    lote_ids = fields.One2many('metrology.historico.exportacao.lote', 'exportacao_id', string='Lotes')
+    total_lotes = fields.Integer(string='Total de Lotes', compute='_compute_progresso')
+    lotes_concluidos = fields.Integer(string='Lotes Concluídos', compute='_compute_progresso')
+    progresso = fields.Float(string='Progresso', compute='_compute_progresso')
+    anexo_id = fields.Many2one('ir.attachment', string='Arquivo PDF', readonly=True)
+    mensagem_erro = fields.Text(string='Erro', readonly=True)
+
+    @api.depends('lote_ids.state')
+    def _compute_progresso(self):
+        for exportacao in self:
+            total = len(exportacao.lote_ids)
+            concluidos = len(exportacao.lote_ids.filtered(lambda l: l.state == 'concluido'))
+            exportacao.total_lotes = total
+            exportacao.lotes_concluidos = concluidos
+            exportacao.progresso = 100.0 * concluidos / total if total else 0.0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        exportacoes = super().create(vals_list)
+        exportacoes._criar_lotes()
+        self.env.ref('metrology_management.ir_cron_historico_exportacao')._trigger()
+        return exportacoes
+
+    def _criar_lotes(self):
+        """Divide os equipamentos de cada exportação em lotes de tamanho limitado"""
+        vals_list = []
+        for exportacao in self:
+            equipamentos = self.env['metrology.equipamento'].search(
+                [('id', 'in', exportacao.equipamento_ids.ids)], order='tag, id')
+            tamanho = max(exportacao.tamanho_lote, 1)
+            for sequencia, ids in enumerate(split_every(tamanho, equipamentos.ids), start=1):
+                vals_list.append({
+                    'exportacao_id': exportacao.id,
+                    'sequencia': sequencia,
+                    'equipamento_ids': [Command.set(list(ids))],
+                })
+        self.env['metrology.historico.exportacao.lote'].create(vals_list)
+
+    def action_baixar(self):
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % self.anexo_id.id,
+            'target': 'self',
+        }
+
+    def _commit(self):
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    @api.model
+    def _processar_lotes(self):
+        """Processa os lotes pendentes; executado pelo agendador.
+
+        Cada lote é reservado com FOR UPDATE SKIP LOCKED, portanto várias cópias deste
+        agendador podem trabalhar em paralelo como um conjunto de workers. Cada lote é
+        confirmado em sua própria transação; ao esgotar o tempo da execução, o
+        agendador é reagendado para continuar de onde parou. Um lote que falha volta
+        à fila (na próxima execução) até LOTE_TENTATIVAS vezes; depois disso fica de
+        fora e os demais lotes da exportação seguem normalmente.
+        """
+        inicio = time.monotonic()
+        Lote = self.env['metrology.historico.exportacao.lote']
+        falhas = []
+        while True:
+            self._finalizar_concluidas()
+            if time.monotonic() - inicio > TEMPO_MAXIMO_EXECUCAO:
+                self.env.ref('metrology_management.ir_cron_historico_exportacao')._trigger()
+                return
+            self.env.cr.execute("""
+                SELECT l.id
+                  FROM metrology_historico_exportacao_lote l
+                  JOIN metrology_historico_exportacao e ON e.id = l.exportacao_id
+                 WHERE l.state = 'pendente' AND e.state = 'processando'
+                   AND NOT l.id = ANY(%s::int[])
+              ORDER BY l.exportacao_id, l.sequencia
+                 LIMIT 1
+                   FOR UPDATE OF l SKIP LOCKED
+            """, [falhas])
+            row = self.env.cr.fetchone()
+            if not row:
+                if falhas:
+                    self.env.ref('metrology_management.ir_cron_historico_exportacao')._trigger()
+                return
+            lote = Lote.browse(row[0])
+            try:
+                with self.env.cr.savepoint():
+                    lote._renderizar()
+            except Exception as e:
+                _logger.exception('Falha ao gerar o lote %s da exportação de histórico', lote.id)
+                falhas.append(lote.id)
+                tentativas = lote.tentativas + 1
+                lote.write({
+                    'tentativas': tentativas,
+                    'state': 'erro' if tentativas >= LOTE_TENTATIVAS else 'pendente',
+                    'mensagem_erro': str(e),
+                })
+            self._commit()
+
+    @api.model
+    def _finalizar_concluidas(self):
+        """Mescla os PDFs das exportações sem lotes pendentes (gerados ou com falha definitiva)"""
+        self.env.cr.execute("""
+            SELECT e.id
+              FROM metrology_historico_exportacao e
+             WHERE e.state = 'processando'
+               AND NOT EXISTS (SELECT 1
+                                 FROM metrology_historico_exportacao_lote l
+                                WHERE l.exportacao_id = e.id AND l.state = 'pendente')
+               FOR UPDATE SKIP LOCKED
+        """)
+        for exportacao in self.browse([row[0] for row in self.env.cr.fetchall()]):
+            exportacao._mesclar_pdfs()
+            self._commit()
+
+    def _criar_anexo_de_arquivo(self, arquivo, vals):
+        """Cria um anexo copiando o arquivo em blocos para o filestore.
+
+        Equivale a informar raw, sem carregar o conteúdo inteiro em memória: o checksum
+        é calculado em blocos e o arquivo é copiado para o caminho endereçado por ele.
+        """
+        Anexo = self.env['ir.attachment']
+        if Anexo._storage() != 'file':
+            return Anexo.create(dict(vals, raw=arquivo.read()))
+        sha = hashlib.sha1()
+        tamanho = 0
+        for bloco in iter(lambda: arquivo.read(BLOCO_COPIA), b''):
+            sha.update(bloco)
+            tamanho += len(bloco)
+        checksum = sha.hexdigest()
+        fname = '%s/%s' % (checksum[:2], checksum)
+        caminho = Anexo._full_path(fname)
+        if not os.path.exists(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+            arquivo.seek(0)
+            with open(caminho, 'wb') as destino:
+                shutil.copyfileobj(arquivo, destino, BLOCO_COPIA)
+            # Removido pela coleta de lixo do filestore se a transação for desfeita
+            Anexo._mark_for_gc(fname)
+        return Anexo.create(dict(vals, store_fname=fname, file_size=tamanho, checksum=checksum))
+
+    def _mesclar_pdfs(self):
+        """Junta os PDFs dos lotes gerados lendo cada um do filestore sob demanda.
+
+        Lotes com falha definitiva ficam de fora e a exportação termina como parcial.
+        """
+        self.ensure_one()
+        gerados = self.lote_ids.filtered(lambda l: l.state == 'concluido').sorted('sequencia')
+        falhas = self.lote_ids - gerados
+        if not gerados:
+            self.write({'state': 'erro', 'mensagem_erro': '\n'.join(falhas.mapped('mensagem_erro'))})
+            return
+        writer = PdfFileWriter()
+        arquivos = []
+        try:
+            for lote in gerados:
+                anexo = lote.anexo_id
+                if anexo.store_fname:
+                    arquivo = open(anexo._full_path(anexo.store_fname), 'rb')
+                else:
+                    arquivo = io.BytesIO(anexo.raw)
+                arquivos.append(arquivo)
+                reader = PdfFileReader(arquivo, strict=False)
+                for pagina in range(reader.getNumPages()):
+                    writer.addPage(reader.getPage(pagina))
+            with tempfile.TemporaryFile() as saida:
+                writer.write(saida)
+                saida.seek(0)
+                anexo = self._criar_anexo_de_arquivo(saida, {
+                    'name': '%s.pdf' % self.name,
+                    'mimetype': 'application/pdf',
+                    'res_model': self._name,
+                    'res_id': self.id,
+                })
+        finally:
+            for arquivo in arquivos:
+                arquivo.close()
+
+        gerados.anexo_id.unlink()
+        if falhas:
+            self.write({
+                'anexo_id': anexo.id,
+                'state': 'parcial',
+                'mensagem_erro': '\n'.join('Lote %s: %s' % (lote.sequencia, lote.mensagem_erro) for lote in falhas),
+            })
+            corpo = 'Exportação concluída parcialmente: %s de %s equipamentos (%s lotes com falha).' % (
+                len(gerados.equipamento_ids), len(self.equipamento_ids), len(falhas))
+        else:
+            self.write({'anexo_id': anexo.id, 'state': 'concluido'})
+            corpo = 'Exportação concluída: %s equipamentos.' % len(self.equipamento_ids)
+        self.message_post(body=corpo, attachment_ids=[anexo.id], partner_ids=self.create_uid.partner_id.ids)
+
+
+class HistoricoExportacaoLote(models.Model):
+    _name = 'metrology.historico.exportacao.lote'
+    _description = 'Lote da Exportação de Histórico'
+    _order = 'exportacao_id, sequencia'
+
+    exportacao_id = fields.Many2one('metrology.historico.exportacao', string='Exportação',
+                                    required=True, ondelete='cascade', index=True)
+    sequencia = fields.Integer(string='Sequência')
+    equipamento_ids = fields.Many2many('metrology.equipamento', string='Equipamentos')
+    state = fields.Selection([
+        ('pendente', 'Pendente'),
+        ('concluido', 'Concluído'),
+        ('erro', 'Erro'),
+    ], string='Status', default='pendente', index=True)
+    tentativas = fields.Integer(string='Tentativas com Falha', readonly=True)
+    mensagem_erro = fields.Text(string='Erro', readonly=True)
+    anexo_id = fields.Many2one('ir.attachment', string='PDF do Lote')
+
+    def _renderizar(self):
+        """Gera o PDF do lote com todas as calibrações carregadas em uma única consulta"""
+        self.ensure_one()
+        equipamentos = self.equipamento_ids
+        self.env['metrology.calibracao'].search(
+            [('equipamento_id', 'in', equipamentos.ids)]
+        ).fetch(HISTORICO_CAMPOS_CALIBRACAO)
+        self.env['metrology.calibracao.arquivo'].search(
+            [('equipamento_id', 'in', equipamentos.ids)]
+        ).fetch(HISTORICO_CAMPOS_ARQUIVO)
+        pdf, _formato = self.env['ir.actions.report']._render_qweb_pdf(
+            'metrology_management.action_report_equipment_history', res_ids=equipamentos.ids)
+        anexo = self.env['ir.attachment'].create({
+            'name': 'historico_lote_%s.pdf' % self.sequencia,
+            'raw': pdf,
+            'mimetype': 'application/pdf',
+            'res_model': self._name,
+            'res_id': self.id,
+        })
+        self.write({'state': 'concluido', 'anexo_id': anexo.id})
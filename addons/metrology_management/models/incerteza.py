@@ -0,0 +1,383 @@
+import bisect
+import logging
+import math
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError
+from odoo.tools import split_every
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ORCAMENTO_BATCH_SIZE = 1000
+SIMULACOES_PADRAO = 100000
+
+# Divisores que convertem a semi-amplitude de cada distribuição em incerteza padrão
+DIVISORES = {
+    'retangular': math.sqrt(3),
+    'triangular': math.sqrt(6),
+    'u': math.sqrt(2),
+}
+
+# Condições de referência usadas nas componentes ambientais
+REFERENCIA_AMBIENTAL = {
+    'temperatura': 20.0,
+    'umidade': 50.0,
+    'pressao': 1013.25,
+}
+
+# Fatores t de Student do GUM (JCGM 100, tabela G.2) por graus de liberdade efetivos
+_TABELA_T_GRAUS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20,
+                   25, 30, 35, 40, 45, 50, 100]
+_TABELA_T = {
+    '95': [12.71, 4.30, 3.18, 2.78, 2.57, 2.45, 2.36, 2.31, 2.26, 2.23, 2.20, 2.18, 2.16, 2.14,
+           2.13, 2.12, 2.11, 2.10, 2.09, 2.09, 2.06, 2.04, 2.03, 2.02, 2.01, 2.01, 1.984],
+    '95.45': [13.97, 4.53, 3.31, 2.87, 2.65, 2.52, 2.43, 2.37, 2.32, 2.28, 2.25, 2.23, 2.21, 2.20,
+              2.18, 2.17, 2.16, 2.15, 2.14, 2.13, 2.11, 2.09, 2.07, 2.06, 2.06, 2.05, 2.025],
+    '99': [63.66, 9.92, 5.84, 4.60, 4.03, 3.71, 3.50, 3.36, 3.25, 3.17, 3.11, 3.05, 3.01, 2.98,
+           2.95, 2.92, 2.90, 2.88, 2.86, 2.85, 2.79, 2.75, 2.72, 2.70, 2.69, 2.68, 2.626],
+}
+_T_INFINITO = {'95': 1.960, '95.45': 2.000, '99': 2.576}
+_PROBABILIDADES = {'95': 0.95, '95.45': 0.9545, '99': 0.99}
+
+
+def fator_t(graus_liberdade, nivel_confianca):
+    """Fator t para os graus de liberdade efetivos (0 = infinitos).
+
+    Valores intermediários usam a linha tabelada imediatamente inferior, o que é conservador.
+    """
+    if not graus_liberdade or graus_liberdade > _TABELA_T_GRAUS[-1] * 10:
+        return _T_INFINITO[nivel_confianca]
+    posicao = max(bisect.bisect_right(_TABELA_T_GRAUS, graus_liberdade) - 1, 0)
+    return _TABELA_T[nivel_confianca][posicao]
+
+
+class OrcamentoIncerteza(models.Model):
+    _name = 'metrology.incerteza.orcamento'
+    _description = 'Orçamento de Incerteza de Medição'
+    _rec_name = 'calibracao_id'
+
+    calibracao_id = fields.Many2one('metrology.calibracao', string='Calibração', required=True,
+                                    ondelete='cascade', index=True)
+    componente_ids = fields.One2many('metrology.incerteza.componente', 'orcamento_id',
+                                     string='Componentes de Incerteza', copy=True)
+    metodo = fields.Selection([
+        ('gum', 'GUM (Lei de Propagação)'),
+        ('monte_carlo', 'Monte Carlo (GUM Suplemento 1)'),
+    ], string='Método', required=True, default='gum')
+    nivel_confianca = fields.Selection([
+        ('95', '95%'),
+        ('95.45', '95,45%'),
+        ('99', '99%'),
+    ], string='Nível da Confiança', required=True, default='95.45')
+    numero_simulacoes = fields.Integer(string='Número de Simulações', default=lambda self: self._simulacoes_padrao())
+
+    # Resultados gravados por _avaliar
+    incerteza_combinada = fields.Float(string='Incerteza Combinada (uc)', readonly=True, digits=(16, 6))
+    graus_liberdade_efetivos = fields.Float(string='Graus de Liberdade Efetivos', readonly=True,
+                                            help='Welch–Satterthwaite. 0 indica graus de liberdade infinitos.')
+    fator_abrangencia = fields.Float(string='Fator de Abrangência (k)', readonly=True, digits=(16, 3))
+    incerteza_expandida = fields.Float(string='Incerteza Expandida (U)', readonly=True, digits=(16, 6))
+    limite_inferior = fields.Float(string='Limite Inferior do Intervalo', readonly=True, digits=(16, 6))
+    limite_superior = fields.Float(string='Limite Superior do Intervalo', readonly=True, digits=(16, 6))
+    data_avaliacao = fields.Datetime(string='Data da Avaliação', readonly=True)
+
+    _sql_constraints = [
+        ('calibracao_uniq', 'unique(calibracao_id)', 'Cada calibração possui um único orçamento de incerteza.'),
+    ]
+
+    @api.model
+    def _simulacoes_padrao(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.incerteza_simulacoes', SIMULACOES_PADRAO)
+        try:
+            return max(int(valor), 1000)
+        except (TypeError, ValueError):
+            return SIMULACOES_PADRAO
+
+    def action_avaliar(self):
+        self._avaliar()
+
+    def action_gerar_componentes_ambientais(self):
+        """Inclui as componentes de temperatura, umidade e pressão que ainda não existem"""
+        Componente = self.env['metrology.incerteza.componente']
+        rotulos = dict(Componente._fields['origem'].selection)
+        valores = []
+        for orcamento in self:
+            existentes = set(orcamento.componente_ids.mapped('origem'))
+            for origem in REFERENCIA_AMBIENTAL:
+                if origem not in existentes:
+                    valores.append({
+                        'orcamento_id': orcamento.id,
+                        'name': '%s (referência %s)' % (rotulos[origem], REFERENCIA_AMBIENTAL[origem]),
+                        'origem': origem,
+                        'tipo_avaliacao': 'b',
+                        'distribuicao': 'retangular',
+                        'coeficiente_sensibilidade': 0.0,
+                    })
+        Componente.create(valores)
+
+    def _avaliar(self):
+        """Avalia os orçamentos em lote e propaga U e k para as calibrações"""
+        gum = self.filtered(lambda o: o.metodo == 'gum')
+        for ids in split_every(ORCAMENTO_BATCH_SIZE, gum.ids):
+            self.browse(ids)._avaliar_gum()
+        for orcamento in self - gum:
+            orcamento._avaliar_monte_carlo()
+
+    def _ler_componentes(self):
+        """Retorna (orcamento_id, u_i, c_i, ν_i) de todas as componentes em uma consulta"""
+        Componente = self.env['metrology.incerteza.componente']
+        Componente.flush_model(['orcamento_id', 'incerteza_padrao', 'coeficiente_sensibilidade',
+                                'graus_liberdade', 'distribuicao'])
+        self.env.cr.execute("""
+            SELECT orcamento_id, incerteza_padrao, coeficiente_sensibilidade, graus_liberdade, distribuicao
+              FROM metrology_incerteza_componente
+             WHERE orcamento_id = ANY(%s)
+        """, [self.ids])
+        return self.env.cr.fetchall()
+
+    def _avaliar_gum(self):
+        """Lei de propagação: uc² = Σ(cᵢ·uᵢ)², ν_eff por Welch–Satterthwaite e k pela tabela t"""
+        linhas = self._ler_componentes()
+        variancia = defaultdict(float)
+        denominador = defaultdict(float)
+        if numpy is not None and linhas:
+            posicoes = {orcamento_id: i for i, orcamento_id in enumerate(self.ids)}
+            indice = numpy.array([posicoes[linha[0]] for linha in linhas])
+            contribuicao = numpy.array([(linha[1] or 0.0) * (linha[2] or 0.0) for linha in linhas]) ** 2
+            graus = numpy.array([linha[3] or 0 for linha in linhas], dtype=float)
+            finitos = graus > 0
+            soma = numpy.bincount(indice, weights=contribuicao, minlength=len(self))
+            soma_ws = numpy.bincount(indice[finitos], weights=contribuicao[finitos] ** 2 / graus[finitos],
+                                     minlength=len(self))
+            variancia.update(zip(self.ids, soma.tolist()))
+            denominador.update(zip(self.ids, soma_ws.tolist()))
+        else:
+            for orcamento_id, incerteza, coeficiente, graus, _distribuicao in linhas:
+                termo = ((incerteza or 0.0) * (coeficiente or 0.0)) ** 2
+                variancia[orcamento_id] += termo
+                if graus:
+                    denominador[orcamento_id] += termo ** 2 / graus
+
+        resultados = []
+        for orcamento in self:
+            var = variancia[orcamento.id]
+            # Graus infinitos (0) quando nenhuma componente tem graus de liberdade finitos
+            graus_efetivos = var ** 2 / denominador[orcamento.id] if denominador[orcamento.id] else 0.0
+            k = fator_t(graus_efetivos, orcamento.nivel_confianca)
+            incerteza_combinada = math.sqrt(var)
+            resultados.append((orcamento.id, incerteza_combinada, graus_efetivos, k,
+                               k * incerteza_combinada, -k * incerteza_combinada, k * incerteza_combinada))
+        self._gravar_resultados(resultados)
+
+    def _avaliar_monte_carlo(self):
+        """Propaga as distribuições por simulação (GUM Suplemento 1) para o modelo Y = Σ cᵢ·Xᵢ"""
+        self.ensure_one()
+        if numpy is None:
+            raise UserError('A biblioteca numpy é necessária para a avaliação por Monte Carlo.')
+        linhas = self._ler_componentes()
+        simulacoes = max(self.numero_simulacoes or 0, 1000)
+        gerador = numpy.random.default_rng()
+        y = numpy.zeros(simulacoes)
+        for _orcamento_id, incerteza, coeficiente, graus, distribuicao in linhas:
+            u = incerteza or 0.0
+            if distribuicao == 'retangular':
+                amostra = gerador.uniform(-1.0, 1.0, simulacoes) * u * DIVISORES['retangular']
+            elif distribuicao == 'triangular':
+                amostra = gerador.triangular(-1.0, 0.0, 1.0, simulacoes) * u * DIVISORES['triangular']
+            elif distribuicao == 'u':
+                amostra = numpy.sin(2 * numpy.pi * gerador.uniform(size=simulacoes)) * u * DIVISORES['u']
+            elif graus and graus > 2:
+                # t de Student escalada para que o desvio padrão seja u (GUM S1, 6.4.9)
+                amostra = gerador.standard_t(graus, simulacoes) * u * math.sqrt((graus - 2) / graus)
+            else:
+                amostra = gerador.normal(0.0, u, simulacoes) if u else numpy.zeros(simulacoes)
+            y += (coeficiente or 0.0) * amostra
+        probabilidade = _PROBABILIDADES[self.nivel_confianca]
+        inferior, superior = numpy.quantile(y, [(1 - probabilidade) / 2, (1 + probabilidade) / 2])
+        incerteza_combinada = float(numpy.std(y, ddof=1))
+        expandida = float(superior - inferior) / 2
+        k = expandida / incerteza_combinada if incerteza_combinada else 0.0
+        self._gravar_resultados([(self.id, incerteza_combinada, 0.0, k, expandida, float(inferior), float(superior))])
+
+    def _gravar_resultados(self, resultados):
+        """Grava os resultados com um único comando e os propaga para as calibrações"""
+        if not resultados:
+            return
+        self.check_access_rights('write')
+        self.check_access_rule('write')
+        colunas = [list(coluna) for coluna in zip(*resultados)]
+        cr = self.env.cr
+        cr.execute("""
+            UPDATE metrology_incerteza_orcamento o
+               SET incerteza_combinada = r.uc,
+                   graus_liberdade_efetivos = r.graus,
+                   fator_abrangencia = r.k,
+                   incerteza_expandida = r.expandida,
+                   limite_inferior = r.inferior,
+                   limite_superior = r.superior,
+                   data_avaliacao = now() at time zone 'UTC',
+                   write_uid = %s,
+                   write_date = now() at time zone 'UTC'
+              FROM unnest(%s::int[], %s::float8[], %s::float8[], %s::float8[], %s::float8[],
+                          %s::float8[], %s::float8[]) AS r(id, uc, graus, k, expandida, inferior, superior)
+             WHERE o.id = r.id
+        """, [self.env.uid] + colunas)
+        self.invalidate_model()
+        self.browse(colunas[0])._propagar_calibracoes()
+
+    def _propagar_calibracoes(self):
+        """Copia U e k dos orçamentos para as calibrações em aberto, registrando a alteração.
+
+        Calibrações aprovadas mantêm os valores do certificado emitido; quando o orçamento
+        passa a divergir deles, apenas uma nota é registrada para revisão.
+        """
+        Calibracao = self.env['metrology.calibracao']
+        Calibracao.flush_model(['incerteza_expandida', 'fator_abrangencia', 'state'])
+        cr = self.env.cr
+        cr.execute("""
+            SELECT c.id, c.state = 'aprovado', c.incerteza_expandida, c.fator_abrangencia,
+                   o.incerteza_expandida, o.fator_abrangencia
+              FROM metrology_incerteza_orcamento o
+              JOIN metrology_calibracao c ON c.id = o.calibracao_id
+             WHERE o.id = ANY(%s)
+               AND (c.incerteza_expandida IS DISTINCT FROM o.incerteza_expandida
+                    OR c.fator_abrangencia IS DISTINCT FROM o.fator_abrangencia)
+        """, [self.ids])
+        alteradas, divergentes = {}, {}
+        for calibracao_id, aprovada, u_anterior, k_anterior, u, k in cr.fetchall():
+            valores = (u_anterior or 0.0, k_anterior or 0.0, u or 0.0, k or 0.0)
+            (divergentes if aprovada else alteradas)[calibracao_id] = valores
+        if divergentes:
+            Calibracao.browse(divergentes)._message_log_batch({
+                calibracao_id: 'Orçamento de incerteza reavaliado com U = %g (k = %g), diferente do certificado '
+                               'aprovado (U = %g, k = %g). A calibração não foi alterada.'
+                               % (u, k, u_anterior, k_anterior)
+                for calibracao_id, (u_anterior, k_anterior, u, k) in divergentes.items()
+            })
+        if not alteradas:
+            return
+        abertas = Calibracao.browse(alteradas)
+        abertas.check_access_rights('write')
+        abertas.check_access_rule('write')
+        cr.execute("""
+            UPDATE metrology_calibracao c
+               SET incerteza_expandida = o.incerteza_expandida,
+                   fator_abrangencia = o.fator_abrangencia,
+                   write_uid = %s,
+                   write_date = now() at time zone 'UTC'
+              FROM metrology_incerteza_orcamento o
+             WHERE o.calibracao_id = c.id
+               AND c.id = ANY(%s)
+        """, [self.env.uid, abertas.ids])
+        abertas.invalidate_recordset(['incerteza_expandida', 'fator_abrangencia', 'write_uid', 'write_date'])
+        abertas._message_log_batch({
+            calibracao_id: 'Incerteza expandida atualizada pelo orçamento de incerteza: U de %g para %g, '
+                           'k de %g para %g.' % (u_anterior, u, k_anterior, k)
+            for calibracao_id, (u_anterior, k_anterior, u, k) in alteradas.items()
+        })
+        # A nova incerteza pode mudar o resultado da regra de decisão
+        abertas._avaliar_decisao()
+
+    @api.model
+    def _reavaliar_por_padroes(self, padrao_ids):
+        """Reavalia todos os orçamentos que usam os padrões informados"""
+        self.env['metrology.incerteza.componente'].flush_model(['orcamento_id', 'padrao_id', 'incerteza_padrao'])
+        self.env.cr.execute("""
+            SELECT DISTINCT orcamento_id
+              FROM metrology_incerteza_componente
+             WHERE origem = 'padrao'
+               AND padrao_id = ANY(%s)
+        """, [list(padrao_ids)])
+        orcamentos = self.browse([row[0] for row in self.env.cr.fetchall()])
+        # Monte Carlo é reavaliado sob demanda; a simulação de milhares de orçamentos não cabe aqui
+        orcamentos.filtered(lambda o: o.metodo == 'gum')._avaliar()
+        return orcamentos
+
+
+class ComponenteIncerteza(models.Model):
+    _name = 'metrology.incerteza.componente'
+    _description = 'Componente do Orçamento de Incerteza'
+    _order = 'orcamento_id, sequence, id'
+
+    orcamento_id = fields.Many2one('metrology.incerteza.orcamento', string='Orçamento', required=True,
+                                   ondelete='cascade', index=True)
+    calibracao_id = fields.Many2one(related='orcamento_id.calibracao_id')
+    sequence = fields.Integer(default=10)
+    name = fields.Char(string='Grandeza de Entrada', required=True)
+    origem = fields.Selection([
+        ('manual', 'Informada'),
+        ('padrao', 'Padrão de Medição'),
+        ('temperatura', 'Temperatura'),
+        ('umidade', 'Umidade Relativa'),
+        ('pressao', 'Pressão Atmosférica'),
+    ], string='Origem', required=True, default='manual')
+    padrao_id = fields.Many2one('metrology.padrao_medicao', string='Padrão de Medição', index=True)
+    tipo_avaliacao = fields.Selection([
+        ('a', 'Tipo A'),
+        ('b', 'Tipo B'),
+    ], string='Avaliação', required=True, default='b')
+    distribuicao = fields.Selection([
+        ('normal', 'Normal'),
+        ('retangular', 'Retangular'),
+        ('triangular', 'Triangular'),
+        ('u', 'Forma de U'),
+    ], string='Distribuição', required=True, default='normal')
+    valor = fields.Float(string='Valor', digits=(16, 6),
+                         help='Incerteza expandida (distribuição normal) ou semi-amplitude (demais distribuições).')
+    divisor_normal = fields.Float(string='Fator de Abrangência da Entrada', default=1.0,
+                                  help='Divisor do valor informado para a distribuição normal.')
+    coeficiente_sensibilidade = fields.Float(string='Coeficiente de Sensibilidade (c)', default=1.0, digits=(16, 6))
+    graus_liberdade = fields.Integer(string='Graus de Liberdade', default=0, help='0 = infinitos.')
+    incerteza_padrao = fields.Float(string='Incerteza Padrão (u)', compute='_compute_incerteza_padrao',
+                                    store=True, digits=(16, 6))
+    contribuicao = fields.Float(string='Contribuição |c·u|', compute='_compute_incerteza_padrao',
+                                store=True, digits=(16, 6))
+
+    @api.depends('origem', 'valor', 'distribuicao', 'divisor_normal', 'coeficiente_sensibilidade',
+                 'padrao_id.incerteza_expandida', 'padrao_id.fator_abrangencia',
+                 'orcamento_id.calibracao_id.temperatura', 'orcamento_id.calibracao_id.umidade',
+                 'orcamento_id.calibracao_id.pressao')
+    def _compute_incerteza_padrao(self):
+        for componente in self:
+            if componente.origem == 'padrao':
+                padrao = componente.padrao_id
+                u = padrao.incerteza_expandida / (padrao.fator_abrangencia or 2.0) if padrao else 0.0
+            elif componente.origem in REFERENCIA_AMBIENTAL:
+                # Desvio em relação à condição de referência tratado como distribuição retangular
+                medido = componente.orcamento_id.calibracao_id[componente.origem]
+                semi_amplitude = abs(medido - REFERENCIA_AMBIENTAL[componente.origem]) if medido else 0.0
+                u = semi_amplitude / DIVISORES['retangular']
+            elif componente.distribuicao == 'normal':
+                u = componente.valor / (componente.divisor_normal or 1.0)
+            else:
+                u = componente.valor / DIVISORES[componente.distribuicao]
+            componente.incerteza_padrao = u
+            componente.contribuicao = abs(componente.coeficiente_sensibilidade * u)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        componentes = super().create(vals_list)
+        componentes.orcamento_id.filtered(lambda o: o.metodo == 'gum')._avaliar()
+        componentes.filtered('padrao_id').orcamento_id.calibracao_id._sincronizar_suspeita()
+        return componentes
+
+    def write(self, vals):
+        orcamentos = self.orcamento_id
+        res = super().write(vals)
+        (orcamentos | self.orcamento_id).filtered(lambda o: o.metodo == 'gum')._avaliar()
+        if 'padrao_id' in vals or 'orcamento_id' in vals:
+            (orcamentos | self.orcamento_id).calibracao_id._sincronizar_suspeita()
+        return res
+
+    def unlink(self):
+        orcamentos = self.orcamento_id
+        res = super().unlink()
+        orcamentos.exists().filtered(lambda o: o.metodo == 'gum')._avaliar()
+        return res
@@ -0,0 +1,49 @@
+import logging
+
+from odoo import models, api
+
+_logger = logging.getLogger(__name__)
+
+
+class IrSequence(models.Model):
+    _inherit = 'ir.sequence'
+
+    @api.model
+    def _next_block_by_code(self, sequence_code, quantidade):
+        """Reserva `quantidade` números da sequência em uma única chamada.
+
+        Equivale a chamar next_by_code `quantidade` vezes, mas com uma consulta por
+        bloco: a implementação padrão usa nextval sobre generate_series (números não
+        utilizados viram lacunas, como em next_by_code) e a implementação sem lacunas
+        trava a linha da sequência uma única vez. Sequências com intervalos de datas
+        recaem na chamada por número.
+        """
+        if quantidade <= 0:
+            return []
+        self.check_access_rights('read')
+        company_id = self.env.company.id
+        sequencia = self.sudo().search(
+            [('code', '=', sequence_code), ('company_id', 'in', [company_id, False])],
+            order='company_id', limit=1)
+        if not sequencia:
+            _logger.debug("Nenhuma sequência encontrada para o código '%s' na empresa atual.", sequence_code)
+            return [False] * quantidade
+        if sequencia.use_date_range:
+            return [sequencia._next() for _i in range(quantidade)]
+
+        if sequencia.implementation == 'standard':
+            self.env.cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)",
+                                ['ir_sequence_%03d' % sequencia.id, quantidade])
+            numeros = [row[0] for row in self.env.cr.fetchall()]
+        else:
+            passo = sequencia.number_increment
+            self.env.cr.execute("""
+                UPDATE ir_sequence
+                   SET number_next = number_next + %(passo)s * %(quantidade)s
+                 WHERE id = %(id)s
+             RETURNING number_next - %(passo)s * %(quantidade)s
+            """, {'passo': passo, 'quantidade': quantidade, 'id': sequencia.id})
+            inicio = self.env.cr.fetchone()[0]
+            sequencia.invalidate_recordset(['number_next'])
+            numeros = [inicio + passo * indice for indice in range(quantidade)]
+        return [sequencia.get_next_char(numero) for numero in numeros]
@@ -7,6 +7,9 @@ class LocalEnsaio(models.Model):
 
     name = fields.Char(string='Nome', required=True)
     endereco = fields.Char(string='Endereço')
+    company_id = fields.Many2one('res.company', string='Empresa', index=True,
+                                 default=lambda self: self.env.company,
+                                 help='Laboratório da planta. Vazio: compartilhado entre as empresas.')
     observacoes = fields.Text(string='Observações')
 
 
@@ -21,6 +24,8 @@ class ParteInteressada(models.Model):
         ('fornecedor', 'Fornecedor'),
     ], string='Tipo')
     contato = fields.Char(string='Contato')
+    capacidade_mensal = fields.Integer(string='Capacidade Mensal (calibrações)',
+                                       help='Limite usado no nivelamento do planejamento. 0 = sem limite.')
     observacoes = fields.Text(string='Observações')
 
 
@@ -1,4 +1,91 @@
-from odoo import models, fields
+from odoo import models, fields, api
+from odoo.exceptions import ValidationError
+
+# Campos que alteram a incerteza padrão transferida aos orçamentos de incerteza
+CAMPOS_INCERTEZA = {'incerteza_expandida', 'fator_abrangencia'}
+
+# Fecho transitivo da cadeia de rastreabilidade: padrões que dependem das raízes, as
+# calibrações executadas com eles (diretamente ou no orçamento de incerteza) e os
+# equipamentos cuja calibração vigente é uma dessas calibrações
+_IMPACTO = """
+    WITH RECURSIVE padroes(id) AS (
+        SELECT unnest(%(raizes)s::int[])
+         UNION
+        SELECT r.padrao_id
+          FROM metrology_padrao_referencia_rel r
+          JOIN padroes p ON p.id = r.referencia_id
+    ),
+    calibracoes AS (
+        SELECT c.id
+          FROM metrology_calibracao c
+         WHERE c.padrao_id IN (SELECT id FROM padroes)
+           AND c.state != 'cancelado'
+         UNION
+        SELECT o.calibracao_id
+          FROM metrology_incerteza_componente ic
+          JOIN metrology_incerteza_orcamento o ON o.id = ic.orcamento_id
+          JOIN metrology_calibracao c ON c.id = o.calibracao_id
+         WHERE ic.padrao_id IN (SELECT id FROM padroes)
+           AND c.state != 'cancelado'
+    ),
+    equipamentos AS (
+        SELECT e.id
+          FROM metrology_equipamento e
+         WHERE e.ultima_calibracao_id IN (SELECT id FROM calibracoes)
+    )
+"""
+
+# Recalcula as sinalizações dos registros informados a partir de todos os padrões suspeitos:
+# marca os que dependem de algum deles e desmarca os demais (p. ex. equipamentos recalibrados)
+_SINCRONIZAR = """
+    WITH RECURSIVE padroes(id) AS (
+        SELECT id FROM metrology_padrao_medicao WHERE suspeito
+         UNION
+        SELECT r.padrao_id
+          FROM metrology_padrao_referencia_rel r
+          JOIN padroes p ON p.id = r.referencia_id
+    ),
+    candidatas AS (
+        SELECT unnest(%(calibracao_ids)s::int[]) AS id
+         UNION
+        SELECT ultima_calibracao_id FROM metrology_equipamento WHERE id = ANY(%(equipamento_ids)s::int[])
+    ),
+    suspeitas AS (
+        SELECT c.id
+          FROM metrology_calibracao c
+         WHERE c.id IN (SELECT id FROM candidatas)
+           AND c.state != 'cancelado'
+           AND (c.padrao_id IN (SELECT id FROM padroes)
+                OR EXISTS (SELECT 1
+                             FROM metrology_incerteza_componente ic
+                             JOIN metrology_incerteza_orcamento o ON o.id = ic.orcamento_id
+                            WHERE o.calibracao_id = c.id
+                              AND ic.padrao_id IN (SELECT id FROM padroes)))
+    ),
+    padroes_atualizados AS (
+        UPDATE metrology_padrao_medicao t
+           SET rastreabilidade_suspeita = t.id IN (SELECT id FROM padroes)
+         WHERE t.id = ANY(%(padrao_ids)s::int[])
+           AND t.rastreabilidade_suspeita IS DISTINCT FROM (t.id IN (SELECT id FROM padroes))
+     RETURNING t.id
+    ), calibracoes_atualizadas AS (
+        UPDATE metrology_calibracao t
+           SET rastreabilidade_suspeita = t.id IN (SELECT id FROM suspeitas)
+         WHERE t.id = ANY(%(calibracao_ids)s::int[])
+           AND t.rastreabilidade_suspeita IS DISTINCT FROM (t.id IN (SELECT id FROM suspeitas))
+     RETURNING t.id
+    ), equipamentos_atualizados AS (
+        UPDATE metrology_equipamento t
+           SET rastreabilidade_suspeita = COALESCE(t.ultima_calibracao_id IN (SELECT id FROM suspeitas), FALSE)
+         WHERE t.id = ANY(%(equipamento_ids)s::int[])
+           AND t.rastreabilidade_suspeita IS DISTINCT FROM
+               COALESCE(t.ultima_calibracao_id IN (SELECT id FROM suspeitas), FALSE)
+     RETURNING t.id
+    )
+    SELECT (SELECT count(*) FROM padroes_atualizados),
+           (SELECT count(*) FROM calibracoes_atualizadas),
+           (SELECT count(*) FROM equipamentos_atualizados)
+"""
 
 
 class PadraoMedicao(models.Model):
@@ -13,6 +100,155 @@ class PadraoMedicao(models.Model):
     # Campo referenciado por metrology.calibracao.rastreabilidade
     rastreabilidade = fields.Char(string='Rastreabilidade', help='Identificação da rastreabilidade do padrão')
 
+    # Cadeia de rastreabilidade: padrões contra os quais este padrão foi calibrado
+    padrao_referencia_ids = fields.Many2many(
+        'metrology.padrao_medicao', 'metrology_padrao_referencia_rel', 'padrao_id', 'referencia_id',
+        string='Padrões de Referência')
+    padrao_dependente_ids = fields.Many2many(
+        'metrology.padrao_medicao', 'metrology_padrao_referencia_rel', 'referencia_id', 'padrao_id',
+        string='Padrões Dependentes', readonly=True)
+
+    # Certificado do próprio padrão considerado inválido (raiz da suspeita)
+    suspeito = fields.Boolean(string='Certificado Suspeito', readonly=True, copy=False)
+    # Afetado por um padrão suspeito, diretamente ou pela cadeia de rastreabilidade
+    rastreabilidade_suspeita = fields.Boolean(string='Rastreabilidade Suspeita', readonly=True, copy=False)
+
+    # Incerteza declarada no certificado do padrão
+    incerteza_expandida = fields.Float(string='Incerteza Expandida (U)', digits=(16, 6))
+    fator_abrangencia = fields.Float(string='Fator de Abrangência (k)', default=2.0)
+
     observacoes = fields.Text(string='Observações')
 
-    active = fields.Boolean(default=True)
\ No newline at end of file
+    active = fields.Boolean(default=True)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if CAMPOS_INCERTEZA.intersection(vals):
+            self.env['metrology.incerteza.orcamento']._reavaliar_por_padroes(self.ids)
+        return res
+
+    @api.constrains('padrao_referencia_ids')
+    def _check_ciclo_rastreabilidade(self):
+        if self._has_cycle('padrao_referencia_ids'):
+            raise ValidationError('A cadeia de rastreabilidade não pode conter ciclos: '
+                                  'um padrão não pode depender, direta ou indiretamente, de si mesmo.')
+
+    def _flush_rastreabilidade(self):
+        self.flush_model(['padrao_referencia_ids', 'suspeito', 'rastreabilidade_suspeita'])
+        self.env['metrology.calibracao'].flush_model(['padrao_id', 'state', 'rastreabilidade_suspeita'])
+        self.env['metrology.incerteza.componente'].flush_model(['padrao_id', 'orcamento_id'])
+        self.env['metrology.equipamento'].flush_model(['ultima_calibracao_id', 'rastreabilidade_suspeita'])
+
+    def _impacto(self):
+        """Retorna os ids de padrões, calibrações e equipamentos que dependem destes padrões"""
+        self._flush_rastreabilidade()
+        self.env.cr.execute(_IMPACTO + """
+            SELECT (SELECT array_agg(id) FROM padroes),
+                   (SELECT array_agg(id) FROM calibracoes),
+                   (SELECT array_agg(id) FROM equipamentos)
+        """, {'raizes': self.ids})
+        padroes, calibracoes, equipamentos = self.env.cr.fetchone()
+        return {
+            'padrao_ids': padroes or [],
+            'calibracao_ids': calibracoes or [],
+            'equipamento_ids': equipamentos or [],
+        }
+
+    def _propagar_suspeita(self):
+        """Marca em um único comando todos os registros que dependem destes padrões"""
+        self.env.cr.execute(_IMPACTO + """
+            , padroes_marcados AS (
+                UPDATE metrology_padrao_medicao
+                   SET rastreabilidade_suspeita = TRUE
+                 WHERE id IN (SELECT id FROM padroes)
+                   AND rastreabilidade_suspeita IS NOT TRUE
+             RETURNING id
+            ), calibracoes_marcadas AS (
+                UPDATE metrology_calibracao
+                   SET rastreabilidade_suspeita = TRUE
+                 WHERE id IN (SELECT id FROM calibracoes)
+                   AND rastreabilidade_suspeita IS NOT TRUE
+             RETURNING id
+            ), equipamentos_marcados AS (
+                UPDATE metrology_equipamento
+                   SET rastreabilidade_suspeita = TRUE
+                 WHERE id IN (SELECT id FROM equipamentos)
+                   AND rastreabilidade_suspeita IS NOT TRUE
+             RETURNING id
+            )
+            SELECT (SELECT count(*) FROM padroes_marcados),
+                   (SELECT count(*) FROM calibracoes_marcadas),
+                   (SELECT count(*) FROM equipamentos_marcados)
+        """, {'raizes': self.ids})
+        marcados = self.env.cr.fetchone()
+        self.invalidate_model(['rastreabilidade_suspeita'])
+        self.env['metrology.calibracao'].invalidate_model(['rastreabilidade_suspeita'])
+        self.env['metrology.equipamento'].invalidate_model(['rastreabilidade_suspeita'])
+        return marcados
+
+    @api.model
+    def _sincronizar_suspeita(self, padrao_ids=(), calibracao_ids=(), equipamento_ids=()):
+        """Recalcula a rastreabilidade suspeita dos registros informados.
+
+        Chamado ao criar ou alterar calibrações e componentes de incerteza (novas
+        dependências de padrões suspeitos, recalibrações) e ao remover uma suspeita.
+        """
+        self._flush_rastreabilidade()
+        self.env.cr.execute(_SINCRONIZAR, {
+            'padrao_ids': list(padrao_ids),
+            'calibracao_ids': list(calibracao_ids),
+            'equipamento_ids': list(equipamento_ids),
+        })
+        atualizados = self.env.cr.fetchone()
+        self.invalidate_model(['rastreabilidade_suspeita'])
+        self.env['metrology.calibracao'].invalidate_model(['rastreabilidade_suspeita'])
+        self.env['metrology.equipamento'].invalidate_model(['rastreabilidade_suspeita'])
+        return atualizados
+
+    @api.model
+    def _ha_suspeitos(self):
+        self.flush_model(['suspeito'])
+        self.env.cr.execute("SELECT 1 FROM metrology_padrao_medicao WHERE suspeito LIMIT 1")
+        return bool(self.env.cr.fetchone())
+
+    def action_marcar_suspeito(self):
+        """Marca os padrões como suspeitos e sinaliza tudo o que depende deles"""
+        self.check_access_rights('write')
+        self.check_access_rule('write')
+        self.write({'suspeito': True})
+        self._flush_rastreabilidade()
+        padroes, calibracoes, equipamentos = self._propagar_suspeita()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'type': 'warning',
+                'sticky': True,
+                'message': 'Rastreabilidade suspeita: %s padrões, %s calibrações e %s equipamentos sinalizados.' % (
+                    padroes, calibracoes, equipamentos),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
+
+    def action_remover_suspeita(self):
+        """Remove a suspeita destes padrões e recalcula somente as sinalizações que dependiam deles.
+
+        Registros também dependentes de outro padrão suspeito continuam sinalizados.
+        """
+        self.check_access_rights('write')
+        self.check_access_rule('write')
+        impacto = self._impacto()
+        self.write({'suspeito': False})
+        self._sincronizar_suspeita(**impacto)
+        return True
+
+    def action_ver_impacto(self):
+        """Lista os equipamentos que dependem destes padrões"""
+        impacto = self._impacto()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': 'Equipamentos Afetados',
+            'res_model': 'metrology.equipamento',
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', impacto['equipamento_ids'])],
+        }
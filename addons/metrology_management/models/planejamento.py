@@ -0,0 +1,258 @@
+import logging
+from collections import defaultdict
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+HORIZONTE_PADRAO_MESES = 24
+
+# Mesma convenção de metrology_dashboard_kpi: COALESCE permite o índice único com colunas nulas
+_CHAVE_CARGA = "company_id, mes, COALESCE(executor_id, 0), COALESCE(local_ensaio_id, 0), COALESCE(tipo, '')"
+
+# Projeta as próximas calibrações de cada equipamento ativo dentro do horizonte. Calibrações
+# vencidas entram no mês inicial; executor e local vêm da última calibração aprovada.
+# Equipamentos sem frequência (nula ou zero) entram apenas com a próxima calibração.
+_PROJECAO = """
+    WITH base AS (
+        SELECT e.company_id, NULLIF(e.tipo, '') AS tipo, c.executor_id, c.local_ensaio_id,
+               COALESCE(e.frequencia_calibracao, 0) AS frequencia,
+               GREATEST(e.proxima_calibracao, %(inicio)s) AS primeira
+          FROM metrology_equipamento e
+     LEFT JOIN metrology_calibracao c ON c.id = e.ultima_calibracao_id
+         WHERE e.active
+           AND e.proxima_calibracao IS NOT NULL
+           AND e.proxima_calibracao < %(fim)s
+           {filtro}
+    )
+    SELECT b.company_id,
+           date_trunc('month', b.primeira + make_interval(months => n.k * b.frequencia))::date AS mes,
+           b.executor_id, b.local_ensaio_id, b.tipo, COUNT(*) AS quantidade
+      FROM base b
+CROSS JOIN LATERAL generate_series(
+               0, CASE WHEN b.frequencia > 0 THEN %(horizonte)s / b.frequencia ELSE 0 END) AS n(k)
+     WHERE b.primeira + make_interval(months => n.k * b.frequencia) < %(fim)s
+  GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+class PlanejamentoPendente(models.Model):
+    _name = 'metrology.planejamento.pendente'
+    _description = 'Diferenças Pendentes do Planejamento de Calibrações'
+    _order = 'id'
+    _log_access = False
+
+    # Somente inserções (transações dos usuários) e exclusões (_aplicar_pendentes), via SQL
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True)
+    mes = fields.Date(string='Mês', readonly=True)
+    executor_id = fields.Many2one('metrology.parte_interessada', string='Executor', readonly=True)
+    local_ensaio_id = fields.Many2one('metrology.local_ensaios', string='Local do Ensaio', readonly=True)
+    tipo = fields.Char(string='Tipo', readonly=True)
+    quantidade = fields.Integer(string='Diferença', readonly=True)
+
+
+class PlanejamentoCarga(models.Model):
+    _name = 'metrology.planejamento.carga'
+    _description = 'Planejamento da Carga de Calibrações'
+    _order = 'mes, executor_id, local_ensaio_id, tipo'
+
+    # Linhas mantidas em SQL por _recalcular e por _aplicar_pendentes
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True, index=True)
+    mes = fields.Date(string='Mês', readonly=True)
+    executor_id = fields.Many2one('metrology.parte_interessada', string='Executor', readonly=True)
+    local_ensaio_id = fields.Many2one('metrology.local_ensaios', string='Local do Ensaio', readonly=True)
+    tipo = fields.Selection(selection='_selection_tipo', string='Tipo', readonly=True)
+    quantidade = fields.Integer(string='Demanda Projetada', readonly=True, group_operator='sum')
+    quantidade_nivelada = fields.Integer(string='Carga Nivelada', readonly=True, group_operator='sum',
+                                         help='Demanda após antecipar o excesso dos meses acima da '
+                                              'capacidade mensal do executor.')
+
+    def _selection_tipo(self):
+        return self.env['metrology.equipamento']._fields['tipo'].selection
+
+    def init(self):
+        self.env.cr.execute("DROP INDEX IF EXISTS metrology_planejamento_carga_chave_uniq")
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS metrology_planejamento_carga_empresa_chave_uniq
+                ON metrology_planejamento_carga (%s)
+        """ % _CHAVE_CARGA)
+        # Projeções anteriores à separação por empresa são reconstruídas
+        self.env.cr.execute("SELECT 1 FROM metrology_planejamento_carga WHERE company_id IS NULL LIMIT 1")
+        if self.env.cr.fetchone():
+            self._recalcular()
+
+    @api.model
+    def _horizonte_meses(self):
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.planejamento_horizonte_meses', HORIZONTE_PADRAO_MESES)
+        try:
+            return max(int(valor), 1)
+        except (TypeError, ValueError):
+            return HORIZONTE_PADRAO_MESES
+
+    @api.model
+    def _parametros_projecao(self):
+        inicio = date.today().replace(day=1)
+        horizonte = self._horizonte_meses()
+        return {'inicio': inicio, 'fim': inicio + relativedelta(months=horizonte), 'horizonte': horizonte}
+
+    @api.model
+    def _recalcular(self):
+        """Reconstrói toda a projeção e o nivelamento (executado diariamente via agendador)"""
+        self.env['metrology.equipamento'].flush_model()
+        self.env['metrology.calibracao'].flush_model(['executor_id', 'local_ensaio_id'])
+        cr = self.env.cr
+        cr.execute("DELETE FROM metrology_planejamento_carga")
+        # Diferenças confirmadas antes deste snapshot já estão refletidas na nova projeção
+        cr.execute("DELETE FROM metrology_planejamento_pendente")
+        cr.execute("""
+            INSERT INTO metrology_planejamento_carga
+                   (company_id, mes, executor_id, local_ensaio_id, tipo, quantidade, quantidade_nivelada)
+            SELECT p.company_id, p.mes, p.executor_id, p.local_ensaio_id, p.tipo, p.quantidade, p.quantidade
+              FROM (%s) p
+        """ % _PROJECAO.format(filtro=''), self._parametros_projecao())
+        _logger.info('Planejamento de calibrações recalculado: %s grupos', cr.rowcount)
+        self._nivelar()
+        self.invalidate_model()
+
+    @api.model
+    def _projetar(self, equipamento_ids):
+        """Retorna a projeção de um conjunto de equipamentos como {chave: quantidade}"""
+        if not equipamento_ids:
+            return {}
+        self.env['metrology.equipamento'].flush_model()
+        self.env['metrology.calibracao'].flush_model(['executor_id', 'local_ensaio_id'])
+        self.env.cr.execute(
+            _PROJECAO.format(filtro='AND e.id = ANY(%(ids)s)'),
+            dict(self._parametros_projecao(), ids=list(equipamento_ids)))
+        return {tuple(row[:5]): row[5] for row in self.env.cr.fetchall()}
+
+    @api.model
+    def _planejamento_calculado(self):
+        self.env.cr.execute("SELECT 1 FROM metrology_planejamento_carga LIMIT 1")
+        return bool(self.env.cr.fetchone())
+
+    @api.model
+    def _atualizar_equipamentos(self, equipamento_ids, antes):
+        """Enfileira a diferença entre a projeção anterior (antes) e a atual dos equipamentos.
+
+        Chamado após criar, aprovar ou alterar calibrações. A transação do usuário apenas
+        insere as diferenças em metrology_planejamento_pendente: as linhas agregadas, que
+        aprovações simultâneas disputariam, são atualizadas depois por _aplicar_pendentes.
+        """
+        depois = self._projetar(equipamento_ids)
+        delta = defaultdict(int)
+        for chave, quantidade in depois.items():
+            delta[chave] += quantidade
+        for chave, quantidade in antes.items():
+            delta[chave] -= quantidade
+        delta = {chave: quantidade for chave, quantidade in delta.items() if quantidade}
+        if not delta:
+            return
+        chaves = list(delta)
+        self.env.cr.execute("""
+            INSERT INTO metrology_planejamento_pendente
+                   (company_id, mes, executor_id, local_ensaio_id, tipo, quantidade)
+            SELECT *
+              FROM unnest(%s::int[], %s::date[], %s::int[], %s::int[], %s::varchar[], %s::int[])
+        """, [[c[i] for c in chaves] for i in range(5)] + [list(delta.values())])
+        self.env.ref('metrology_management.ir_cron_planejamento_pendentes')._trigger()
+
+    @api.model
+    def _aplicar_pendentes(self):
+        """Soma à projeção as diferenças enfileiradas e nivela os executores afetados.
+
+        Executado pelo agendador (disparado após cada enfileiramento): um único worker
+        atualiza as linhas agregadas, sem disputa com as transações dos usuários.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            WITH pendentes AS (
+                DELETE FROM metrology_planejamento_pendente
+                  RETURNING company_id, mes, executor_id, local_ensaio_id, tipo, quantidade
+            )
+            INSERT INTO metrology_planejamento_carga AS t
+                   (company_id, mes, executor_id, local_ensaio_id, tipo, quantidade, quantidade_nivelada)
+            SELECT company_id, mes, executor_id, local_ensaio_id, tipo, SUM(quantidade), SUM(quantidade)
+              FROM pendentes
+          GROUP BY company_id, mes, executor_id, local_ensaio_id, tipo
+                ON CONFLICT ({chave})
+                DO UPDATE SET quantidade = t.quantidade + EXCLUDED.quantidade
+         RETURNING executor_id
+        """.format(chave=_CHAVE_CARGA))
+        executores = {row[0] for row in cr.fetchall()}
+        if executores:
+            self._nivelar(executores)
+            self.invalidate_model()
+        return len(executores)
+
+    @api.model
+    def _nivelar(self, executor_ids=None):
+        """Nivela a carga mensal de cada executor conforme a capacidade cadastrada.
+
+        O excesso de um mês é antecipado para o mês anterior (calibrar antes do vencimento
+        é sempre permitido), do fim do horizonte para o início. O que não couber no mês
+        inicial permanece nele como sobrecarga. Executores sem capacidade não são limitados.
+        A capacidade é do executor: a carga de todas as empresas atendidas conta para ela.
+        """
+        cr = self.env.cr
+        filtro = ''
+        params = {}
+        if executor_ids is not None:
+            filtro = 'WHERE COALESCE(executor_id, 0) = ANY(%(executores)s)'
+            params['executores'] = [executor_id or 0 for executor_id in executor_ids]
+        cr.execute("UPDATE metrology_planejamento_carga SET quantidade_nivelada = quantidade " + filtro, params)
+        cr.execute("DELETE FROM metrology_planejamento_carga " + (filtro + ' AND' if filtro else 'WHERE')
+                   + " quantidade <= 0", params)
+
+        self.env['metrology.parte_interessada'].flush_model(['capacidade_mensal'])
+        cr.execute("""
+            SELECT c.executor_id, p.capacidade_mensal, c.mes, c.company_id, c.local_ensaio_id, c.tipo, c.quantidade
+              FROM metrology_planejamento_carga c
+              JOIN metrology_parte_interessada p ON p.id = c.executor_id
+             WHERE p.capacidade_mensal > 0
+        """ + (' AND c.executor_id = ANY(%(executores)s)' if filtro else ''), params)
+        capacidades = {}
+        cargas = defaultdict(lambda: defaultdict(dict))
+        for executor_id, capacidade, mes, company_id, local_ensaio_id, tipo, quantidade in cr.fetchall():
+            capacidades[executor_id] = capacidade
+            cargas[executor_id][mes][(company_id, local_ensaio_id, tipo)] = quantidade
+        if not cargas:
+            return
+
+        inicio = self._parametros_projecao()['inicio']
+        niveladas = []
+        for executor_id, meses in cargas.items():
+            capacidade = capacidades[executor_id]
+            mes = max(meses)
+            while mes > inicio:
+                linhas = meses.get(mes, {})
+                excesso = sum(linhas.values()) - capacidade
+                if excesso > 0:
+                    anterior = meses.setdefault(mes - relativedelta(months=1), {})
+                    for sub in sorted(linhas, key=lambda s: (s[0], s[1] or 0, s[2] or '')):
+                        mover = min(excesso, linhas[sub])
+                        linhas[sub] -= mover
+                        anterior[sub] = anterior.get(sub, 0) + mover
+                        excesso -= mover
+                        if not excesso:
+                            break
+                mes -= relativedelta(months=1)
+            for mes, linhas in meses.items():
+                for (company_id, local_ensaio_id, tipo), quantidade in linhas.items():
+                    niveladas.append((company_id, mes, executor_id, local_ensaio_id, tipo, quantidade))
+
+        # Meses que só recebem carga antecipada entram com demanda projetada zero
+        cr.execute("""
+            INSERT INTO metrology_planejamento_carga AS t
+                   (company_id, mes, executor_id, local_ensaio_id, tipo, quantidade, quantidade_nivelada)
+            SELECT d.company_id, d.mes, d.executor_id, d.local_ensaio_id, d.tipo, 0, d.quantidade_nivelada
+              FROM unnest(%s::int[], %s::date[], %s::int[], %s::int[], %s::varchar[], %s::int[])
+                   AS d(company_id, mes, executor_id, local_ensaio_id, tipo, quantidade_nivelada)
+                ON CONFLICT ({chave})
+                DO UPDATE SET quantidade_nivelada = EXCLUDED.quantidade_nivelada
+        """.format(chave=_CHAVE_CARGA), [list(coluna) for coluna in zip(*niveladas)])
+        cr.execute("DELETE FROM metrology_planejamento_carga WHERE quantidade = 0 AND quantidade_nivelada = 0")
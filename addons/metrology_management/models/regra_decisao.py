@@ -0,0 +1,71 @@
+import math
+
+from odoo import models, fields, api
+
+# Campos da regra que exigem reavaliar todo o histórico dos equipamentos que a utilizam
+CAMPOS_AVALIACAO_REGRA = {'tipo', 'fator_banda_guarda'}
+
+
+def _normal_cdf(x):
+    return 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+
+
+def avaliar_regra(tipo, fator_banda_guarda, ema, erro, incerteza_expandida, fator_abrangencia):
+    """Aplica a regra de decisão a um resultado de calibração.
+
+    Retorna (resultado, probabilidade de falsa aceitação). A probabilidade considera o erro
+    verdadeiro distribuído normalmente em torno do erro encontrado com desvio U/k e só é
+    calculada para resultados aceitos.
+    """
+    erro_abs = abs(erro or 0.0)
+    incerteza = abs(incerteza_expandida or 0.0)
+    if tipo == 'banda_guarda':
+        # Aceitação protegida: o limite de aceitação é o EMA reduzido de w·U
+        resultado = 'conforme' if erro_abs <= ema - fator_banda_guarda * incerteza else 'nao_conforme'
+    elif tipo == 'ilac_g8':
+        # ILAC-G8:2009 em três zonas
+        if erro_abs + incerteza <= ema:
+            resultado = 'conforme'
+        elif erro_abs - incerteza > ema:
+            resultado = 'nao_conforme'
+        else:
+            resultado = 'condicional'
+    else:
+        # Aceitação simples (risco compartilhado)
+        resultado = 'conforme' if erro_abs <= ema else 'nao_conforme'
+
+    if resultado != 'conforme':
+        return resultado, 0.0
+    desvio = incerteza / (fator_abrangencia or 2.0)
+    if not desvio:
+        return resultado, 0.0
+    erro = erro or 0.0
+    probabilidade = _normal_cdf((-ema - erro) / desvio) + 1.0 - _normal_cdf((ema - erro) / desvio)
+    return resultado, probabilidade
+
+
+class RegraDecisao(models.Model):
+    _name = 'metrology.regra.decisao'
+    _description = 'Regra de Decisão de Conformidade'
+    _order = 'name'
+
+    name = fields.Char(string='Nome', required=True)
+    tipo = fields.Selection([
+        ('simples', 'Aceitação Simples (risco compartilhado)'),
+        ('banda_guarda', 'Aceitação com Banda de Guarda'),
+        ('ilac_g8', 'ILAC-G8 (conforme / condicional / não conforme)'),
+    ], string='Tipo', required=True, default='simples')
+    fator_banda_guarda = fields.Float(string='Fator da Banda de Guarda (w)', default=1.0,
+                                      help='A banda de guarda vale w·U, sendo U a incerteza expandida.')
+    descricao = fields.Text(string='Descrição')
+    active = fields.Boolean(default=True)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if CAMPOS_AVALIACAO_REGRA.intersection(vals):
+            self.env['metrology.calibracao']._avaliar_decisao_por_regras(self.ids)
+        return res
+
+    @api.model
+    def _regra_padrao(self):
+        return self.env.ref('metrology_management.regra_decisao_padrao', raise_if_not_found=False) or self.browse()
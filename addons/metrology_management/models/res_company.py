@@ -0,0 +1,51 @@
+from odoo import models, fields, api
+
+# Agendadores replicados por empresa: campo da empresa -> (agendador modelo, método)
+AGENDADORES_EMPRESA = {
+    'metrology_cron_rollover_id': ('metrology_management.ir_cron_status_rollover', '_rollover_status_metrologico'),
+    'metrology_cron_alertas_id': ('metrology_management.ir_cron_calibration_alerts', '_send_calibration_alerts'),
+}
+
+
+class ResCompany(models.Model):
+    _inherit = 'res.company'
+
+    metrology_cron_rollover_id = fields.Many2one('ir.cron', string='Agendador da Virada de Status',
+                                                 readonly=True, ondelete='set null')
+    metrology_cron_alertas_id = fields.Many2one('ir.cron', string='Agendador dos Alertas de Calibração',
+                                                readonly=True, ondelete='set null')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        companies = super().create(vals_list)
+        companies._metrology_criar_agendadores()
+        return companies
+
+    def unlink(self):
+        # As cópias dos agendadores rodam com a empresa fixa no código: não sobrevivem a ela
+        agendadores = self.env['ir.cron']
+        for campo in AGENDADORES_EMPRESA:
+            agendadores |= self[campo]
+        res = super().unlink()
+        agendadores.sudo().unlink()
+        return res
+
+    @api.model
+    def _metrology_criar_agendadores(self):
+        """Cria, para cada empresa, cópias dos agendadores modelo restritas à empresa.
+
+        Agendadores distintos rodam em paralelo nos workers de cron; como cada cópia
+        trata somente os equipamentos (e os contadores) da própria empresa, as
+        execuções não disputam as mesmas linhas. Chamado na instalação e ao criar empresas.
+        """
+        empresas = self or self.search([])
+        for campo, (xmlid, metodo) in AGENDADORES_EMPRESA.items():
+            modelo = self.env.ref(xmlid, raise_if_not_found=False)
+            if not modelo:
+                continue
+            for empresa in empresas.filtered(lambda e: not e[campo]):
+                empresa.sudo()[campo] = modelo.sudo().copy({
+                    'name': '%s (%s)' % (modelo.name, empresa.name),
+                    'code': 'model.with_company(%d).%s()' % (empresa.id, metodo),
+                    'active': True,
+                })
@@ -0,0 +1,21 @@
+from odoo import models, fields
+
+
+class ResUsers(models.Model):
+    _inherit = 'res.users'
+
+    metrology_resumo_frequencia = fields.Selection([
+        ('imediato', 'Imediato'),
+        ('diario', 'Diário'),
+        ('semanal', 'Semanal'),
+    ], string='Resumo de Alertas Metrológicos', default='diario',
+        help='Frequência do e-mail de resumo dos alertas de calibração dos equipamentos sob sua responsabilidade.')
+    metrology_resumo_ultimo_envio = fields.Datetime(string='Último Resumo de Alertas', readonly=True)
+
+    @property
+    def SELF_READABLE_FIELDS(self):
+        return super().SELF_READABLE_FIELDS + ['metrology_resumo_frequencia']
+
+    @property
+    def SELF_WRITEABLE_FIELDS(self):
+        return super().SELF_WRITEABLE_FIELDS + ['metrology_resumo_frequencia']
@@ -0,0 +1,283 @@
+import hashlib
+import hmac
+import json
+import logging
+import time
+from datetime import timedelta
+
+import requests
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+EVENTOS_LIMITE_PADRAO = 500
+EVENTOS_RETENCAO_PADRAO_DIAS = 90
+
+WEBHOOK_TIMEOUT = 10
+# Espera entre tentativas: dobra a cada falha, de WEBHOOK_ESPERA_BASE até WEBHOOK_ESPERA_MAXIMA (minutos)
+WEBHOOK_ESPERA_BASE = 1
+WEBHOOK_ESPERA_MAXIMA = 24 * 60
+# Tempo (segundos) que uma execução do agendador dedica às entregas antes de se reagendar
+TEMPO_MAXIMO_ENTREGA = 240
+
+# Colunas cuja alteração gera um evento
+_COLUNAS_EVENTO = ('status_metrologico', 'proxima_calibracao', 'active')
+
+_INSERIR_EVENTOS = """
+    INSERT INTO metrology_status_evento
+           (transacao, equipamento_id, company_id, status_anterior, status_novo,
+            proxima_calibracao_anterior, proxima_calibracao, ativo_anterior, ativo, data_evento)
+    SELECT txid_current(), n.id, n.company_id, {status_anterior}, n.status_metrologico,
+           {proxima_anterior}, n.proxima_calibracao, {ativo_anterior}, n.active,
+           now() at time zone 'UTC'
+      {origem}
+  ORDER BY n.id
+"""
+
+
+def _criar_gatilhos_eventos(cr):
+    """Cria os gatilhos por comando que registram as transições dos equipamentos.
+
+    Assim como os contadores do dashboard, usam tabelas de transição: um UPDATE em lote
+    grava todos os seus eventos com um único INSERT.
+    """
+    corpo_insert = _INSERIR_EVENTOS.format(
+        status_anterior='NULL', proxima_anterior='NULL', ativo_anterior='NULL', origem='FROM novas n')
+    corpo_update = _INSERIR_EVENTOS.format(
+        status_anterior='a.status_metrologico', proxima_anterior='a.proxima_calibracao',
+        ativo_anterior='a.active', origem="""FROM novas n
+      JOIN antigas a ON a.id = n.id
+     WHERE ({colunas_a}) IS DISTINCT FROM ({colunas_n})""".format(
+            colunas_a=', '.join('a.%s' % c for c in _COLUNAS_EVENTO),
+            colunas_n=', '.join('n.%s' % c for c in _COLUNAS_EVENTO)))
+    cr.execute("""
+        CREATE OR REPLACE FUNCTION metrology_status_evento_registrar() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- Cargas em massa (gerador de frota sintética) desativam o registro na sessão
+            IF current_setting('metrology.sem_eventos', true) = '1' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'INSERT' THEN
+                {corpo_insert};
+            ELSE
+                {corpo_update};
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+    """.format(corpo_insert=corpo_insert, corpo_update=corpo_update))
+    for evento, transicao in (
+        ('INSERT', 'NEW TABLE AS novas'),
+        ('UPDATE', 'NEW TABLE AS novas OLD TABLE AS antigas'),
+    ):
+        gatilho = 'metrology_status_evento_%s' % evento.lower()
+        cr.execute('DROP TRIGGER IF EXISTS %s ON metrology_equipamento' % gatilho)
+        cr.execute("""
+            CREATE TRIGGER {gatilho} AFTER {evento} ON metrology_equipamento
+            REFERENCING {transicao}
+            FOR EACH STATEMENT EXECUTE FUNCTION metrology_status_evento_registrar()
+        """.format(gatilho=gatilho, evento=evento, transicao=transicao))
+
+
+def _ler_cursor(cursor):
+    """Converte o cursor "<transação>,<id>" em tupla; None começa do início"""
+    if not cursor:
+        return (0, 0)
+    transacao, evento_id = cursor.split(',', 1)
+    return (int(transacao), int(evento_id))
+
+
+class StatusEvento(models.Model):
+    _name = 'metrology.status.evento'
+    _description = 'Evento de Transição do Status Metrológico'
+    _order = 'id desc'
+    _log_access = False
+
+    # Registro somente de inclusão, gravado pelos gatilhos de metrology_equipamento
+    equipamento_id = fields.Many2one('metrology.equipamento', string='Equipamento', readonly=True,
+                                     ondelete='set null', index=True)
+    company_id = fields.Many2one('res.company', string='Empresa', readonly=True, index=True)
+    status_anterior = fields.Selection(selection='_selection_status', string='Status Anterior', readonly=True)
+    status_novo = fields.Selection(selection='_selection_status', string='Status Novo', readonly=True)
+    proxima_calibracao_anterior = fields.Date(string='Próxima Calibração Anterior', readonly=True)
+    proxima_calibracao = fields.Date(string='Próxima Calibração', readonly=True)
+    ativo_anterior = fields.Boolean(string='Ativo Anterior', readonly=True)
+    ativo = fields.Boolean(string='Ativo', readonly=True)
+    data_evento = fields.Datetime(string='Data do Evento', readonly=True, index=True)
+
+    def _selection_status(self):
+        return self.env['metrology.equipamento']._fields['status_metrologico'].selection
+
+    def init(self):
+        # A transação (txid) não é um campo do ORM: o Odoo não possui inteiro de 64 bits
+        self.env.cr.execute("ALTER TABLE metrology_status_evento ADD COLUMN IF NOT EXISTS transacao bigint")
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS metrology_status_evento_cursor_idx
+                ON metrology_status_evento (transacao, id)
+        """)
+        _criar_gatilhos_eventos(self.env.cr)
+
+    @api.model
+    def _ler(self, cursor=None, limite=EVENTOS_LIMITE_PADRAO, somente_status=False, empresas=None):
+        """Retorna (eventos, próximo cursor, fim) a partir do cursor informado.
+
+        Os eventos são ordenados por (transação, id) e só são entregues depois que todas
+        as transações anteriores terminaram (txid abaixo do xmin do snapshot). Um id
+        menor confirmado mais tarde nunca fica para trás do cursor do consumidor.
+        Somente eventos das empresas informadas (padrão: empresas ativas) são lidos.
+        """
+        self.check_access_rights('read')
+        empresas = self.env.companies if empresas is None else empresas
+        posicao = _ler_cursor(cursor)
+        self.env.cr.execute("""
+            SELECT id, transacao
+              FROM metrology_status_evento
+             WHERE transacao < txid_snapshot_xmin(txid_current_snapshot())
+               AND (transacao, id) > (%s, %s)
+               AND company_id = ANY(%s)
+               {filtro}
+          ORDER BY transacao, id
+             LIMIT %s
+        """.format(filtro='AND status_anterior IS DISTINCT FROM status_novo' if somente_status else ''),
+            [posicao[0], posicao[1], empresas.ids, limite])
+        linhas = self.env.cr.fetchall()
+        eventos = self.browse([row[0] for row in linhas])
+        if linhas:
+            posicao = (linhas[-1][1], linhas[-1][0])
+        return eventos, '%s,%s' % posicao, len(linhas) < limite
+
+    def _exportar(self):
+        """Representação compacta usada pela API e pelos webhooks"""
+        self.fetch(['equipamento_id', 'status_anterior', 'status_novo', 'proxima_calibracao_anterior',
+                    'proxima_calibracao', 'ativo_anterior', 'ativo', 'data_evento'])
+        return [{
+            'id': evento.id,
+            'equipamento_id': evento.equipamento_id.id or None,
+            'status_anterior': evento.status_anterior or None,
+            'status_novo': evento.status_novo or None,
+            'proxima_calibracao_anterior': fields.Date.to_string(evento.proxima_calibracao_anterior) or None,
+            'proxima_calibracao': fields.Date.to_string(evento.proxima_calibracao) or None,
+            'ativo_anterior': evento.ativo_anterior,
+            'ativo': evento.ativo,
+            'data_evento': fields.Datetime.to_string(evento.data_evento),
+        } for evento in self]
+
+    @api.model
+    def _expurgar(self):
+        """Remove eventos mais antigos que a retenção configurada"""
+        valor = self.env['ir.config_parameter'].sudo().get_param(
+            'metrology_management.eventos_retencao_dias', EVENTOS_RETENCAO_PADRAO_DIAS)
+        try:
+            dias = int(valor)
+        except (TypeError, ValueError):
+            dias = EVENTOS_RETENCAO_PADRAO_DIAS
+        if dias <= 0:
+            return 0
+        self.env.cr.execute(
+            "DELETE FROM metrology_status_evento WHERE data_evento < (now() at time zone 'UTC') - %s",
+            [timedelta(days=dias)])
+        return self.env.cr.rowcount
+
+
+class Webhook(models.Model):
+    _name = 'metrology.webhook'
+    _description = 'Webhook de Eventos Metrológicos'
+    _order = 'name'
+
+    name = fields.Char(string='Nome', required=True)
+    url = fields.Char(string='URL', required=True)
+    segredo = fields.Char(string='Segredo', copy=False,
+                          help='Quando informado, o corpo é assinado com HMAC-SHA256 no cabeçalho '
+                               'X-Metrology-Assinatura.')
+    somente_status = fields.Boolean(string='Somente Mudanças de Status',
+                                    help='Ignora eventos que alteram apenas a próxima calibração ou o '
+                                         'arquivamento.')
+    tamanho_lote = fields.Integer(string='Eventos por Entrega', default=EVENTOS_LIMITE_PADRAO)
+    # O assinante recebe somente os eventos dos equipamentos desta empresa
+    company_id = fields.Many2one('res.company', string='Empresa', required=True, index=True,
+                                 default=lambda self: self.env.company)
+    active = fields.Boolean(default=True)
+    # Estado da caixa de saída: cada assinante tem o seu cursor
+    cursor = fields.Char(string='Cursor', readonly=True, copy=False)
+    ultima_entrega = fields.Datetime(string='Última Entrega', readonly=True, copy=False)
+    tentativas = fields.Integer(string='Falhas Consecutivas', readonly=True, copy=False)
+    proxima_tentativa = fields.Datetime(string='Próxima Tentativa', readonly=True, copy=False)
+    ultimo_erro = fields.Text(string='Último Erro', readonly=True, copy=False)
+
+    def _commit(self):
+        if not self.env.registry.in_test_mode():
+            self.env.cr.commit()
+
+    def action_reiniciar(self):
+        """Reenvia a partir do início do registro de eventos"""
+        self.write({'cursor': False, 'tentativas': 0, 'proxima_tentativa': False, 'ultimo_erro': False})
+
+    @api.model
+    def _entregar_pendentes(self):
+        """Entrega os eventos pendentes a cada webhook ativo; executado pelo agendador.
+
+        Cada webhook é reservado com FOR UPDATE SKIP LOCKED e cada lote entregue é
+        confirmado em sua própria transação junto com o avanço do cursor (entrega ao
+        menos uma vez). Falhas adiam o webhook com espera exponencial.
+        """
+        inicio = time.monotonic()
+        processados = []
+        while time.monotonic() - inicio < TEMPO_MAXIMO_ENTREGA:
+            self.env.cr.execute("""
+                SELECT id FROM metrology_webhook
+                 WHERE active
+                   AND (proxima_tentativa IS NULL OR proxima_tentativa <= now() at time zone 'UTC')
+                   AND NOT id = ANY(%s::int[])
+              ORDER BY id
+                 LIMIT 1
+                   FOR UPDATE SKIP LOCKED
+            """, [processados])
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+            processados.append(row[0])
+            self.browse(row[0])._entregar(inicio)
+        else:
+            self.env.ref('metrology_management.ir_cron_webhook_entrega')._trigger()
+        self.env['metrology.status.evento']._expurgar()
+
+    def _entregar(self, inicio):
+        self.ensure_one()
+        Evento = self.env['metrology.status.evento']
+        while time.monotonic() - inicio < TEMPO_MAXIMO_ENTREGA:
+            eventos, cursor, fim = Evento._ler(self.cursor, max(self.tamanho_lote, 1), self.somente_status,
+                                              empresas=self.company_id)
+            if eventos:
+                corpo = json.dumps({'eventos': eventos._exportar(), 'cursor': cursor}).encode()
+                cabecalhos = {'Content-Type': 'application/json'}
+                if self.segredo:
+                    cabecalhos['X-Metrology-Assinatura'] = hmac.new(
+                        self.segredo.encode(), corpo, hashlib.sha256).hexdigest()
+                try:
+                    requests.post(self.url, data=corpo, headers=cabecalhos,
+                                  timeout=WEBHOOK_TIMEOUT).raise_for_status()
+                except requests.RequestException as e:
+                    tentativas = self.tentativas + 1
+                    espera = min(WEBHOOK_ESPERA_BASE * 2 ** (tentativas - 1), WEBHOOK_ESPERA_MAXIMA)
+                    _logger.warning('Falha na entrega do webhook %s (tentativa %s): %s', self.name, tentativas, e)
+                    self.write({
+                        'tentativas': tentativas,
+                        'proxima_tentativa': fields.Datetime.now() + timedelta(minutes=espera),
+                        'ultimo_erro': str(e),
+                    })
+                    self._commit()
+                    return
+            vals = {'cursor': cursor}
+            if eventos:
+                vals.update(ultima_entrega=fields.Datetime.now(), tentativas=0,
+                            proxima_tentativa=False, ultimo_erro=False)
+            if vals['cursor'] != self.cursor or eventos:
+                self.write(vals)
+            self._commit()
+            if fim:
+                return
+            # O commit liberou a reserva; outro worker pode ter assumido o webhook
+            self.env.cr.execute("SELECT id FROM metrology_webhook WHERE id = %s FOR UPDATE SKIP LOCKED", [self.id])
+            if not self.env.cr.fetchone():
+                return
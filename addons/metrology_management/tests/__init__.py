@@ -0,0 +1,3 @@
+from . import test_equipamento
+from . import test_calibracao
+from . import test_alertas
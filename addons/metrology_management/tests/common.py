@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+from odoo.tests.common import TransactionCase
+from odoo.tools import split_every
+
+from ..tools.perfil import medir
+
+_logger = logging.getLogger(__name__)
+
+# Linhas de base dos testes de desempenho; regravadas com METROLOGY_BENCHMARK_SALVAR=1.
+# Somente métricas independentes da máquina (consultas) são versionadas; tempo e memória são registrados no log
+METRICAS_LINHA_BASE = ('consultas',)
+ARQUIVO_LINHAS_BASE = os.path.join(os.path.dirname(__file__), 'linhas_base.json')
+CRIACAO_BATCH_SIZE = 5000
+
+
+def frotas_benchmark():
+    """Tamanhos de frota medidos (METROLOGY_BENCHMARK_FROTAS, ex.: '1000,10000,100000')"""
+    return [int(valor) for valor in os.environ.get('METROLOGY_BENCHMARK_FROTAS', '1000').split(',') if valor]
+
+
+def historico_benchmark():
+    """Calibrações aprovadas por equipamento (METROLOGY_BENCHMARK_HISTORICO)"""
+    return int(os.environ.get('METROLOGY_BENCHMARK_HISTORICO', '3'))
+
+
+class MetrologyCommon(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Equipamento = cls.env['metrology.equipamento']
+        cls.Calibracao = cls.env['metrology.calibracao']
+        cls.hoje = date.today()
+        cls.total_frota = 0
+
+    @classmethod
+    def _criar_frota(cls, quantidade, historico=2):
+        """Cria equipamentos com calibrações aprovadas espalhadas nos últimos meses.
+
+        As datas variam por equipamento de modo que a frota mistura calibrações vigentes,
+        próximas do vencimento e vencidas. Chamadas sucessivas ampliam a mesma frota.
+        """
+        Equipamento = cls.Equipamento.with_context(tracking_disable=True)
+        Calibracao = cls.Calibracao.with_context(tracking_disable=True)
+        tipos = [tipo for tipo, _rotulo in Equipamento._fields['tipo'].selection]
+        inicio = cls.total_frota
+        equipamentos = Equipamento.browse()
+        for indices in split_every(CRIACAO_BATCH_SIZE, range(inicio, inicio + quantidade)):
+            equipamentos |= Equipamento.create([{
+                'tag': 'FROTA-%07d' % indice,
+                'nome': 'Instrumento %d' % indice,
+                'tipo': tipos[indice % len(tipos)],
+                'centro_custo': 'CC-%02d' % (indice % 20),
+                'frequencia_calibracao': 12,
+                'erro_maximo_admissivel': 1.0,
+            } for indice in indices])
+        cls.total_frota += quantidade
+
+        vals_list = []
+        for indice, equipamento in enumerate(equipamentos, start=inicio):
+            for ciclo in range(historico):
+                vals_list.append({
+                    'equipamento_id': equipamento.id,
+                    'data_calibracao': cls.hoje - relativedelta(months=12 * ciclo + indice % 14, days=indice % 28),
+                    'numero_certificado': 'CERT-%07d-%02d' % (indice, ciclo),
+                    'erro_encontrado': 0.1 * ciclo + 0.01 * (indice % 7),
+                    'incerteza_expandida': 0.05,
+                    'state': 'aprovado',
+                })
+        for lote in split_every(CRIACAO_BATCH_SIZE, vals_list):
+            Calibracao.create(list(lote))
+        cls.env.flush_all()
+        return equipamentos
+
+    def _medir(self, funcao, memoria=False):
+        """Mede a chamada com os caches do ambiente vazios, incluindo as gravações pendentes"""
+        self.env.flush_all()
+        self.env.invalidate_all()
+        with medir(self.env.cr, memoria=memoria) as medicao:
+            funcao()
+            self.env.flush_all()
+        return medicao
+
+    def assertConsultasIndependentes(self, funcao, ampliar):
+        """Falha se o número de consultas de funcao crescer junto com os dados (padrão N+1)"""
+        funcao()  # aquece os caches do registro
+        antes = self._medir(funcao)['consultas']
+        ampliar()
+        depois = self._medir(funcao)['consultas']
+        self.assertEqual(depois, antes, 'O número de consultas passou de %s para %s ao ampliar os dados'
+                         % (antes, depois))
+
+
+class MetrologyBenchmarkCommon(MetrologyCommon):
+    """Base dos testes de desempenho (tag metrology_benchmark, fora da suíte padrão).
+
+    Cada ponto medido é comparado com a linha de base do mesmo tamanho de frota,
+    aplicando as tolerâncias do arquivo; um ponto sem linha de base falha. Com
+    METROLOGY_BENCHMARK_SALVAR=1 as medidas substituem as linhas de base em vez de
+    serem verificadas.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(ARQUIVO_LINHAS_BASE) as arquivo:
+            cls.orcamento = json.load(arquivo)
+        cls.salvar = os.environ.get('METROLOGY_BENCHMARK_SALVAR') == '1'
+        cls.novas_linhas_base = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.salvar and cls.novas_linhas_base:
+            with open(ARQUIVO_LINHAS_BASE) as arquivo:
+                orcamento = json.load(arquivo)
+            orcamento['linhas_base'].update(cls.novas_linhas_base)
+            # Tamanhos de frota e profundidade de histórico cobertos pelas linhas de base
+            frotas = {int(chave.rsplit(':', 1)[1]) for chave in orcamento['linhas_base']}
+            orcamento['frotas'] = sorted(frotas)
+            orcamento['historico'] = historico_benchmark()
+            with open(ARQUIVO_LINHAS_BASE, 'w') as arquivo:
+                json.dump(orcamento, arquivo, indent=2, sort_keys=True)
+                arquivo.write('\n')
+        super().tearDownClass()
+
+    def _ampliar_frota(self, tamanho):
+        """Amplia a frota até o tamanho pedido com o gerador de frota sintética (COPY)"""
+        if tamanho > self.total_frota:
+            self.env['metrology.gerador.frota']._gerar(
+                tamanho - self.total_frota, historico=historico_benchmark(), semente=tamanho)
+            type(self).total_frota = tamanho
+
+    def assertDentroDoOrcamento(self, ponto, funcao):
+        """Mede funcao e compara com a linha de base '<ponto>:<tamanho da frota>'"""
+        medicao = self._medir(funcao, memoria=True)
+        chave = '%s:%s' % (ponto, self.total_frota)
+        _logger.info('%s: %s consultas, %.1f ms, pico de memória %.1f KiB', chave, medicao['consultas'],
+                     medicao['tempo'] * 1000, medicao['memoria_pico'] / 1024)
+        if self.salvar:
+            self.novas_linhas_base[chave] = {metrica: medicao[metrica] for metrica in METRICAS_LINHA_BASE}
+            return medicao
+        base = self.orcamento['linhas_base'].get(chave)
+        if not base:
+            self.fail('Sem linha de base para %s (frotas registradas: %s); registre-a executando com '
+                      'METROLOGY_BENCHMARK_SALVAR=1 METROLOGY_BENCHMARK_FROTAS=%s'
+                      % (chave, self.orcamento.get('frotas') or 'nenhuma', self.total_frota))
+        for metrica, tolerancia in self.orcamento['tolerancia'].items():
+            limite = base[metrica] * (1 + tolerancia)
+            self.assertLessEqual(medicao[metrica], limite, '%s: %s = %s excede a linha de base %s (+%d%%)' % (
+                chave, metrica, medicao[metrica], base[metrica], tolerancia * 100))
+        return medicao
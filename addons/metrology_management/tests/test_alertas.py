@@ -0,0 +1,134 @@
+import logging
+
+from dateutil.relativedelta import relativedelta
+
+from odoo.tests import tagged
+
+from .common import MetrologyCommon, MetrologyBenchmarkCommon, frotas_benchmark
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged('post_install', '-at_install')
+class TestResumoAlertas(MetrologyCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Alerta = cls.env['metrology.calibracoes.alert']
+        cls.Fila = cls.env['metrology.alerta.fila']
+        cls.env['ir.config_parameter'].set_param('metrology_management.alertas_modo', 'resumo')
+        Usuario = cls.env['res.users'].with_context(no_reset_password=True)
+        cls.usuario_a = Usuario.create({'name': 'Responsável A', 'login': 'resp_a', 'email': 'a@example.com'})
+        cls.usuario_b = Usuario.create({'name': 'Responsável B', 'login': 'resp_b', 'email': 'b@example.com'})
+        frota = cls._criar_frota(20, historico=1)
+        cls.vencidos = frota.filtered(lambda e: e.ultima_calibracao < cls.hoje - relativedelta(months=1))[:6]
+        cls.vencidos.write({'frequencia_calibracao': 1})
+        cls.vencidos[:4].write({'responsavel_id': cls.usuario_a.id})
+        cls.vencidos[4:].write({'responsavel_id': cls.usuario_b.id})
+
+    def _resumos(self, usuario):
+        return self.env['mail.mail'].search([('recipient_ids', 'in', usuario.partner_id.ids)])
+
+    def test_um_resumo_por_responsavel(self):
+        mensagens = self.env['mail.message'].search_count([('model', '=', 'metrology.equipamento')])
+        self.Alerta._send_calibration_alerts()
+        self.assertEqual(self.env['mail.message'].search_count([('model', '=', 'metrology.equipamento')]),
+                         mensagens, 'O modo resumo não deve publicar no chatter dos equipamentos')
+        self.Fila._enviar_resumos()
+
+        resumo = self._resumos(self.usuario_a)
+        self.assertEqual(len(resumo), 1)
+        for equipamento in self.vencidos[:4]:
+            self.assertIn(equipamento.tag, resumo.body_html)
+        self.assertNotIn(self.vencidos[4].tag, resumo.body_html)
+        self.assertEqual(len(self._resumos(self.usuario_b)), 1)
+        self.assertFalse(self.Fila.search([('usuario_id', 'in', (self.usuario_a | self.usuario_b).ids)]))
+
+    def test_preferencia_frequencia(self):
+        self.usuario_a.metrology_resumo_frequencia = 'semanal'
+        self.usuario_b.metrology_resumo_frequencia = 'imediato'
+        self.Alerta._send_calibration_alerts()
+        self.Fila._enviar_resumos()
+
+        # Novos alertas no mesmo dia: somente o destinatário imediato recebe outro resumo
+        self.Fila._enfileirar(self.vencidos.ids, 'vencido')
+        self.Fila._enviar_resumos()
+        self.assertEqual(len(self._resumos(self.usuario_a)), 1)
+        self.assertEqual(len(self._resumos(self.usuario_b)), 2)
+        self.assertTrue(self.Fila.search([('usuario_id', '=', self.usuario_a.id)]))
+
+    def test_limite_por_execucao(self):
+        self.env['ir.config_parameter'].set_param('metrology_management.resumo_limite_envios', 1)
+        self.Fila._enfileirar(self.vencidos.ids, 'vencido')
+        self.assertEqual(self.Fila._enviar_resumos(), 1)
+        self.assertEqual(self.Fila._enviar_resumos(), 1)
+        self.assertFalse(self.Fila.search([('usuario_id', 'in', (self.usuario_a | self.usuario_b).ids)]))
+
+    def test_execucao_em_andamento(self):
+        # Enquanto a execução do agendador enfileira, nenhum resumo parcial é enviado
+        Fila = self.Fila.with_context(metrology_alerta_execucao='execucao-teste')
+        Fila._enfileirar(self.vencidos[:2].ids, 'vencido')
+        self.assertEqual(self.Fila._enviar_resumos(), 0)
+        Fila._enfileirar(self.vencidos[2:4].ids, 'vencido')
+        self.Fila._liberar('execucao-teste')
+        self.assertEqual(self.Fila._enviar_resumos(), 1)
+        for equipamento in self.vencidos[:4]:
+            self.assertIn(equipamento.tag, self._resumos(self.usuario_a).body_html)
+
+    def test_modo_mensagem(self):
+        self.env['ir.config_parameter'].set_param('metrology_management.alertas_modo', 'mensagem')
+        self.Alerta._send_calibration_alerts()
+        self.assertFalse(self.Fila.search([]))
+        self.assertEqual(self.env['mail.message'].search_count([
+            ('model', '=', 'metrology.equipamento'), ('res_id', 'in', self.vencidos.ids)]), len(self.vencidos))
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestResumoAlertasDesempenho(MetrologyBenchmarkCommon):
+    """Alertas de vencimento por mensagem no chatter comparados ao resumo por responsável"""
+
+    RESPONSAVEIS = 20
+
+    def test_desempenho(self):
+        ICP = self.env['ir.config_parameter']
+        Alerta = self.env['metrology.calibracoes.alert']
+        Usuario = self.env['res.users'].with_context(no_reset_password=True)
+        responsaveis = Usuario.create([{
+            'name': 'Responsável %d' % indice,
+            'login': 'bench_resp_%d' % indice,
+            'email': 'resp%d@example.com' % indice,
+        } for indice in range(self.RESPONSAVEIS)])
+        ICP.set_param('metrology_management.resumo_limite_envios', self.RESPONSAVEIS)
+
+        def reiniciar():
+            self.env.flush_all()
+            self.env.cr.execute("""
+                UPDATE metrology_equipamento
+                   SET alerta_status = NULL,
+                       responsavel_id = (%s::int[])[id %% %s + 1]
+            """, [responsaveis.ids, self.RESPONSAVEIS])
+            self.env.cr.execute("DELETE FROM mail_mail")
+            self.env.invalidate_all()
+
+        def emails():
+            return self.env['mail.mail'].search_count([])
+
+        for tamanho in frotas_benchmark():
+            with self.subTest(frota=tamanho):
+                self._ampliar_frota(tamanho)
+
+                reiniciar()
+                ICP.set_param('metrology_management.alertas_modo', 'mensagem')
+                self.assertDentroDoOrcamento('alertas_mensagem', Alerta._send_calibration_alerts)
+                por_mensagem = emails()
+
+                reiniciar()
+                responsaveis.write({'metrology_resumo_ultimo_envio': False})
+                ICP.set_param('metrology_management.alertas_modo', 'resumo')
+                self.assertDentroDoOrcamento('alertas_resumo', lambda: (
+                    Alerta._send_calibration_alerts(), self.env['metrology.alerta.fila']._enviar_resumos()))
+                por_resumo = emails()
+                _logger.info('Alertas com frota de %s: %s e-mails por mensagem, %s por resumo',
+                             tamanho, por_mensagem, por_resumo)
+                self.assertLessEqual(por_resumo, self.RESPONSAVEIS)
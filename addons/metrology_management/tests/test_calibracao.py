@@ -0,0 +1,384 @@
+import base64
+import logging
+import threading
+import time
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
+
+from odoo import api, models, sql_db, SUPERUSER_ID
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+
+from .common import MetrologyCommon, MetrologyBenchmarkCommon, frotas_benchmark, historico_benchmark
+
+_logger = logging.getLogger(__name__)
+
+# Certificados de um laboratório aprovados de uma vez no teste de desempenho
+APROVACAO_LOTE = 500
+
+
+@tagged('post_install', '-at_install')
+class TestCalibracao(MetrologyCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.equipamentos = cls._criar_frota(10, historico=3)
+
+    def _nova_calibracao(self, equipamento, **vals):
+        return self.Calibracao.create(dict({
+            'equipamento_id': equipamento.id,
+            'data_calibracao': self.hoje,
+            'numero_certificado': 'CERT-NOVA-%s' % equipamento.id,
+            'erro_encontrado': 0.2,
+            'incerteza_expandida': 0.1,
+        }, **vals))
+
+    def test_aprovar_atualiza_equipamento(self):
+        equipamento = self.equipamentos[0]
+        calibracao = self._nova_calibracao(equipamento)
+        calibracao.action_aprovar()
+        self.assertEqual(equipamento.ultima_calibracao_id, calibracao)
+        self.assertEqual(equipamento.proxima_calibracao,
+                         self.hoje + relativedelta(months=equipamento.frequencia_calibracao))
+        self.assertEqual(equipamento.status_metrologico, 'conforme')
+
+    def test_aprovar_exige_certificado(self):
+        calibracao = self._nova_calibracao(self.equipamentos[0], numero_certificado=False)
+        with self.assertRaises(ValidationError):
+            calibracao.action_aprovar()
+
+    def test_aprovar_lote(self):
+        equipamentos = self.equipamentos[5:8]
+        lote = self.Calibracao.create([{
+            'equipamento_id': equipamento.id,
+            'data_calibracao': self.hoje - relativedelta(days=dias),
+            'numero_certificado': 'CERT-LOTE-%s-%s' % (equipamento.id, dias),
+            'erro_encontrado': 0.2,
+            'incerteza_expandida': 0.1,
+        } for equipamento in equipamentos for dias in (0, 10)])
+        calculados = []
+        Equipamento = type(self.Equipamento)
+        original = Equipamento._compute_status_metrologico
+
+        def contar(registros):
+            calculados.extend(registros.ids)
+            return original(registros)
+
+        with patch.object(Equipamento, '_compute_status_metrologico', contar):
+            lote.action_aprovar()
+        for equipamento in equipamentos:
+            self.assertEqual(calculados.count(equipamento.id), 1, 'Cada equipamento deve ser recalculado uma vez')
+            self.assertEqual(equipamento.ultima_calibracao, self.hoje)
+            self.assertEqual(equipamento.status_metrologico, 'conforme')
+        self.assertEqual(set(lote.mapped('state')), {'aprovado'})
+
+    def test_aprovar_lote_valida_tudo(self):
+        equipamento = self.equipamentos[8]
+        lote = self._nova_calibracao(equipamento) | self._nova_calibracao(equipamento, numero_certificado=False)
+        with self.assertRaises(ValidationError):
+            lote.action_aprovar()
+        self.assertNotIn('aprovado', lote.mapped('state'))
+
+    def test_aprovar_consultas(self):
+        equipamento = self.equipamentos[1]
+
+        def aprovar():
+            self._nova_calibracao(equipamento).action_aprovar()
+
+        def ampliar_historico():
+            self.Calibracao.create([{
+                'equipamento_id': equipamento.id,
+                'data_calibracao': self.hoje - relativedelta(years=5 + ano),
+                'numero_certificado': 'CERT-ANTIGO-%s' % ano,
+                'state': 'aprovado',
+            } for ano in range(20)])
+
+        self.assertConsultasIndependentes(aprovar, ampliar_historico)
+
+    def test_datas_calibracao_consultas(self):
+        def recalcular():
+            equipamentos = self.Equipamento.search([])
+            equipamentos.modified(['frequencia_calibracao'])
+            equipamentos.flush_recordset()
+
+        self.assertConsultasIndependentes(recalcular, lambda: self._criar_frota(30))
+
+    def test_regra_decisao(self):
+        equipamento = self.equipamentos[2]
+        self.assertEqual(self._nova_calibracao(equipamento, erro_encontrado=0.5).resultado, 'conforme')
+        self.assertEqual(self._nova_calibracao(equipamento, erro_encontrado=1.5).resultado, 'nao_conforme')
+        # Resultado informado manualmente prevalece sobre a regra
+        manual = self._nova_calibracao(equipamento, erro_encontrado=1.5, resultado='conforme')
+        self.assertEqual(manual.resultado, 'conforme')
+
+    def test_regra_nao_reescreve_aprovadas(self):
+        equipamento = self.equipamentos[6]
+        aprovada = self._nova_calibracao(equipamento, erro_encontrado=0.8)
+        aprovada.action_aprovar()
+        aberta = self._nova_calibracao(equipamento, erro_encontrado=0.8)
+        equipamento.erro_maximo_admissivel = 0.5
+        self.assertEqual(aprovada.resultado, 'conforme', 'O certificado aprovado não deve ser reavaliado')
+        self.assertEqual(aberta.resultado, 'nao_conforme')
+
+    def test_orcamento_preserva_aprovadas(self):
+        equipamento = self.equipamentos[9]
+        aprovada = self._nova_calibracao(equipamento)
+        aprovada.action_aprovar()
+        aberta = self._nova_calibracao(equipamento)
+        Orcamento = self.env['metrology.incerteza.orcamento']
+        for calibracao in aprovada | aberta:
+            Orcamento.create({'calibracao_id': calibracao.id, 'componente_ids': [(0, 0, {
+                'name': 'Repetibilidade', 'valor': 0.2, 'divisor_normal': 2.0})]})
+        self.assertAlmostEqual(aberta.incerteza_expandida, aberta.orcamento_incerteza_ids.incerteza_expandida)
+        self.assertIn('Incerteza expandida atualizada', aberta.message_ids[0].body)
+        self.assertEqual(aprovada.incerteza_expandida, 0.1, 'O certificado aprovado não deve ser alterado')
+        self.assertIn('certificado aprovado', aprovada.message_ids[0].body)
+
+    def test_aprovar_exige_resultado(self):
+        equipamento = self.equipamentos[7]
+        equipamento.erro_maximo_admissivel = 0
+        calibracao = self._nova_calibracao(equipamento)
+        self.assertFalse(calibracao.resultado)
+        with self.assertRaises(ValidationError):
+            calibracao.action_aprovar()
+
+    def test_importar_por_empresa(self):
+        equipamento = self.equipamentos[3]
+        filial = self.env['res.company'].create({'name': 'Planta Importação'})
+        self.Equipamento.with_company(filial).create({
+            'tag': equipamento.tag, 'nome': 'Mesmo TAG na filial', 'tipo': 'outro', 'frequencia_calibracao': 12})
+        conteudo = 'tag,data_calibracao,numero_certificado\n%s,%s,CERT-IMP\nINEXISTENTE,%s,CERT-X\n' % (
+            equipamento.tag, self.hoje, self.hoje)
+        assistente = self.env['metrology.calibracao.import'].create({
+            'arquivo': base64.b64encode(conteudo.encode()), 'nome_arquivo': 'calibracoes.csv'})
+        assistente.action_importar()
+        self.assertEqual((assistente.total_importadas, assistente.total_erros), (1, 1))
+        importada = self.Calibracao.search([('numero_certificado', '=', 'CERT-IMP')])
+        self.assertEqual(importada.equipamento_id, equipamento, 'O TAG deve ser resolvido na empresa ativa')
+
+    def test_numeracao_em_bloco(self):
+        equipamento = self.equipamentos[4]
+        calibracoes = self.Calibracao.create([{'equipamento_id': equipamento.id} for _i in range(5)])
+        nomes = calibracoes.mapped('name')
+        self.assertNotIn('Novo', nomes)
+        self.assertEqual(len(set(nomes)), 5)
+        self.assertEqual(nomes, sorted(nomes), 'O bloco deve seguir a ordem de criação')
+        informado = self.Calibracao.create({'equipamento_id': equipamento.id, 'name': 'CAL-EXTERNA'})
+        self.assertEqual(informado.name, 'CAL-EXTERNA')
+
+    def test_arquivar(self):
+        equipamento = self.equipamentos[5]
+        self.env['ir.config_parameter'].set_param('metrology_management.arquivo_anos', 1)
+        vigente = equipamento.ultima_calibracao_id
+        antigas = equipamento.calibracao_ids.filtered(
+            lambda c: c != vigente and c.data_calibracao < self.hoje - relativedelta(years=1))
+        self.assertTrue(antigas)
+        antigas[0].message_post(body='Certificado conferido')
+        originais = antigas.ids
+
+        self.env['metrology.calibracao.arquivo']._arquivar()
+        self.assertFalse(self.Calibracao.browse(originais).exists())
+        self.assertTrue(vigente.exists())
+        arquivo = equipamento.calibracao_arquivo_ids
+        self.assertEqual(sorted(arquivo.mapped('calibracao_original_id')), sorted(originais))
+        self.assertIn('Certificado conferido', arquivo.filtered(
+            lambda a: a.calibracao_original_id == originais[0]).historico_mensagens_texto)
+        self.assertEqual(equipamento.ultima_calibracao_id, vigente)
+
+    def test_frequencia_atualiza_validade(self):
+        equipamento = self.equipamentos[3]
+        equipamento.frequencia_calibracao = 6
+        ultima = equipamento.ultima_calibracao_id
+        self.assertEqual(ultima.data_validade, ultima.data_calibracao + relativedelta(months=6))
+        self.assertEqual(equipamento.proxima_calibracao, ultima.data_calibracao + relativedelta(months=6))
+        self.assertIn('para 6 meses', equipamento.message_ids[0].body)
+        with self.assertRaises(ValidationError):
+            equipamento.frequencia_calibracao = 0
+
+    def test_rastreabilidade_suspeita(self):
+        Padrao = self.env['metrology.padrao_medicao']
+        raiz, outro_suspeito, confiavel = Padrao.create([{'name': nome} for nome in ('Raiz', 'Outro', 'Confiável')])
+        dependente = Padrao.create({'name': 'Dependente', 'padrao_referencia_ids': [(6, 0, raiz.ids)]})
+        (raiz | outro_suspeito).action_marcar_suspeito()
+
+        # Calibrações registradas depois da suspeita também são sinalizadas
+        equipamento, outro = self.equipamentos[1], self.equipamentos[2]
+        suspeita = self._nova_calibracao(equipamento, padrao_id=dependente.id)
+        suspeita.action_aprovar()
+        self.assertTrue(suspeita.rastreabilidade_suspeita)
+        self.assertTrue(equipamento.rastreabilidade_suspeita)
+        self._nova_calibracao(outro, padrao_id=outro_suspeito.id).action_aprovar()
+        self.assertTrue(outro.rastreabilidade_suspeita)
+
+        # A recalibração com um padrão confiável retira a sinalização do equipamento
+        self._nova_calibracao(equipamento, padrao_id=confiavel.id,
+                              data_calibracao=self.hoje + relativedelta(days=1)).action_aprovar()
+        self.assertFalse(equipamento.rastreabilidade_suspeita)
+        self.assertTrue(suspeita.rastreabilidade_suspeita)
+
+        # Remover a suspeita da raiz não afeta o que depende de outro padrão suspeito
+        raiz.action_remover_suspeita()
+        self.assertFalse(dependente.rastreabilidade_suspeita)
+        self.assertFalse(suspeita.rastreabilidade_suspeita)
+        self.assertTrue(outro.rastreabilidade_suspeita)
+        self.assertTrue(outro_suspeito.rastreabilidade_suspeita)
+
+    def _carga_planejada(self):
+        self.env.cr.execute("""
+            SELECT company_id, mes, executor_id, local_ensaio_id, tipo, quantidade
+              FROM metrology_planejamento_carga
+             WHERE quantidade <> 0
+        """)
+        return sorted(self.env.cr.fetchall(), key=str)
+
+    def test_planejamento_incremental(self):
+        Planejamento = self.env['metrology.planejamento.carga']
+        sem_frequencia = self.equipamentos[8]
+        self.env.cr.execute("UPDATE metrology_equipamento SET frequencia_calibracao = NULL WHERE id = %s",
+                            [sem_frequencia.id])
+        self.env.invalidate_all()
+        Planejamento._recalcular()
+        self.assertTrue(Planejamento._projetar(sem_frequencia.ids),
+                        'Equipamento sem frequência deve entrar ao menos com a próxima calibração')
+
+        calibracao = self._nova_calibracao(self.equipamentos[9])
+        calibracao.action_aprovar()
+        # A transação do usuário só enfileira a diferença; as linhas agregadas ficam intactas
+        self.assertTrue(self.env['metrology.planejamento.pendente'].search_count([]))
+        Planejamento._aplicar_pendentes()
+        self.assertFalse(self.env['metrology.planejamento.pendente'].search_count([]))
+        incremental = self._carga_planejada()
+        Planejamento._recalcular()
+        self.assertEqual(incremental, self._carga_planejada())
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestCalibracaoDesempenho(MetrologyBenchmarkCommon):
+
+    def test_desempenho(self):
+        for tamanho in frotas_benchmark():
+            with self.subTest(frota=tamanho):
+                self._ampliar_frota(tamanho)
+                equipamento = self.Equipamento.search([], limit=1)
+                calibracao = self.Calibracao.create({
+                    'equipamento_id': equipamento.id,
+                    'numero_certificado': 'CERT-BENCH-%s' % tamanho,
+                    'erro_encontrado': 0.1,
+                })
+                self.assertDentroDoOrcamento('action_aprovar', calibracao.action_aprovar)
+                lote = self.Calibracao.create([{
+                    'equipamento_id': equipamento.id,
+                    'numero_certificado': 'CERT-LOTE-%s-%s' % (tamanho, equipamento.id),
+                    'erro_encontrado': 0.1,
+                } for equipamento in self.Equipamento.search([], limit=APROVACAO_LOTE)])
+                self.assertDentroDoOrcamento('aprovar_lote', lote.action_aprovar)
+
+                def recalcular():
+                    todos = self.Equipamento.search([])
+                    todos.modified(['frequencia_calibracao'])
+                    todos.flush_recordset()
+
+                self.assertDentroDoOrcamento('datas_calibracao', recalcular)
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestFrequenciaDesempenho(MetrologyBenchmarkCommon):
+    """Troca de frequência de toda a frota: reajuste em SQL contra o recálculo registro a registro do ORM.
+
+    O volume de calibrações é frota x METROLOGY_BENCHMARK_HISTORICO; 500 mil calibrações
+    correspondem, por exemplo, a METROLOGY_BENCHMARK_FROTAS=100000 e METROLOGY_BENCHMARK_HISTORICO=5.
+    """
+
+    def test_desempenho(self):
+        for tamanho in frotas_benchmark():
+            with self.subTest(frota=tamanho):
+                self._ampliar_frota(tamanho)
+                todos = self.Equipamento.search([])
+                tempos = {}
+
+                # Caminho anterior: write() base, com o recálculo de validade e próxima calibração pelo ORM
+                def recalculo_orm():
+                    models.BaseModel.write(todos, {'frequencia_calibracao': 6})
+
+                tempos['orm'] = self.assertDentroDoOrcamento('frequencia_orm', recalculo_orm)['tempo']
+                tempos['sql'] = self.assertDentroDoOrcamento(
+                    'frequencia_sql', lambda: todos._aplicar_frequencia_calibracao(12))['tempo']
+                _logger.info('Troca de frequência com frota de %s (%s calibrações por equipamento): '
+                             'ORM %.1f ms, SQL %.1f ms', tamanho, historico_benchmark(),
+                             tempos['orm'] * 1000, tempos['sql'] * 1000)
+                ultima = todos[0].ultima_calibracao_id
+                self.assertEqual(ultima.data_validade, ultima.data_calibracao + relativedelta(months=12))
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestArquivamentoDesempenho(MetrologyBenchmarkCommon):
+    """Lista de calibrações e recálculo das datas antes e depois do arquivamento"""
+
+    def test_desempenho(self):
+        self.env['ir.config_parameter'].set_param('metrology_management.arquivo_anos', 1)
+
+        def listar():
+            self.Calibracao.search_fetch(
+                [], ['name', 'equipamento_id', 'data_calibracao', 'data_validade', 'resultado', 'state'], limit=80)
+
+        def recalcular():
+            todos = self.Equipamento.search([])
+            todos.modified(['frequencia_calibracao'])
+            todos.flush_recordset()
+
+        for tamanho in frotas_benchmark():
+            with self.subTest(frota=tamanho):
+                self._ampliar_frota(tamanho)
+                self.assertDentroDoOrcamento('lista_calibracoes_antes_arquivo', listar)
+                self.assertDentroDoOrcamento('datas_calibracao_antes_arquivo', recalcular)
+                movidas = self.env['metrology.calibracao.arquivo']._arquivar()
+                _logger.info('Arquivamento com frota de %s: %s calibrações movidas', tamanho, movidas)
+                self.assertDentroDoOrcamento('lista_calibracoes_depois_arquivo', listar)
+                self.assertDentroDoOrcamento('datas_calibracao_depois_arquivo', recalcular)
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestSequenciaConcorrencia(MetrologyCommon):
+    """Vazão da numeração de calibrações com vários workers em conexões independentes"""
+
+    WORKERS = 8
+    REGISTROS_POR_WORKER = 500
+
+    def _vazao(self, alocar):
+        """Números alocados por segundo; cada worker desfaz sua transação ao terminar"""
+        banco = sql_db.db_connect(self.env.cr.dbname)
+        barreira = threading.Barrier(self.WORKERS + 1)
+        erros = []
+
+        def worker():
+            with banco.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                barreira.wait()
+                try:
+                    alocar(env['ir.sequence'])
+                except Exception as e:
+                    erros.append(e)
+                finally:
+                    cr.rollback()
+
+        threads = [threading.Thread(target=worker) for _i in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        barreira.wait()
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+        self.assertFalse(erros, erros)
+        return self.WORKERS * self.REGISTROS_POR_WORKER / duracao
+
+    def test_vazao(self):
+        codigo = 'metrology.calibracao'
+        por_registro = self._vazao(lambda Sequencia: [
+            Sequencia.next_by_code(codigo) for _i in range(self.REGISTROS_POR_WORKER)])
+        em_bloco = self._vazao(lambda Sequencia: Sequencia._next_block_by_code(codigo, self.REGISTROS_POR_WORKER))
+        _logger.info('Numeração com %s workers: %.0f/s por registro, %.0f/s em bloco (%.1fx)',
+                     self.WORKERS, por_registro, em_bloco, em_bloco / por_registro)
+        self.assertGreater(em_bloco, por_registro)
@@ -0,0 +1,179 @@
+from dateutil.relativedelta import relativedelta
+
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+
+from .common import MetrologyCommon, MetrologyBenchmarkCommon, frotas_benchmark
+
+CAMPOS_DASHBOARD = [
+    'total_equipamentos', 'equipamentos_conformes', 'equipamentos_vencidos',
+    'proximas_calibracoes', 'calibracoes_mes', 'taxa_conformidade',
+]
+
+
+@tagged('post_install', '-at_install')
+class TestEquipamento(MetrologyCommon):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.equipamentos = cls._criar_frota(30)
+        cls.dashboard = cls.env['metrology.dashboard'].create({})
+
+    def test_datas_e_status(self):
+        for equipamento in self.equipamentos:
+            ultima = equipamento.ultima_calibracao_id
+            self.assertEqual(equipamento.ultima_calibracao, ultima.data_calibracao)
+            self.assertEqual(equipamento.proxima_calibracao,
+                             ultima.data_calibracao + relativedelta(months=equipamento.frequencia_calibracao))
+            if equipamento.proxima_calibracao < self.hoje:
+                self.assertEqual(equipamento.status_metrologico, 'vencido')
+
+    def test_name_search_consultas(self):
+        self.assertConsultasIndependentes(
+            lambda: self.Equipamento.name_search('FROTA-00000', limit=20),
+            lambda: self._criar_frota(60))
+
+    def test_name_search_ordem(self):
+        alvo = self.equipamentos[3]
+        resultado = self.Equipamento.name_search(alvo.tag.lower())
+        self.assertEqual(resultado[0][0], alvo.id, 'O TAG exato deve vir primeiro')
+
+    def test_tag_unico_por_empresa(self):
+        filial = self.env['res.company'].create({'name': 'Planta TAG'})
+        tag = self.equipamentos[0].tag
+        vals = {'tag': ' %s ' % tag.lower(), 'nome': 'Mesmo TAG', 'tipo': 'outro', 'frequencia_calibracao': 12}
+        self.assertTrue(self.Equipamento.with_company(filial).create(dict(vals)))
+        # O índice único dispara no INSERT e é apresentado como erro de validação
+        with self.assertRaises(ValidationError):
+            self.Equipamento.create(dict(vals))
+        with self.assertRaises(ValidationError):
+            self.equipamentos[1].tag = tag
+        # O comando com erro foi desfeito: a transação continua utilizável
+        self.assertNotEqual(self.equipamentos[1].tag, tag)
+        self.assertEqual(self.Equipamento.search_count([('tag', '=', tag)]), 1)
+
+    def test_dashboard_consultas(self):
+        self.assertConsultasIndependentes(
+            lambda: self.env['metrology.dashboard'].default_get(CAMPOS_DASHBOARD),
+            lambda: self._criar_frota(60))
+
+    def test_dashboard_contadores(self):
+        valores = self.env['metrology.dashboard'].default_get(CAMPOS_DASHBOARD)
+        ativos = self.Equipamento.search([])
+        self.assertEqual(valores['total_equipamentos'], len(ativos))
+        self.assertEqual(valores['equipamentos_vencidos'],
+                         len(ativos.filtered(lambda e: e.status_metrologico == 'vencido')))
+        janela = self.Equipamento._janela_alerta_dias()
+        self.assertEqual(valores['proximas_calibracoes'], len(ativos.filtered(
+            lambda e: e.proxima_calibracao and 0 <= e.dias_para_vencimento <= janela)))
+        self.assertEqual(self.dashboard.get_report_data()['janela_alerta_dias'], janela)
+
+        # Os gatilhos aplicam somente as mudanças de mês, status ou dimensão; nada a reconciliar
+        ativos[:5].write({'observacoes': 'Sem efeito nos contadores'})
+        ativos[5:10].write({'centro_custo': 'CC-NOVO'})
+        ativos[10:15].write({'frequencia_calibracao': 3})
+        ativos[15:17].write({'active': False})
+        self.env.flush_all()
+        self.assertEqual(self.env['metrology.dashboard.kpi']._reconciliar(), 0)
+
+    def test_relatorio_consultas(self):
+        self.assertConsultasIndependentes(
+            lambda: self.dashboard.get_report_data(),
+            lambda: self._criar_frota(60))
+
+    def test_alertas_uma_vez(self):
+        Alerta = self.env['metrology.calibracoes.alert']
+        Atividade = self.env['mail.activity']
+        tipo = self.env.ref('metrology_management.mail_activity_calibration_alert')
+        dominio = [('res_model', '=', 'metrology.equipamento'), ('activity_type_id', '=', tipo.id)]
+        Alerta._send_calibration_alerts()
+        atividades = Atividade.search_count(dominio)
+        proximos = self.Equipamento.search_count([
+            ('proxima_calibracao', '>=', self.hoje),
+            ('dias_para_vencimento', '<=', self.Equipamento._janela_alerta_dias()),
+        ])
+        self.assertEqual(atividades, proximos)
+        vencidos = self.Equipamento.search([('status_metrologico', '=', 'vencido')])
+        self.assertTrue(all(e.alerta_status == 'vencido' for e in vencidos))
+
+        # Segunda execução não repete atividades nem mensagens
+        mensagens = self.env['mail.message'].search_count([('model', '=', 'metrology.equipamento')])
+        Alerta._send_calibration_alerts()
+        self.assertEqual(Atividade.search_count(dominio), atividades)
+        self.assertEqual(self.env['mail.message'].search_count([('model', '=', 'metrology.equipamento')]),
+                         mensagens)
+
+    def test_multiempresa(self):
+        filial = self.env['res.company'].create({'name': 'Planta Filial'})
+        self.assertTrue(filial.metrology_cron_rollover_id.active)
+        self.assertIn('with_company(%d)' % filial.id, filial.metrology_cron_alertas_id.code)
+
+        equipamento = self.Equipamento.with_company(filial).create({
+            'tag': 'FILIAL-001', 'nome': 'Instrumento da filial', 'tipo': 'outro', 'frequencia_calibracao': 1})
+        self.Calibracao.with_company(filial).create({
+            'equipamento_id': equipamento.id,
+            'data_calibracao': self.hoje - relativedelta(months=3),
+            'numero_certificado': 'CERT-FILIAL',
+            'state': 'aprovado',
+        })
+        self.assertEqual(equipamento.company_id, filial)
+        self.assertEqual(equipamento.calibracao_ids.company_id, filial)
+
+        # Usuário da matriz não enxerga a filial, nem nos indicadores
+        usuario = self.env['res.users'].with_context(no_reset_password=True).create({
+            'name': 'Técnico Matriz', 'login': 'tecnico_matriz',
+            'company_id': self.env.company.id, 'company_ids': [(6, 0, self.env.company.ids)],
+            'groups_id': [(6, 0, self.env.ref('metrology_management.group_metrology_user').ids)],
+        })
+        self.assertFalse(self.Equipamento.with_user(usuario).search([('tag', '=', 'FILIAL-001')]))
+        matriz = self.env['metrology.dashboard'].with_user(usuario)._get_kpi_snapshot()
+        ambas = self.env['metrology.dashboard'].with_context(
+            allowed_company_ids=(self.env.company | filial).ids)._get_kpi_snapshot()
+        self.assertEqual(ambas['total_equipamentos'], matriz['total_equipamentos'] + 1)
+
+        # O agendador da matriz não vira o status nem alerta os equipamentos da filial
+        self.env['metrology.calibracoes.alert']._send_calibration_alerts()
+        self.assertFalse(equipamento.alerta_status)
+        self.env['metrology.calibracoes.alert'].with_company(filial)._send_calibration_alerts()
+        self.assertEqual(equipamento.status_metrologico, 'vencido')
+        self.assertEqual(equipamento.alerta_status, 'vencido')
+
+        # Eventos de status também são separados por empresa
+        Evento = self.env['metrology.status.evento']
+        self.assertEqual(Evento.search([('equipamento_id', '=', equipamento.id)]).company_id, filial)
+        self.assertFalse(Evento.with_user(usuario).search([('equipamento_id', '=', equipamento.id)]))
+
+        # Excluir a empresa remove as cópias dos agendadores
+        temporaria = self.env['res.company'].create({'name': 'Planta Temporária'})
+        agendadores = temporaria.metrology_cron_rollover_id | temporaria.metrology_cron_alertas_id
+        temporaria.unlink()
+        self.assertFalse(agendadores.exists())
+
+    def test_perfilamento(self):
+        self.env['ir.config_parameter'].sudo().set_param('metrology_management.perfilamento', '1')
+        with self.assertLogs('odoo.addons.metrology_management.tools.perfil', 'INFO') as logs:
+            self.Equipamento.name_search('FROTA')
+        self.assertIn('consultas', logs.output[0])
+
+
+@tagged('-standard', 'metrology_benchmark')
+class TestEquipamentoDesempenho(MetrologyBenchmarkCommon):
+
+    def test_desempenho(self):
+        Alerta = self.env['metrology.calibracoes.alert']
+        Dashboard = self.env['metrology.dashboard']
+        for tamanho in frotas_benchmark():
+            with self.subTest(frota=tamanho):
+                self._ampliar_frota(tamanho)
+                dashboard = Dashboard.search([], limit=1) or Dashboard.create({})
+                self.assertDentroDoOrcamento('dashboard', lambda: Dashboard.default_get(CAMPOS_DASHBOARD))
+                self.assertDentroDoOrcamento('relatorio', lambda: dashboard.get_report_data())
+                self.assertDentroDoOrcamento('name_search', lambda: self.Equipamento.name_search('FROTA-0001'))
+                self.assertDentroDoOrcamento('alertas', lambda: Alerta._send_calibration_alerts())
+                tamanho_lote = max(tamanho // 100, 10)
+                self.assertDentroDoOrcamento('criacao_lote', lambda: self.Equipamento.create([{
+                    'tag': 'LOTE-%s-%05d' % (tamanho, indice),
+                    'nome': 'Instrumento em lote %d' % indice,
+                    'tipo': 'outro',
+                } for indice in range(tamanho_lote)]))
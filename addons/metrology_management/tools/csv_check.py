@@ -0,0 +1,33 @@
+"""Validação de colunas de arquivos CSV.
+
+Módulo sem dependências do Odoo: usado pelo script check_csvs.py na raiz do
+repositório e pela importação em lote de calibrações.
+"""
+import csv
+
+
+def detect_dialect(sample):
+    """Detecta o dialeto do CSV a partir de uma amostra, com 'excel' como padrão."""
+    try:
+        return csv.Sniffer().sniff(sample)
+    except csv.Error:
+        return 'excel'  # Default to standard CSV
+
+
+def check_row(header, row):
+    """Compara uma linha com o cabeçalho.
+
+    Retorna uma tupla (erros, colunas_vazias): número de colunas diferente do
+    cabeçalho é erro; colunas_vazias lista os índices dos campos vazios ou só com
+    espaços, que são apenas avisos.
+    """
+    expected_columns = len(header)
+    actual_columns = len(row)
+    if actual_columns != expected_columns:
+        return [f"has {actual_columns} columns (expected {expected_columns})"], []
+
+    empty_columns = [
+        col_num for col_num, field in enumerate(row)
+        if field is None or not str(field).strip()
+    ]
+    return [], empty_columns
@@ -0,0 +1,66 @@
+"""Instrumentação dos pontos críticos do módulo.
+
+Mede consultas SQL, tempo e pico de memória de um trecho de código. O decorador
+perfilar só coleta as medidas quando o parâmetro de sistema
+metrology_management.perfilamento está ativo ('1' mede consultas e tempo,
+'memoria' também mede o pico de memória), portanto pode permanecer nos métodos em
+produção; os testes de desempenho usam medir diretamente.
+"""
+import functools
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+PARAMETRO_PERFILAMENTO = 'metrology_management.perfilamento'
+_DESATIVADO = ('', '0', 'false', 'False')
+
+
+@contextmanager
+def medir(cr, memoria=False):
+    """Mede o bloco: produz um dicionário preenchido com consultas, tempo (s) e memoria_pico (bytes)."""
+    medicao = {'consultas': 0, 'tempo': 0.0, 'memoria_pico': 0}
+    iniciou_rastreio = memoria and not tracemalloc.is_tracing()
+    if iniciou_rastreio:
+        tracemalloc.start()
+    elif memoria:
+        tracemalloc.reset_peak()
+    consultas = cr.sql_log_count
+    inicio = time.perf_counter()
+    try:
+        yield medicao
+    finally:
+        medicao['tempo'] = time.perf_counter() - inicio
+        medicao['consultas'] = cr.sql_log_count - consultas
+        if memoria:
+            medicao['memoria_pico'] = tracemalloc.get_traced_memory()[1]
+            if iniciou_rastreio:
+                tracemalloc.stop()
+
+
+def _modo_perfilamento(env):
+    # get_param usa o cache do registro: nenhuma consulta extra depois da primeira chamada
+    modo = env['ir.config_parameter'].sudo().get_param(PARAMETRO_PERFILAMENTO, '')
+    return None if modo in _DESATIVADO else modo
+
+
+def perfilar(nome=None):
+    """Registra no log as medidas de cada chamada do método quando o perfilamento está ativo"""
+    def decorador(metodo):
+        rotulo = nome or metodo.__qualname__
+
+        @functools.wraps(metodo)
+        def envoltorio(self, *args, **kwargs):
+            modo = _modo_perfilamento(self.env)
+            if not modo:
+                return metodo(self, *args, **kwargs)
+            with medir(self.env.cr, memoria=modo == 'memoria') as medicao:
+                resultado = metodo(self, *args, **kwargs)
+            _logger.info('%s: %s registros, %s consultas, %.1f ms, pico de memória %.1f KiB',
+                         rotulo, len(self), medicao['consultas'], medicao['tempo'] * 1000,
+                         medicao['memoria_pico'] / 1024)
+            return resultado
+        return envoltorio
+    return decorador
@@ -0,0 +1,2 @@
+from . import calibracao_import
+from . import reintervalo
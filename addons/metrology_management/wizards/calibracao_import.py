@@ -0,0 +1,282 @@
+import base64
+import csv
+import io
+import logging
+from datetime import date, datetime
+
+import psycopg2
+
+from odoo import models, fields, api
+from odoo.exceptions import UserError, ValidationError
+from odoo.tools import SQL, split_every
+
+from ..tools.csv_check import check_row, detect_dialect
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Colunas aceitas no arquivo; as obrigatórias precisam existir no cabeçalho e estar preenchidas
+COLUNAS_OBRIGATORIAS = ('tag', 'data_calibracao')
+# Sem a coluna resultado, o resultado é calculado pela regra de decisão do equipamento
+COLUNAS_OPCIONAIS = (
+    'resultado', 'tipo_comprovacao', 'numero_certificado', 'tecnico_responsavel',
+    'incerteza_expandida', 'erro_encontrado', 'temperatura', 'umidade', 'pressao',
+    'ajuste_realizado', 'observacoes', 'restricoes_uso',
+)
+COLUNAS_NUMERICAS = ('incerteza_expandida', 'erro_encontrado', 'temperatura', 'umidade', 'pressao')
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y')
+
+# Limite de erros detalhados guardados no log do assistente
+MAX_ERROS_LOG = 1000
+
+
+class CalibracaoImport(models.TransientModel):
+    _name = 'metrology.calibracao.import'
+    _description = 'Importação em Lote de Calibrações'
+
+    arquivo = fields.Binary(string='Arquivo (CSV ou XLSX)', required=True)
+    nome_arquivo = fields.Char(string='Nome do Arquivo')
+    tamanho_lote = fields.Integer(string='Registros por Lote', default=500)
+    state = fields.Selection([
+        ('rascunho', 'Rascunho'),
+        ('concluido', 'Concluído'),
+    ], string='Status', default='rascunho')
+    total_linhas = fields.Integer(string='Linhas Processadas', readonly=True)
+    total_importadas = fields.Integer(string='Calibrações Importadas', readonly=True)
+    total_erros = fields.Integer(string='Linhas com Erro', readonly=True)
+    log = fields.Text(string='Erros', readonly=True)
+
+    def action_importar(self):
+        """Importa o arquivo em lotes e apresenta o resumo da importação"""
+        self.ensure_one()
+        with self._abrir_arquivo() as conteudo:
+            if (self.nome_arquivo or '').lower().endswith('.xlsx'):
+                cabecalho, linhas = self._ler_xlsx(conteudo)
+            else:
+                cabecalho, linhas = self._ler_csv(conteudo)
+            resultado = self._importar_linhas(cabecalho, linhas, tamanho_lote=self.tamanho_lote or 500)
+
+        erros = resultado['erros']
+        log = '\n'.join('Linha %s: %s' % erro for erro in erros[:MAX_ERROS_LOG])
+        if len(erros) > MAX_ERROS_LOG:
+            log += '\n... e mais %s linhas com erro.' % (len(erros) - MAX_ERROS_LOG)
+        self.write({
+            'state': 'concluido',
+            'total_linhas': resultado['total'],
+            'total_importadas': len(resultado['calibracao_ids']),
+            'total_erros': len(erros),
+            'log': log,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    def _abrir_arquivo(self):
+        """Abre o arquivo enviado para leitura em blocos.
+
+        O conteúdo é lido direto do anexo no filestore, já decodificado, em vez de
+        decodificar o base64 do campo inteiro em memória.
+        """
+        anexo = self.env['ir.attachment'].sudo().search([
+            ('res_model', '=', self._name),
+            ('res_field', '=', 'arquivo'),
+            ('res_id', '=', self.id),
+        ], limit=1)
+        if anexo.store_fname:
+            return open(anexo._full_path(anexo.store_fname), 'rb')
+        if anexo:
+            return io.BytesIO(anexo.raw)
+        return io.BytesIO(base64.b64decode(self.arquivo or b''))
+
+    @api.model
+    def _ler_csv(self, conteudo):
+        """Retorna o cabeçalho e um iterador sobre as linhas do CSV, sem carregar todas em memória.
+
+        conteudo é um arquivo binário posicionável (ou os bytes do arquivo).
+        """
+        if isinstance(conteudo, bytes):
+            conteudo = io.BytesIO(conteudo)
+        texto = io.TextIOWrapper(conteudo, encoding='utf-8-sig', newline='')
+        dialect = detect_dialect(texto.read(1024))
+        texto.seek(0)
+        reader = csv.reader(texto, dialect)
+        try:
+            cabecalho = next(reader)
+        except StopIteration:
+            raise UserError('O arquivo está vazio.')
+        return cabecalho, reader
+
+    @api.model
+    def _ler_xlsx(self, conteudo):
+        """Retorna o cabeçalho e um iterador sobre as linhas da primeira planilha (modo somente leitura)"""
+        if openpyxl is None:
+            raise UserError('A biblioteca openpyxl é necessária para importar arquivos XLSX.')
+        if isinstance(conteudo, bytes):
+            conteudo = io.BytesIO(conteudo)
+        planilha = openpyxl.load_workbook(conteudo, read_only=True, data_only=True).active
+        linhas = planilha.iter_rows(values_only=True)
+        try:
+            cabecalho = [str(valor or '') for valor in next(linhas)]
+        except StopIteration:
+            raise UserError('O arquivo está vazio.')
+        # Planilhas podem omitir células vazias no fim da linha
+        largura = len(cabecalho)
+        return cabecalho, (tuple(linha[:largura]) + (None,) * (largura - len(linha)) for linha in linhas)
+
+    @api.model
+    def _importar_linhas(self, cabecalho, linhas, tamanho_lote=500):
+        """Cria calibrações a partir de linhas já lidas de um arquivo.
+
+        Pode ser usado diretamente por integrações. As linhas são consumidas em lotes;
+        cada lote é criado com um único create(vals_list), sem rastreamento, e os
+        campos calculados dos equipamentos afetados são recalculados uma vez por lote.
+        Linhas inválidas são reportadas sem interromper a importação.
+
+        Retorna {'total': int, 'calibracao_ids': [int], 'erros': [(linha, mensagem)]}
+        """
+        cabecalho = [(coluna or '').strip().lower() for coluna in cabecalho]
+        faltantes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in cabecalho]
+        if faltantes:
+            raise UserError('Colunas obrigatórias ausentes no arquivo: %s' % ', '.join(faltantes))
+
+        equipamentos_por_tag = self._mapear_equipamentos_por_tag()
+        resultado = {'total': 0, 'calibracao_ids': [], 'erros': []}
+        for lote in split_every(tamanho_lote, enumerate(linhas, start=2)):
+            vals_por_linha = []
+            for num_linha, linha in lote:
+                resultado['total'] += 1
+                try:
+                    vals_por_linha.append((num_linha, self._preparar_valores(cabecalho, linha, equipamentos_por_tag)))
+                except ValidationError as e:
+                    resultado['erros'].append((num_linha, e.args[0]))
+            if vals_por_linha:
+                self._criar_lote(vals_por_linha, resultado)
+        return resultado
+
+    @api.model
+    def _mapear_equipamentos_por_tag(self):
+        """Carrega o mapa TAG normalizado -> id dos equipamentos ativos em uma única consulta.
+
+        Considera apenas as empresas selecionadas e as regras de acesso do usuário; o TAG
+        só é único por empresa, e a empresa ativa prevalece quando se repete entre elas.
+        """
+        Equipamento = self.env['metrology.equipamento']
+        Equipamento.flush_model(['tag', 'active', 'company_id'])
+        query = Equipamento._search([('company_id', 'in', self.env.companies.ids)])
+        tabela = Equipamento._table
+        self.env.cr.execute(query.select(
+            SQL('upper(btrim(%s))', SQL.identifier(tabela, 'tag')),
+            SQL.identifier(tabela, 'id'),
+            SQL('%s = %s', SQL.identifier(tabela, 'company_id'), self.env.company.id),
+        ))
+        mapa = {}
+        for tag, equipamento_id, empresa_ativa in self.env.cr.fetchall():
+            if empresa_ativa or tag not in mapa:
+                mapa[tag] = equipamento_id
+        return mapa
+
+    @api.model
+    def _preparar_valores(self, cabecalho, linha, equipamentos_por_tag):
+        """Valida uma linha e converte para os valores de metrology.calibracao"""
+        erros, _colunas_vazias = check_row(cabecalho, linha)
+        if erros:
+            raise ValidationError('Linha com %s colunas (esperado %s).' % (len(linha), len(cabecalho)))
+        dados = {
+            coluna: (valor.strip() if isinstance(valor, str) else valor)
+            for coluna, valor in zip(cabecalho, linha)
+            if coluna in COLUNAS_OBRIGATORIAS or coluna in COLUNAS_OPCIONAIS
+        }
+        vazias = [coluna for coluna in COLUNAS_OBRIGATORIAS if dados.get(coluna) in (None, '')]
+        if vazias:
+            raise ValidationError('Campos obrigatórios vazios: %s' % ', '.join(vazias))
+
+        Calib = self.env['metrology.calibracao']
+        equipamento_id = equipamentos_por_tag.get(str(dados['tag']).strip().upper())
+        if not equipamento_id:
+            raise ValidationError('Equipamento com TAG %s não encontrado.' % dados['tag'])
+
+        vals = {
+            'equipamento_id': equipamento_id,
+            'data_calibracao': self._converter_data(dados['data_calibracao']),
+        }
+        if dados.get('resultado') not in (None, ''):
+            vals['resultado'] = self._converter_selecao(Calib, 'resultado', dados['resultado'])
+        if dados.get('tipo_comprovacao') not in (None, ''):
+            vals['tipo_comprovacao'] = self._converter_selecao(Calib, 'tipo_comprovacao', dados['tipo_comprovacao'])
+        for coluna in COLUNAS_NUMERICAS:
+            if dados.get(coluna) not in (None, ''):
+                vals[coluna] = self._converter_numero(coluna, dados[coluna])
+        if dados.get('ajuste_realizado') not in (None, ''):
+            vals['ajuste_realizado'] = str(dados['ajuste_realizado']).strip().lower() in ('1', 'true', 'sim', 's', 'x')
+        for coluna in ('numero_certificado', 'tecnico_responsavel', 'observacoes', 'restricoes_uso'):
+            if dados.get(coluna) not in (None, ''):
+                vals[coluna] = str(dados[coluna])
+        return vals
+
+    @api.model
+    def _converter_data(self, valor):
+        if isinstance(valor, datetime):
+            return valor.date()
+        if isinstance(valor, date):
+            return valor
+        for formato in FORMATOS_DATA:
+            try:
+                return datetime.strptime(str(valor), formato).date()
+            except ValueError:
+                continue
+        raise ValidationError('Data da calibração inválida: %s' % valor)
+
+    @api.model
+    def _converter_numero(self, coluna, valor):
+        if isinstance(valor, (int, float)):
+            return float(valor)
+        try:
+            return float(str(valor).replace(',', '.'))
+        except ValueError:
+            raise ValidationError('Valor numérico inválido em %s: %s' % (coluna, valor))
+
+    @api.model
+    def _converter_selecao(self, model, campo, valor):
+        """Aceita tanto a chave quanto o rótulo da opção, sem diferenciar maiúsculas"""
+        valor = str(valor).strip().lower()
+        for chave, rotulo in model._fields[campo].selection:
+            if valor in (chave.lower(), rotulo.lower()):
+                return chave
+        raise ValidationError('Valor inválido em %s: %s' % (campo, valor))
+
+    @api.model
+    def _criar_lote(self, vals_por_linha, resultado):
+        """Cria o lote de uma vez; se falhar, isola as linhas com erro criando-as individualmente"""
+        Calib = self.env['metrology.calibracao'].with_context(
+            tracking_disable=True,
+            mail_create_nolog=True,
+            mail_create_nosubscribe=True,
+            mail_notrack=True,
+        )
+        try:
+            with self.env.cr.savepoint():
+                calibracoes = Calib.create([vals for _num_linha, vals in vals_por_linha])
+                # Recalcula validade e os campos dos equipamentos afetados uma única vez por lote
+                self.env.flush_all()
+            resultado['calibracao_ids'].extend(calibracoes.ids)
+            return
+        except (ValidationError, UserError, psycopg2.IntegrityError):
+            _logger.info('Lote de importação com erro; reprocessando linha a linha', exc_info=True)
+
+        for num_linha, vals in vals_por_linha:
+            try:
+                with self.env.cr.savepoint():
+                    calibracao = Calib.create(vals)
+                    self.env.flush_all()
+                resultado['calibracao_ids'].append(calibracao.id)
+            except (ValidationError, UserError, psycopg2.IntegrityError) as e:
+                mensagem = e.args[0] if isinstance(e, UserError) else str(e)
+                resultado['erros'].append((num_linha, mensagem))
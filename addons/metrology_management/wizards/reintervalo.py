@@ -0,0 +1,43 @@
+from odoo import models, fields, api, Command
+from odoo.exceptions import UserError
+
+
+class ReintervaloWizard(models.TransientModel):
+    _name = 'metrology.reintervalo.wizard'
+    _description = 'Alteração em Lote da Frequência de Calibração'
+
+    tipo = fields.Selection(
+        selection=lambda self: self.env['metrology.equipamento']._fields['tipo'].selection,
+        string='Família (Tipo)',
+        help='Quando informado e nenhum equipamento for selecionado, aplica a todos os equipamentos deste tipo.')
+    equipamento_ids = fields.Many2many('metrology.equipamento', string='Equipamentos')
+    frequencia_calibracao = fields.Integer(string='Nova Frequência (meses)', required=True, default=12)
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'metrology.equipamento' and self.env.context.get('active_ids'):
+            res['equipamento_ids'] = [Command.set(self.env.context['active_ids'])]
+        return res
+
+    def action_aplicar(self):
+        """Aplica a nova frequência a todos os equipamentos selecionados em uma única operação"""
+        self.ensure_one()
+        if self.frequencia_calibracao <= 0:
+            raise UserError('A frequência de calibração deve ser maior que zero.')
+        equipamentos = self.equipamento_ids
+        if not equipamentos and self.tipo:
+            equipamentos = self.env['metrology.equipamento'].search([('tipo', '=', self.tipo)])
+        if not equipamentos:
+            raise UserError('Selecione os equipamentos ou a família a ser alterada.')
+        equipamentos._aplicar_frequencia_calibracao(self.frequencia_calibracao)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'type': 'success',
+                'message': 'Frequência de %s equipamentos alterada para %s meses.' % (
+                    len(equipamentos), self.frequencia_calibracao),
+                'next': {'type': 'ir.actions.act_window_close'},
+            },
+        }
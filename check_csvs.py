@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
 import csv
+import importlib.util
 import os
 import sys
 from pathlib import Path
 
+
+def load_csv_check():
+    """Load the module's CSV validation (shared with the calibration import) by file path.
+
+    Importing it through the addon package would run the package __init__, which needs Odoo.
+    """
+    path = Path(__file__).resolve().parent / 'addons' / 'metrology_management' / 'tools' / 'csv_check.py'
+    spec = importlib.util.spec_from_file_location('metrology_csv_check', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+csv_check = load_csv_check()
+check_row, detect_dialect = csv_check.check_row, csv_check.detect_dialect
+
 def check_csv_file(file_path):
     """Check if all rows in a CSV file have the same number of columns as the header."""
     try:
@@ -13,10 +30,7 @@ def check_csv_file(file_path):
             f.seek(0)
             
             # Try to detect the dialect
-            try:
-                dialect = csv.Sniffer().sniff(sample)
-            except csv.Error:
-                dialect = 'excel'  # Default to standard CSV
+            dialect = detect_dialect(sample)
             
             reader = csv.reader(f, dialect)
             
@@ -29,16 +43,16 @@ def check_csv_file(file_path):
                 print(f"Header has {expected_columns} columns: {', '.join(header)}")
                 
                 for line_num, row in enumerate(reader, start=2):
-                    actual_columns = len(row)
-                    if actual_columns != expected_columns:
-                        print(f"ERROR: Line {line_num} has {actual_columns} columns (expected {expected_columns})")
+                    errors, empty_columns = check_row(header, row)
+                    if errors:
+                        for error in errors:
+                            print(f"ERROR: Line {line_num} {error}")
                         print(f"Line content: {row}")
                         return False
                     
                     # Check for empty or whitespace-only fields
-                    for col_num, field in enumerate(row):
-                        if not field.strip():
-                            print(f"WARNING: Empty field at line {line_num}, column {col_num + 1} (header: {header[col_num]})")
+                    for col_num in empty_columns:
+                        print(f"WARNING: Empty field at line {line_num}, column {col_num + 1} (header: {header[col_num]})")
                 
                 print("✓ All rows have correct number of columns")
                 return True
@@ -81,4 +95,4 @@ def main():
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()